@@ -0,0 +1,183 @@
+"""Escrituras atómicas y bloqueos entre procesos para los archivos de datos.
+
+El servidor web y las aplicaciones Tk (comparador, inventario_gui) trabajan sobre
+los mismos archivos (local.txt, bodegac.txt, registro_ventas.csv, ...). Este módulo
+reúne las dos piezas que todos deben usar al escribirlos:
+
+- abrir_atomico(ruta): se escribe en un temporal de la misma carpeta, se hace fsync
+  y se reemplaza el original con os.replace. Si el proceso muere a mitad de la
+  escritura el archivo original queda intacto.
+- bloqueo_archivo(ruta): bloqueo exclusivo sobre "<ruta>.lock" (fcntl en Linux/Mac,
+  msvcrt en Windows), reentrante dentro del mismo hilo, para que dos programas no
+  intercalen sus lecturas y escrituras del mismo archivo.
+"""
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def _clave(ruta):
+    return os.path.normcase(os.path.abspath(ruta))
+
+
+def _sincronizar_carpeta(carpeta):
+    # En Windows no se puede abrir una carpeta para fsync; el reemplazo ya es durable
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(carpeta, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def abrir_atomico(ruta, modo="w", encoding="utf-8", newline=None):
+    """Abre un temporal para escribir `ruta`; al salir sin error reemplaza el original."""
+    carpeta = os.path.dirname(os.path.abspath(ruta))
+    fd, temporal = tempfile.mkstemp(prefix=f".{os.path.basename(ruta)}.", suffix=".tmp", dir=carpeta)
+    try:
+        if "b" in modo:
+            f = os.fdopen(fd, modo)
+        else:
+            f = os.fdopen(fd, modo, encoding=encoding, newline=newline)
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # Conservar los permisos del archivo original (mkstemp crea con 0600)
+        try:
+            os.chmod(temporal, stat.S_IMODE(os.stat(ruta).st_mode))
+        except OSError:
+            pass
+        os.replace(temporal, ruta)
+    except BaseException:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+    _sincronizar_carpeta(carpeta)
+
+
+def escribir_lineas(ruta, lineas, encoding="utf-8"):
+    """Reemplaza atómicamente el contenido de `ruta` con las líneas dadas."""
+    with abrir_atomico(ruta, encoding=encoding) as f:
+        f.writelines(lineas)
+
+
+class BloqueoArchivo:
+    """Bloqueo reentrante que combina un RLock (hilos) y un lock de archivo (procesos)."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.ruta_lock = f"{ruta}.lock"
+        self._rlock = threading.RLock()
+        self._nivel = 0
+        self._fd = None
+
+    def acquire(self):
+        self._rlock.acquire()
+        self._nivel += 1
+        if self._nivel == 1:
+            try:
+                self._bloquear_archivo()
+            except BaseException:
+                self._nivel -= 1
+                self._rlock.release()
+                raise
+        return True
+
+    def release(self):
+        self._nivel -= 1
+        if self._nivel == 0:
+            self._desbloquear_archivo()
+        self._rlock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _bloquear_archivo(self):
+        try:
+            fd = os.open(self.ruta_lock, os.O_RDWR | os.O_CREAT, 0o666)
+        except OSError:
+            # Carpeta de solo lectura: queda solo la exclusión entre hilos
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK se rinde tras ~10 s; seguimos esperando
+                        time.sleep(0.1)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def _desbloquear_archivo(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+
+_bloqueos = {}
+_bloqueos_guard = threading.Lock()
+
+
+def obtener_bloqueo(ruta):
+    """Devuelve el BloqueoArchivo compartido por todo el proceso para `ruta`."""
+    clave = _clave(ruta)
+    with _bloqueos_guard:
+        bloqueo = _bloqueos.get(clave)
+        if bloqueo is None:
+            bloqueo = BloqueoArchivo(clave)
+            _bloqueos[clave] = bloqueo
+        return bloqueo
+
+
+@contextmanager
+def bloqueo_archivo(*rutas):
+    """Bloquea uno o varios archivos (siempre en el mismo orden para evitar bloqueos mutuos)."""
+    bloqueos = [obtener_bloqueo(r) for r in sorted({_clave(r) for r in rutas if r})]
+    adquiridos = []
+    try:
+        for bloqueo in bloqueos:
+            bloqueo.acquire()
+            adquiridos.append(bloqueo)
+        yield
+    finally:
+        for bloqueo in reversed(adquiridos):
+            bloqueo.release()
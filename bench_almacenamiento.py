@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from almacenamiento import abrir_atomico, bloqueo_archivo
+
+# Compara el costo por venta de las distintas formas de persistir el stock:
+#   1. antiguo: leer el archivo y reescribirlo con open("w") (sin fsync, se trunca si se corta)
+#   2. atómico: leer y reescribir con temporal + fsync + os.replace (almacenamiento.py)
+#   3. diario:  una línea con fsync en <archivo>.diario (DiarioStock de servidor.py),
+#               con la compactación atómica periódica incluida en el tiempo total
+# Uso: python bench_almacenamiento.py [archivo_stock] [operaciones]
+
+ARCHIVO_ORIGEN = sys.argv[1] if len(sys.argv) > 1 else "local_2.txt"
+OPERACIONES = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+
+def generar_stock(ruta, productos=3000):
+    with open(ruta, "w", encoding="utf-8") as f:
+        for i in range(productos):
+            f.write(f"    Producto de prueba {i:05d} 1000\n")
+
+
+def leer_lineas(ruta):
+    with open(ruta, "r", encoding="utf-8") as f:
+        return f.readlines()
+
+
+def descontar(lineas, idx):
+    desc, qty = lineas[idx].strip().rsplit(" ", 1)
+    lineas[idx] = f"    {desc} {int(qty) - 1}\n"
+
+
+def bench_antiguo(ruta, n):
+    inicio = time.perf_counter()
+    for i in range(n):
+        lineas = leer_lineas(ruta)
+        descontar(lineas, i % len(lineas))
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.writelines(lineas)
+    return time.perf_counter() - inicio
+
+
+def bench_atomico(ruta, n):
+    inicio = time.perf_counter()
+    for i in range(n):
+        with bloqueo_archivo(ruta):
+            lineas = leer_lineas(ruta)
+            descontar(lineas, i % len(lineas))
+            with abrir_atomico(ruta, encoding="utf-8") as f:
+                f.writelines(lineas)
+    return time.perf_counter() - inicio
+
+
+def bench_diario(ruta, n):
+    from servidor import DiarioStock
+    diario = DiarioStock(ruta)
+    descripciones = sorted(diario.vista())
+    inicio = time.perf_counter()
+    for i in range(n):
+        desc = descripciones[i % len(descripciones)]
+        with diario.bloqueo():
+            diario.registrar({desc: -1})
+    diario.compactar()
+    return time.perf_counter() - inicio
+
+
+def main():
+    print("=== BENCHMARK DE ESCRITURA DE STOCK ===")
+    carpeta = tempfile.mkdtemp(prefix="bench_almacenamiento_")
+    try:
+        base = os.path.join(carpeta, "base.txt")
+        if os.path.exists(ARCHIVO_ORIGEN):
+            shutil.copy(ARCHIVO_ORIGEN, base)
+            print(f"Archivo: {ARCHIVO_ORIGEN} ({len(leer_lineas(base))} líneas)")
+        else:
+            generar_stock(base)
+            print(f"Archivo sintético de {len(leer_lineas(base))} líneas ({ARCHIVO_ORIGEN} no existe)")
+        print(f"Operaciones por prueba: {OPERACIONES}\n")
+
+        resultados = []
+        for nombre, funcion in [("antiguo (open 'w')", bench_antiguo),
+                                ("atómico (tmp+fsync+replace)", bench_atomico),
+                                ("diario (append+fsync)", bench_diario)]:
+            ruta = os.path.join(carpeta, "stock.txt")
+            shutil.copy(base, ruta)
+            if os.path.exists(ruta + ".diario"):
+                os.remove(ruta + ".diario")
+            total = funcion(ruta, OPERACIONES)
+            resultados.append((nombre, total))
+
+        referencia = resultados[0][1]
+        for nombre, total in resultados:
+            por_op = total / OPERACIONES * 1000
+            print(f"{nombre:<30} {total:8.3f} s  {por_op:8.3f} ms/op  x{referencia / total:5.2f}")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
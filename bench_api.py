@@ -0,0 +1,418 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from datetime import datetime, timedelta
+
+# Prueba de carga de la API del POS contra un directorio de datos sintético.
+#   1. Genera los archivos de stock, costos, precios, clientes y un registro de ventas
+#      con N años de historia en una carpeta temporal.
+#   2. Inicia una copia de servidor.py en esa carpeta (puerto de prueba).
+#   3. Varios clientes concurrentes mezclan /api/productos, /api/ventas,
+#      /api/caja/status y /api/reportes durante el tiempo indicado.
+#   4. Informa peticiones/s y percentiles de latencia por operación. Con --guardar se
+#      escribe el resultado en JSON y con --comparar se compara contra uno anterior
+#      (código de salida 1 si hay regresión).
+# Uso: python bench_api.py [--skus 7500] [--anios 2] [--tiendas 3] [--clientes 8] [--duracion 20]
+
+DIR_REPO = os.path.dirname(os.path.abspath(__file__))
+ARCHIVOS_STOCK = ["local.txt", "local_2.txt", "bodegac.txt"]  # Las ubicaciones que maneja servidor.py
+MEDIOS_PAGO = ["Efectivo", "Nequi", "Daviplata", "Tarjeta"]
+MEZCLA_DEFECTO = "productos=15,ventas=35,caja=35,reportes=15"
+
+CATEGORIAS = ["Cargador", "Cable", "Forro", "Vidrio", "Audífonos", "Adaptador", "Memoria", "Parlante", "Batería", "Soporte"]
+MARCAS = ["Samsung", "Xiaomi", "Motorola", "Infinix", "Tecno", "Apple", "Huawei", "Oppo", "Realme", "Genérico"]
+VARIANTES = ["Negro", "Blanco", "Azul", "Rojo", "Tipo C", "Micro USB", "Lightning", "3.5", "V8", "Pro"]
+
+
+def generar_datos(carpeta, skus, anios, tiendas, ventas_dia, semilla):
+    rnd = random.Random(semilla)
+    descripciones = []
+    vistos = set()
+    i = 0
+    while len(descripciones) < skus:
+        desc = f"{rnd.choice(CATEGORIAS)} {rnd.choice(MARCAS)} {rnd.choice(VARIANTES)} {i:05d}"
+        i += 1
+        if desc not in vistos:
+            vistos.add(desc)
+            descripciones.append(desc)
+    descripciones.sort()
+
+    costos = {d: rnd.randint(2, 60) * 500 for d in descripciones}
+    with open(os.path.join(carpeta, "dbcst.txt"), "w", encoding="utf-8") as f:
+        for d in descripciones:
+            f.write(f"    {d} {costos[d]}\n")
+    with open(os.path.join(carpeta, "dbacc.txt"), "w", encoding="utf-8") as f:
+        for d in descripciones:
+            f.write(f"    {d} {costos[d] * 2}\n")
+
+    # Stock alto para que las ventas de la prueba no se queden sin existencias
+    for archivo in ARCHIVOS_STOCK[:tiendas]:
+        with open(os.path.join(carpeta, archivo), "w", encoding="utf-8") as f:
+            for d in descripciones:
+                f.write(f"    {d} {rnd.randint(1000, 100000)}\n")
+
+    with open(os.path.join(carpeta, "clientes.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nombre", "Contacto"])
+        for n in range(300):
+            writer.writerow([f"Cliente {n:03d}", f"3{rnd.randint(100000000, 199999999)}"])
+
+    hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    dia = hoy - timedelta(days=int(anios * 365))
+    lineas = 0
+    with open(os.path.join(carpeta, "registro_ventas.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "Timestamp", "ID_Venta", "Descripcion", "Cantidad",
+            "CostoUnitario", "PrecioUnitario", "TotalVenta", "Ganancia",
+            "ArchivoOrigen", "Cliente", "MedioPago", "Estado"
+        ])
+        while dia < hoy:
+            for v in range(rnd.randint(ventas_dia // 2, ventas_dia * 3 // 2)):
+                ts = dia + timedelta(seconds=rnd.randint(8 * 3600, 20 * 3600))
+                timestamp = ts.strftime("%Y-%m-%d %H:%M:%S")
+                id_venta = f"{ts.strftime('%Y%m%d%H%M%S')}-{v}"
+                origen = rnd.choice(ARCHIVOS_STOCK[:tiendas])
+                cliente = rnd.choice(["Regular", "Regular", "Cliente General", f"Cliente {rnd.randint(0, 299):03d}"])
+                medio = rnd.choice(MEDIOS_PAGO)
+                for _ in range(rnd.choice([1, 1, 1, 2, 2, 3])):
+                    d = rnd.choice(descripciones)
+                    cant = rnd.randint(1, 3)
+                    precio = costos[d] * 2
+                    writer.writerow([
+                        timestamp, id_venta, d, cant,
+                        f"{costos[d]:.2f}", f"{precio:.2f}", f"{cant * precio:.2f}",
+                        f"{cant * (precio - costos[d]):.2f}", origen, cliente, medio, "Completada"
+                    ])
+                    lineas += 1
+            dia += timedelta(days=1)
+
+    # Caja iniciada hoy en cada ubicación, para que /api/caja/status tenga movimiento
+    nombres_caja = {"local.txt": "caja_registros.csv", "local_2.txt": "caja_registros_local_2.csv",
+                    "bodegac.txt": "caja_registros_bodegac.csv"}
+    for archivo in ARCHIVOS_STOCK[:tiendas]:
+        with open(os.path.join(carpeta, nombres_caja[archivo]), "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Fecha", "DineroInicial", "Base", "PagosElectronicos", "DineroEnCaja",
+                             "TotalVentas", "TotalMovimientos", "EfectivoEsperado", "Diferencia"])
+            writer.writerow([hoy.strftime("%Y-%m-%d"), 100000.0, 50000.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    return descripciones, lineas
+
+
+def preparar_servidor(carpeta, puerto):
+    with open(os.path.join(DIR_REPO, "servidor.py"), "r", encoding="utf-8") as f:
+        codigo = f.read()
+    codigo = re.sub(r"^PORT = \d+", f"PORT = {puerto}", codigo, count=1, flags=re.M)
+    with open(os.path.join(carpeta, "servidor_bench.py"), "w", encoding="utf-8") as f:
+        f.write(codigo)
+    for modulo in ["almacenamiento.py", "busqueda.py"]:
+        shutil.copy(os.path.join(DIR_REPO, modulo), carpeta)
+    pin = re.search(r'^ADMIN_PIN = "([^"]*)"', codigo, flags=re.M)
+    return pin.group(1) if pin else ""
+
+
+def puerto_libre(puerto):
+    # servidor.py pasa al siguiente puerto si el suyo está ocupado; aquí eso mediría otro servidor
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("", puerto))
+            return True
+        except OSError:
+            return False
+
+
+def esperar_servidor(base_url, proceso, limite=300):
+    inicio = time.time()
+    while time.time() - inicio < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError("El servidor terminó antes de aceptar conexiones.")
+        try:
+            with urllib.request.urlopen(f"{base_url}/api/status", timeout=2) as r:
+                if r.status == 200:
+                    return time.time() - inicio
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError("El servidor no respondió a tiempo.")
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    k = (len(valores) - 1) * p
+    i = int(k)
+    j = min(i + 1, len(valores) - 1)
+    return valores[i] + (valores[j] - valores[i]) * (k - i)
+
+
+class Cliente(threading.Thread):
+    """Un teléfono/caja que repite operaciones según la mezcla hasta que se acaba el tiempo."""
+
+    def __init__(self, numero, args, contexto, fin):
+        super().__init__(daemon=True)
+        self.numero = numero
+        self.args = args
+        self.ctx = contexto
+        self.fin = fin
+        self.rnd = random.Random(args.semilla * 1000 + numero)
+        self.tienda = ARCHIVOS_STOCK[numero % args.tiendas]
+        self.resultados = []  # (operacion, ms, estado, bytes)
+        self.ventas = 0
+
+    def pedir(self, operacion, ruta, datos=None, headers=None):
+        cabeceras = {"Accept-Encoding": "gzip"}
+        cabeceras.update(headers or {})
+        body = None
+        if datos is not None:
+            body = json.dumps(datos).encode("utf-8")
+            cabeceras["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.ctx["base_url"] + ruta, data=body, headers=cabeceras)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as r:
+                tam = len(r.read())
+                estado = r.status
+        except urllib.error.HTTPError as e:
+            tam = len(e.read())
+            estado = e.code
+        except (urllib.error.URLError, OSError):
+            tam = 0
+            estado = 0
+        self.resultados.append((operacion, (time.perf_counter() - inicio) * 1000, estado, tam))
+
+    def op_productos(self):
+        self.pedir("productos", "/api/productos")
+
+    def op_ventas(self):
+        self.ventas += 1
+        items = []
+        for desc in self.rnd.sample(self.ctx["descripciones"], self.rnd.choice([1, 1, 2, 3])):
+            costo = self.ctx["costos"].get(desc, 1000)
+            items.append({"descripcion": desc, "cantidad": 1, "precio": costo * 2, "costo": costo})
+        self.pedir("ventas", "/api/ventas", {
+            "items": items,
+            "archivo_origen": self.tienda,
+            "cliente": "Regular",
+            "medio_pago": self.rnd.choice(MEDIOS_PAGO),
+            "id_venta": f"BENCH-{self.ctx['corrida']}-{self.numero}-{self.ventas}"
+        })
+
+    def op_caja(self):
+        self.pedir("caja", f"/api/caja/status?fecha={self.ctx['hoy']}&local={self.tienda}")
+
+    def op_reportes(self):
+        # Rangos típicos: el día, la semana o el mes, alguna vez el año
+        dias = self.rnd.choice([1, 1, 7, 7, 30, 30, 365])
+        fin = datetime.now() - timedelta(days=self.rnd.randint(0, 30))
+        inicio = fin - timedelta(days=dias - 1)
+        self.pedir("reportes", f"/api/reportes?fecha_inicio={inicio:%Y-%m-%d}&fecha_fin={fin:%Y-%m-%d}",
+                   headers={"X-Admin-PIN": self.ctx["pin"]})
+
+    def run(self):
+        operaciones = self.ctx["operaciones"]
+        pesos = self.ctx["pesos"]
+        while time.time() < self.fin:
+            getattr(self, f"op_{self.rnd.choices(operaciones, pesos)[0]}")()
+
+
+def leer_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if nombre not in ("productos", "ventas", "caja", "reportes"):
+            raise ValueError(f"Operación desconocida en la mezcla: {nombre}")
+        mezcla[nombre] = float(peso or 1)
+    return mezcla
+
+
+def resumir(resultados, duracion):
+    por_operacion = {}
+    for operacion, ms, estado, tam in resultados:
+        por_operacion.setdefault(operacion, []).append((ms, estado, tam))
+    resumen = {}
+    for operacion, filas in sorted(por_operacion.items()):
+        latencias = sorted(ms for ms, estado, _ in filas if 200 <= estado < 400)
+        errores = sum(1 for _, estado, _ in filas if not 200 <= estado < 400)
+        resumen[operacion] = {
+            "peticiones": len(filas),
+            "errores": errores,
+            "por_segundo": round(len(filas) / duracion, 2),
+            "p50_ms": round(percentil(latencias, 0.50), 2),
+            "p95_ms": round(percentil(latencias, 0.95), 2),
+            "p99_ms": round(percentil(latencias, 0.99), 2),
+            "max_ms": round(latencias[-1], 2) if latencias else 0.0,
+            "kb_promedio": round(sum(t for _, _, t in filas) / len(filas) / 1024, 1)
+        }
+    total = len(resultados)
+    resumen["total"] = {
+        "peticiones": total,
+        "errores": sum(r["errores"] for r in resumen.values()),
+        "por_segundo": round(total / duracion, 2)
+    }
+    return resumen
+
+
+def imprimir(resumen):
+    print(f"\n{'operación':<12}{'pet.':>8}{'err.':>6}{'pet/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'KB':>8}")
+    for operacion, r in resumen.items():
+        if operacion == "total":
+            continue
+        print(f"{operacion:<12}{r['peticiones']:>8}{r['errores']:>6}{r['por_segundo']:>9.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}{r['kb_promedio']:>8.1f}")
+    t = resumen["total"]
+    print(f"{'TOTAL':<12}{t['peticiones']:>8}{t['errores']:>6}{t['por_segundo']:>9.1f}")
+
+
+def comparar(resumen, parametros, archivo_base, tolerancia):
+    """Compara contra un resultado guardado. Devuelve la lista de regresiones encontradas."""
+    with open(archivo_base, "r", encoding="utf-8") as f:
+        guardado = json.load(f)
+    base = guardado["resumen"]
+    regresiones = []
+    print(f"\nComparación con {archivo_base} (tolerancia {tolerancia:.0%}):")
+    distintos = [k for k, v in guardado.get("parametros", {}).items() if k in parametros and parametros[k] != v]
+    if distintos:
+        print(f"  Aviso: parámetros distintos a los de la base ({', '.join(distintos)}); los números no son comparables.")
+    for operacion, r in resumen.items():
+        b = base.get(operacion)
+        if not b:
+            continue
+        if operacion != "total":
+            for clave in ("p50_ms", "p95_ms"):
+                if b[clave] > 0 and r[clave] > b[clave] * (1 + tolerancia):
+                    regresiones.append(f"{operacion}: {clave} {b[clave]} -> {r[clave]}")
+            if r["errores"] > b["errores"]:
+                regresiones.append(f"{operacion}: errores {b['errores']} -> {r['errores']}")
+        elif b["por_segundo"] > 0 and r["por_segundo"] < b["por_segundo"] / (1 + tolerancia):
+            regresiones.append(f"total: pet/s {b['por_segundo']} -> {r['por_segundo']}")
+    for linea in regresiones:
+        print(f"  [!] {linea}")
+    if not regresiones:
+        print("  Sin regresiones.")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API del POS con datos sintéticos")
+    parser.add_argument("--skus", type=int, default=7500, help="Productos del catálogo")
+    parser.add_argument("--anios", type=float, default=2, help="Años de historia en el registro de ventas")
+    parser.add_argument("--ventas-dia", type=int, default=60, help="Ventas promedio por día en la historia")
+    parser.add_argument("--tiendas", type=int, default=3, choices=[1, 2, 3],
+                        help="Ubicaciones con stock y ventas (local, local 2, bodega)")
+    parser.add_argument("--clientes", type=int, default=8, help="Clientes concurrentes")
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos de carga")
+    parser.add_argument("--calentamiento", type=float, default=2, help="Segundos de carga que no se miden")
+    parser.add_argument("--mezcla", default=MEZCLA_DEFECTO, help=f"Pesos por operación (por defecto {MEZCLA_DEFECTO})")
+    parser.add_argument("--puerto", type=int, default=8095)
+    parser.add_argument("--modo", choices=["hilos", "simple"], default="hilos")
+    parser.add_argument("--workers", type=int, default=None, help="Workers del servidor en modo hilos")
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--datos", metavar="CARPETA", help="Usar/conservar esta carpeta de datos en vez de una temporal")
+    parser.add_argument("--guardar", metavar="ARCHIVO", help="Guardar el resultado en JSON")
+    parser.add_argument("--comparar", metavar="ARCHIVO", help="Comparar con un resultado guardado")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Aumento de latencia aceptado al comparar")
+    args = parser.parse_args()
+
+    mezcla = leer_mezcla(args.mezcla)
+    print("=== PRUEBA DE CARGA DE LA API DEL POS ===")
+    carpeta = args.datos or tempfile.mkdtemp(prefix="bench_api_")
+    os.makedirs(carpeta, exist_ok=True)
+    proceso = None
+    try:
+        inicio = time.time()
+        if os.path.exists(os.path.join(carpeta, "registro_ventas.csv")) and args.datos:
+            print(f"Usando los datos existentes de {carpeta}")
+            with open(os.path.join(carpeta, "dbcst.txt"), "r", encoding="utf-8") as f:
+                descripciones = [l.strip().rsplit(" ", 1)[0] for l in f if l.strip()]
+        else:
+            descripciones, lineas = generar_datos(carpeta, args.skus, args.anios, args.tiendas,
+                                                  args.ventas_dia, args.semilla)
+            print(f"Datos: {len(descripciones)} productos, {args.tiendas} ubicación(es), "
+                  f"{lineas} líneas de ventas ({args.anios} años) en {time.time() - inicio:.1f} s")
+
+        costos = {}
+        with open(os.path.join(carpeta, "dbcst.txt"), "r", encoding="utf-8") as f:
+            for linea in f:
+                desc, _, costo = linea.strip().rpartition(" ")
+                costos[desc] = float(costo)
+
+        if not puerto_libre(args.puerto):
+            print(f"[!] El puerto {args.puerto} está ocupado (¿otro servidor abierto?). Use --puerto.")
+            return 2
+        pin = preparar_servidor(carpeta, args.puerto)
+        comando = [sys.executable, "servidor_bench.py", "--modo", args.modo]
+        if args.workers:
+            comando += ["--workers", str(args.workers)]
+        proceso = subprocess.Popen(comando, cwd=carpeta, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{args.puerto}"
+        print(f"Servidor listo en {esperar_servidor(base_url, proceso):.1f} s (modo {args.modo})")
+
+        contexto = {
+            "base_url": base_url,
+            "pin": pin,
+            "hoy": datetime.now().strftime("%Y-%m-%d"),
+            "descripciones": descripciones,
+            "costos": costos,
+            "corrida": datetime.now().strftime("%H%M%S"),
+            "operaciones": list(mezcla),
+            "pesos": list(mezcla.values())
+        }
+        print(f"Mezcla: {', '.join(f'{k}={v:g}' for k, v in mezcla.items())} | "
+              f"{args.clientes} clientes | {args.duracion:g} s (+{args.calentamiento:g} s de calentamiento)")
+
+        inicio_carga = time.time()
+        fin = inicio_carga + args.calentamiento + args.duracion
+        clientes = [Cliente(n, args, contexto, fin) for n in range(args.clientes)]
+        for c in clientes:
+            c.start()
+        time.sleep(args.calentamiento)
+        medidos_desde = [len(c.resultados) for c in clientes]
+        for c in clientes:
+            c.join()
+        duracion = time.time() - inicio_carga - args.calentamiento
+
+        resultados = []
+        for c, desde in zip(clientes, medidos_desde):
+            resultados.extend(c.resultados[desde:])
+        resumen = resumir(resultados, duracion)
+        imprimir(resumen)
+
+        parametros = {k: v for k, v in vars(args).items()
+                      if k not in ("guardar", "comparar", "datos", "tolerancia", "puerto")}
+        if args.guardar:
+            with open(args.guardar, "w", encoding="utf-8") as f:
+                json.dump({
+                    "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "parametros": parametros,
+                    "resumen": resumen
+                }, f, ensure_ascii=False, indent=2)
+            print(f"\nResultado guardado en {args.guardar}")
+        if args.comparar and comparar(resumen, parametros, args.comparar, args.tolerancia):
+            return 1
+        return 0
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            try:
+                proceso.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+        if not args.datos:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
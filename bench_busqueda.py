@@ -0,0 +1,150 @@
+import os
+import re
+import sys
+import time
+
+from busqueda import check_match, compilar_busqueda, texto_busqueda
+
+# Mide el tiempo por búsqueda de comparador.search() sobre los inventarios reales:
+#   1. antiguo:    check_match original por fila (vuelve a bajar a minúsculas la
+#                  descripción, separar la consulta y armar las expresiones regulares)
+#   2. por fila:   check_match actual por fila (consulta compilada en caché)
+#   3. compilado:  compilar_busqueda una vez + texto_busqueda, como en comparador.search
+# Uso: python bench_busqueda.py [repeticiones] [archivo1 archivo2 ...]
+
+REPETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+ARCHIVOS = sys.argv[2:] or ["bodegac.txt", "local.txt", "local_2.txt"]
+
+CONSULTAS = [
+    ("phrase", "iphone 15"),
+    ("phrase", "forro"),
+    ("keywords", "forro samsung"),
+    ("keywords", "cable tipo c"),
+    ("keywords", "vidrio a"),
+    ("advanced", "cargador, tipo c|micro -usb"),
+    ("advanced", "forro, iphone|samsung -space"),
+    ("advanced", "-pro audifonos"),
+]
+
+
+def check_match_antiguo(description, search_term, mode):
+    """Copia de check_match antes de compilar las consultas, como referencia."""
+    desc_lower = description.strip().lower()
+    term_lower = search_term.lower()
+    if mode == "phrase":
+        return term_lower in desc_lower
+    elif mode == "keywords":
+        words = term_lower.split()
+        if not words:
+            return True
+        return all(word in desc_lower for word in words)
+    elif mode == "advanced":
+        if "," in term_lower:
+            base_str, or_str = term_lower.split(",", 1)
+        else:
+            base_str, or_str = "", term_lower
+        if base_str:
+            for part in base_str.split():
+                if part.startswith("-") and len(part) > 1:
+                    exclude_word = part[1:]
+                    if exclude_word.isalpha():
+                        if re.search(r"\b" + re.escape(exclude_word) + r"\b", desc_lower):
+                            return False
+                    elif exclude_word in desc_lower:
+                        return False
+                elif part not in desc_lower:
+                    return False
+        if not or_str.strip():
+            return True
+        for group in or_str.split("|"):
+            parts = group.split()
+            if not parts:
+                continue
+            match_group = True
+            for part in parts:
+                if part.startswith("-") and len(part) > 1:
+                    exclude_word = part[1:]
+                    if exclude_word.isalpha():
+                        if re.search(r"\b" + re.escape(exclude_word) + r"\b", desc_lower):
+                            match_group = False
+                            break
+                    elif exclude_word in desc_lower:
+                        match_group = False
+                        break
+                elif part not in desc_lower:
+                    match_group = False
+                    break
+            if match_group:
+                return True
+        return False
+    return False
+
+
+def leer_descripciones(ruta):
+    descripciones = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("    ") and line.strip():
+                parts = line.strip().rsplit(" ", 1)
+                if len(parts) == 2 and parts[1].isdigit():
+                    descripciones.append(parts[0].strip())
+    return descripciones
+
+
+def buscar_antiguo(tablas, term, mode):
+    return [[d for d in tabla if check_match_antiguo(d, term, mode)] for tabla in tablas]
+
+
+def buscar_por_fila(tablas, term, mode):
+    return [[d for d in tabla if check_match(d, term, mode)] for tabla in tablas]
+
+
+def buscar_compilado(tablas, term, mode):
+    coincide = compilar_busqueda(term, mode)
+    return [[d for d in tabla if coincide(texto_busqueda(d))] for tabla in tablas]
+
+
+def main():
+    print("=== BENCHMARK DE BÚSQUEDA (comparador) ===")
+    tablas = []
+    for archivo in ARCHIVOS:
+        if os.path.exists(archivo):
+            tablas.append(leer_descripciones(archivo))
+            print(f"Archivo: {archivo} ({len(tablas[-1])} productos)")
+        else:
+            print(f"Archivo: {archivo} no existe, se omite")
+    if not tablas:
+        print("No hay inventarios para buscar.")
+        return
+    filas = sum(len(t) for t in tablas)
+    print(f"Filas por búsqueda: {filas} | consultas: {len(CONSULTAS)} | repeticiones: {REPETICIONES}\n")
+
+    # Las descripciones se bajan a minúsculas al cargar, no en cada búsqueda
+    for tabla in tablas:
+        for d in tabla:
+            texto_busqueda(d)
+
+    resultados = []
+    for nombre, funcion in [("antiguo (check_match por fila)", buscar_antiguo),
+                            ("por fila (consulta en caché)", buscar_por_fila),
+                            ("compilado + minúsculas", buscar_compilado)]:
+        inicio = time.perf_counter()
+        for _ in range(REPETICIONES):
+            for mode, term in CONSULTAS:
+                funcion(tablas, term, mode)
+        total = time.perf_counter() - inicio
+        resultados.append((nombre, total))
+
+    for mode, term in CONSULTAS:
+        if buscar_compilado(tablas, term, mode) != buscar_antiguo(tablas, term, mode):
+            print(f"[!] Resultados distintos para {mode} '{term}'")
+
+    busquedas = REPETICIONES * len(CONSULTAS)
+    referencia = resultados[0][1]
+    for nombre, total in resultados:
+        por_busqueda = total / busquedas * 1000
+        print(f"{nombre:<32} {total:8.3f} s  {por_busqueda:8.3f} ms/búsqueda  x{referencia / total:5.2f}")
+
+
+if __name__ == "__main__":
+    main()
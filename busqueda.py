@@ -0,0 +1,244 @@
+"""Búsqueda de productos por descripción, compartida por comparador.py y servidor.py.
+
+check_match() define la sintaxis de búsqueda de siempre:
+- "phrase":   la frase exacta aparece en la descripción.
+- "keywords": todas las palabras aparecen (en cualquier orden).
+- "advanced": "base, a|b -x": la base es obligatoria y luego basta con que se
+              cumpla uno de los grupos separados por '|'. Una palabra con '-'
+              excluye; si es solo letras debe aparecer como palabra completa.
+
+compilar_busqueda() interpreta la consulta una sola vez y devuelve un predicado
+sobre texto_busqueda(descripcion); check_match() es ese mismo predicado aplicado
+a una sola descripción. Para recorrer muchas filas conviene compilar antes.
+
+IndiceTrigramas es un índice invertido de trigramas sobre las descripciones en
+minúsculas. Como todas las condiciones positivas de check_match son "el texto
+contiene X", la intersección de las listas de los trigramas de X da un conjunto
+de candidatos que siempre incluye todas las coincidencias; sobre esos pocos
+candidatos se evalúa check_match para obtener exactamente el mismo resultado.
+"""
+import re
+from functools import lru_cache
+
+
+def _separar_partes(partes):
+    """Divide las palabras de un grupo en (requeridas, exclusiones compiladas)."""
+    incluir = []
+    excluir = []
+    for part in partes:
+        if part.startswith("-") and len(part) > 1:
+            exclude_word = part[1:]
+            # Lógica inteligente: Si solo son letras, exige palabra completa (\b)
+            if exclude_word.isalpha():
+                excluir.append(re.compile(r"\b" + re.escape(exclude_word) + r"\b").search)
+            else:
+                excluir.append(lambda texto, palabra=exclude_word: palabra in texto)
+        else:
+            incluir.append(part)
+    return incluir, excluir
+
+
+def _cumple(texto, incluir, excluir):
+    for part in incluir:
+        if part not in texto:
+            return False
+    for excluye in excluir:
+        if excluye(texto):
+            return False
+    return True
+
+
+def _predicado(incluir, excluir):
+    """Predicado "contiene todas las requeridas y ninguna exclusión", sin bucles en los casos comunes."""
+    if excluir:
+        return lambda texto: _cumple(texto, incluir, excluir)
+    if not incluir:
+        return lambda texto: True
+    if len(incluir) == 1:
+        palabra = incluir[0]
+        return lambda texto: palabra in texto
+    if len(incluir) == 2:
+        a, b = incluir
+        return lambda texto: a in texto and b in texto
+    return lambda texto: _cumple(texto, incluir, ())
+
+
+@lru_cache(maxsize=256)
+def compilar_busqueda(search_term, mode):
+    """Convierte la búsqueda en un predicado sobre descripciones ya normalizadas.
+
+    El predicado recibe texto_busqueda(descripcion) (sin espacios extremos y en
+    minúsculas) y da el mismo resultado que check_match. La consulta se interpreta
+    una sola vez: palabras separadas, grupos '|' listos y exclusiones compiladas.
+    """
+    term_lower = search_term.lower()
+
+    if mode == "phrase":  # Frase Exacta
+        return lambda texto: term_lower in texto
+
+    if mode == "keywords":  # Palabras Clave
+        return _predicado(term_lower.split(), ())
+
+    if mode == "advanced":  # Avanzada
+        # 1. Separar por coma (si existe) para obtener la base obligatoria
+        if "," in term_lower:
+            base_str, or_str = term_lower.split(",", 1)
+        else:
+            base_str, or_str = "", term_lower
+        base = _predicado(*_separar_partes(base_str.split()))
+
+        # 2. Sin argumentos OR después de la coma basta con la base
+        if not or_str.strip():
+            return base
+
+        # 3. Grupos OR separados por '|' (los vacíos no cuentan)
+        grupos = [_predicado(*_separar_partes(group.split())) for group in or_str.split("|") if group.split()]
+
+        def coincide(texto):
+            if not base(texto):
+                return False
+            # Si se cumple CUALQUIERA de los grupos divididos por '|', el ítem coincide
+            for grupo in grupos:
+                if grupo(texto):
+                    return True
+            return False
+
+        return coincide
+
+    return lambda texto: False
+
+
+_textos = {}
+MAX_TEXTOS = 100000
+
+
+def texto_busqueda(description):
+    """description.strip().lower(), calculado una vez por descripción (las búsquedas se repiten)."""
+    texto = _textos.get(description)
+    if texto is None:
+        if len(_textos) >= MAX_TEXTOS:
+            _textos.clear()
+        texto = _textos[description] = description.strip().lower()
+    return texto
+
+
+def check_match(description, search_term, mode):
+    """
+    Verifica si la descripción coincide con el término de búsqueda según el modo.
+    """
+    return compilar_busqueda(search_term, mode)(texto_busqueda(description))
+
+
+def terminos_requeridos(search_term, mode):
+    """Condiciones "contiene" que debe cumplir toda coincidencia, en forma de fórmula.
+
+    Devuelve una lista de alternativas (OR); cada alternativa es una lista de
+    textos que deben aparecer todos (AND). None significa que no se puede acotar.
+    """
+    term_lower = search_term.lower()
+    if mode == "phrase":
+        return [[term_lower]]
+    if mode == "keywords":
+        return [term_lower.split()]
+    if mode == "advanced":
+        if "," in term_lower:
+            base_str, or_str = term_lower.split(",", 1)
+        else:
+            base_str, or_str = "", term_lower
+        base = [p for p in base_str.split() if not (p.startswith("-") and len(p) > 1)]
+        if not or_str.strip():
+            return [base]
+        grupos = [g.split() for g in or_str.split("|") if g.split()]
+        if not grupos:
+            return None  # Solo separadores: check_match no encuentra nada, se deja evaluar
+        return [base + [p for p in grupo if not (p.startswith("-") and len(p) > 1)] for grupo in grupos]
+    return None
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> conjunto de claves, sobre descripciones en minúsculas."""
+
+    def __init__(self, descripciones=()):
+        self._textos = {}
+        self._postings = {}
+        for desc in descripciones:
+            self.agregar(desc)
+
+    def __len__(self):
+        return len(self._textos)
+
+    def claves(self):
+        return self._textos.keys()
+
+    def sincronizar(self, descripciones):
+        """Deja en el índice exactamente `descripciones`, agregando y quitando solo la diferencia."""
+        nuevas = set(descripciones)
+        for desc in self._textos.keys() - nuevas:
+            self.quitar(desc)
+        for desc in nuevas - self._textos.keys():
+            self.agregar(desc)
+
+    @staticmethod
+    def _trigramas(texto):
+        return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+    def agregar(self, desc):
+        if desc in self._textos:
+            return
+        texto = desc.strip().lower()
+        self._textos[desc] = texto
+        for tri in self._trigramas(texto):
+            self._postings.setdefault(tri, set()).add(desc)
+
+    def quitar(self, desc):
+        texto = self._textos.pop(desc, None)
+        if texto is None:
+            return
+        for tri in self._trigramas(texto):
+            lista = self._postings.get(tri)
+            if lista is not None:
+                lista.discard(desc)
+                if not lista:
+                    del self._postings[tri]
+
+    def _contienen(self, texto):
+        """Claves cuya descripción puede contener `texto` (None si es muy corto para acotar)."""
+        if len(texto) < 3:
+            return None
+        resultado = None
+        for tri in sorted(self._trigramas(texto), key=lambda t: len(self._postings.get(t, ()))):
+            lista = self._postings.get(tri)
+            if not lista:
+                return set()
+            resultado = set(lista) if resultado is None else resultado & lista
+            if not resultado:
+                break
+        return resultado
+
+    def candidatos(self, search_term, mode):
+        """Superconjunto de las claves que coinciden, o None si hay que revisar todas."""
+        formula = terminos_requeridos(search_term, mode)
+        if formula is None:
+            return None
+        union = set()
+        for alternativa in formula:
+            interseccion = None
+            for texto in alternativa:
+                claves = self._contienen(texto)
+                if claves is None:
+                    continue
+                interseccion = claves if interseccion is None else interseccion & claves
+                if not interseccion:
+                    break
+            if interseccion is None:
+                return None  # Una alternativa sin términos acotables puede coincidir con todo
+            union |= interseccion
+        return union
+
+    def buscar(self, search_term, mode):
+        """Claves que cumplen check_match(desc, search_term, mode)."""
+        candidatos = self.candidatos(search_term, mode)
+        if candidatos is None:
+            candidatos = self._textos.keys()
+        coincide = compilar_busqueda(search_term, mode)
+        return [desc for desc in candidatos if coincide(self._textos[desc])]
@@ -9,7 +9,11 @@ import re  # Importamos regex para búsquedas más precisas
 import webbrowser  # NUEVO: Para abrir el reporte en el navegador
 import tempfile  # NUEVO: Para crear un archivo temporal de impresión
 import shutil  # NUEVO: Para respaldos
+from array import array
 from datetime import datetime  # NUEVO: Para poner la fecha en el reporte
+from contextlib import contextmanager
+from almacenamiento import abrir_atomico, bloqueo_archivo  # Escritura segura compartida con servidor.py
+from busqueda import IndiceTrigramas, compilar_busqueda, texto_busqueda  # Sintaxis de búsqueda compartida con servidor.py
 
 # --- Constantes y Configuración ---
 RESTRICTIONS_FILE = "restricciones.json"
@@ -19,6 +23,12 @@ DEFAULT_RESTRICTIONS = {
     "pdst.txt": [],
 }
 SEARCH_HISTORY_FILE = "historial_busquedas.json"
+PROVIDER_FILES = ["pdcentro.txt", "pdpr.txt", "pdst.txt"]
+RETRASO_BUSQUEDA_MS = 150  # Pausa entre teclas antes de filtrar mientras se escribe
+TECLAS_SIN_TEXTO = {
+    "Return", "KP_Enter", "Escape", "Tab", "Up", "Down", "Left", "Right", "Home", "End",
+    "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R", "Meta_L", "Meta_R",
+}
 
 # --- Creación de archivos de ejemplo ---
 try:
@@ -49,6 +59,8 @@ except FileExistsError:
 last_search_term = ""
 search_history = []
 sticky_item = ""
+pending_search = None
+last_table_search = None
 is_syncing_selection = False
 current_restrictions = {}
 current_local1_filename = "local.txt"   # Variable para archivo local 1 dinámico
@@ -161,30 +173,271 @@ def parse_file(filename):
                         data.append((description, quantity))
     except FileNotFoundError:
         pass
+    if archivo_indexado(filename):
+        indexar_archivo(filename, data)
     return data
 
 
-def update_file(filename, data):
+def escribir_archivo(filename, data):
+    """Escribe `data` en `filename` (respaldo + reemplazo atómico); los errores se propagan."""
+    if isinstance(data, TablaStock) and not data.modificada:
+        return  # Sin cambios: no se reescribe ni se respalda
+    if archivo_indexado(filename):
+        indexar_archivo(filename, data)
     create_backup(filename)  # NUEVO: Generar copia de seguridad antes de escribir
-    try:
-        with open(filename, "w", encoding="utf-8") as f:
-            sorted_data = sorted(data, key=lambda item: item[0])
-            for description, quantity in sorted_data:
-                f.write(f"    {description} {quantity}\n")
+    # Temporal + os.replace: un corte a mitad de escritura no deja el archivo truncado
+    with bloqueo_archivo(filename), abrir_atomico(filename, encoding="utf-8") as f:
+        sorted_data = sorted(data, key=lambda item: item[0])
+        for description, quantity in sorted_data:
+            f.write(f"    {description} {quantity}\n")
+    if isinstance(data, TablaStock):
+        data.modificada = False
+
+
+# --- Índice de búsqueda ---
+# Un índice de trigramas por archivo de las tablas (bodega y los dos locales). Se arma
+# al leer el archivo y se actualiza en escribir_archivo, por donde pasan todos los cambios de
+# las tablas; así search() solo revisa las descripciones candidatas en cada tecla.
+indices_busqueda = {}
+
+
+def archivo_indexado(filename):
+    return filename in ("bodegac.txt", current_local1_filename, current_local2_filename)
+
+
+def indexar_archivo(filename, data):
+    """Sincroniza el índice de `filename` con `data` (solo agrega y quita la diferencia)."""
+    indice = indices_busqueda.get(filename)
+    if indice is None:
+        indices_busqueda[filename] = IndiceTrigramas(desc for desc, qty in data)
+    else:
+        indice.sincronizar(desc for desc, qty in data)
+
+
+def filtrar_filas(filename, data, search_term, mode):
+    """Filas de `data` que coinciden con la búsqueda, usando el índice del archivo si existe."""
+    indice = indices_busqueda.get(filename)
+    if indice is None:
+        coincide = compilar_busqueda(search_term, mode)
+        return [fila for fila in data if coincide(texto_busqueda(fila[0]))]
+    claves = indice.buscar(search_term, mode)
+    if not claves:
+        return []
+    # Se conserva el orden (y los duplicados) de la tabla
+    claves = set(claves)
+    return [fila for fila in data if fila[0] in claves]
+
+
+# --- Modelo de stock ---
+class TablaStock:
+    """Inventario de un archivo (bodega o local) con acceso por descripción.
+
+    Conserva el orden y los duplicados del archivo, con las cantidades en un array
+    compacto, y se recorre como la lista de tuplas (desc, cantidad) de parse_file.
+    Cada fila se ubica por texto_busqueda(desc), el mismo criterio que
+    desc.strip().lower() == termino.lower(), sin recorrer la tabla. Los cambios pasan
+    por sus métodos y marcan `modificada`; escribir_archivo no reescribe tablas sin cambios.
+    """
+
+    def __init__(self, filas=()):
+        self._descripciones = []
+        self._cantidades = array("q")
+        for description, quantity in filas:
+            self._descripciones.append(description)
+            self._cantidades.append(quantity)
+        self._posiciones = None
+        self.modificada = False
+
+    def __len__(self):
+        return len(self._descripciones)
+
+    def __iter__(self):
+        return zip(self._descripciones, self._cantidades)
+
+    def __getitem__(self, i):
+        return self._descripciones[i], self._cantidades[i]
+
+    def _indice(self):
+        """{texto_busqueda(desc): posición de su primera fila}, armado al primer uso."""
+        if self._posiciones is None:
+            posiciones = {}
+            for i, description in enumerate(self._descripciones):
+                posiciones.setdefault(texto_busqueda(description), i)
+            self._posiciones = posiciones
+        return self._posiciones
+
+    def posicion(self, description):
+        return self._indice().get(texto_busqueda(description), -1)
+
+    def contiene(self, description):
+        return texto_busqueda(description) in self._indice()
+
+    def cantidad(self, description, defecto=0):
+        i = self.posicion(description)
+        return self._cantidades[i] if i >= 0 else defecto
+
+    def fijar_cantidad(self, i, quantity):
+        if self._cantidades[i] != quantity:
+            self._cantidades[i] = quantity
+            self.modificada = True
+
+    def agregar(self, description, quantity):
+        self._descripciones.append(description)
+        self._cantidades.append(quantity)
+        if self._posiciones is not None:
+            self._posiciones.setdefault(texto_busqueda(description), len(self._descripciones) - 1)
+        self.modificada = True
+
+    def eliminar(self, i):
+        del self._descripciones[i]
+        del self._cantidades[i]
+        self._posiciones = None
+        self.modificada = True
+
+    def renombrar(self, description, new_desc):
+        """Cambia el nombre de la primera fila de `description`; False si no está."""
+        i = self.posicion(description)
+        if i == -1:
+            return False
+        self._descripciones[i] = new_desc
+        self._posiciones = None
+        self.modificada = True
         return True
-    except Exception as e:
-        messagebox.showerror(
-            "Error de Archivo",
-            f"No se pudo escribir en el archivo {filename}.\nError: {e}",
-        )
-        return False
+
+    def quitar(self, textos):
+        """Elimina las filas cuyo texto_busqueda está en `textos` y devuelve cuántas quitó."""
+        conservar = [i for i, description in enumerate(self._descripciones) if texto_busqueda(description) not in textos]
+        quitadas = len(self._descripciones) - len(conservar)
+        if quitadas:
+            self._descripciones = [self._descripciones[i] for i in conservar]
+            self._cantidades = array("q", (self._cantidades[i] for i in conservar))
+            self._posiciones = None
+            self.modificada = True
+        return quitadas
+
+    def recargar(self, filas):
+        """Toma `filas` (recién leídas del archivo) como contenido sin cambios pendientes."""
+        nueva = TablaStock(filas)
+        self._descripciones = nueva._descripciones
+        self._cantidades = nueva._cantidades
+        self._posiciones = None
+        self.modificada = False
+
+    def reemplazar(self, filas):
+        """Reemplaza todas las filas; solo queda modificada si el contenido cambió."""
+        nueva = TablaStock(filas)
+        if nueva._descripciones != self._descripciones or nueva._cantidades != self._cantidades:
+            self._descripciones = nueva._descripciones
+            self._cantidades = nueva._cantidades
+            self._posiciones = None
+            self.modificada = True
+
+
+def cargar_tabla(filename):
+    return TablaStock(parse_file(filename))
+
+
+# --- Edición con bloqueo ---
+# servidor.py compacta su diario de ventas en bodegac.txt/local.txt e inventario_gui también
+# escribe esos archivos. Un cambio nunca se escribe sobre lo que se leyó antes: se toma el
+# bloqueo, se relee el archivo, se aplica el cambio y se escribe antes de soltarlo.
+class CambioRechazado(Exception):
+    """El cambio no se puede aplicar al contenido actual del archivo (se avisa al usuario)."""
+
+    def __init__(self, titulo, mensaje, mostrar=None):
+        super().__init__(mensaje)
+        self.titulo = titulo
+        self.mostrar = mostrar or messagebox.showerror
+
+
+class Edicion:
+    def __init__(self):
+        self.ok = True
+
+
+@contextmanager
+def editar_archivos(*archivos, parent=None):
+    """Bloquea y relee los archivos, deja aplicar los cambios y los escribe sin soltar el bloqueo.
+
+    `archivos` son pares (filename, TablaStock); cada tabla se recarga desde el disco al
+    entrar. Dentro del bloque se valida y modifica, y CambioRechazado cancela todo. Los
+    avisos se muestran ya sin el bloqueo (un diálogo abierto no frena al servidor) y
+    `edicion.ok` indica si se guardó.
+    """
+    edicion = Edicion()
+    aviso = None
+    with bloqueo_archivo(*(filename for filename, tabla in archivos)):
+        for filename, tabla in archivos:
+            tabla.recargar(parse_file(filename))
+        try:
+            yield edicion
+        except CambioRechazado as e:
+            aviso = (e.mostrar, e.titulo, str(e))
+        else:
+            for filename, tabla in archivos:
+                try:
+                    escribir_archivo(filename, tabla)
+                except Exception as e:
+                    aviso = (messagebox.showerror, "Error de Archivo",
+                             f"No se pudo escribir en el archivo {filename}.\nError: {e}")
+                    break
+        if aviso:
+            # Lo que quedó a medias en memoria se descarta: vuelve a lo que hay en disco
+            for filename, tabla in archivos:
+                tabla.recargar(parse_file(filename))
+    if aviso:
+        edicion.ok = False
+        mostrar, titulo, mensaje = aviso
+        if parent is not None:
+            mostrar(titulo, mensaje, parent=parent)
+        else:
+            mostrar(titulo, mensaje)
+
+
+def archivos_stock():
+    """Pares (archivo, tabla) de bodega y los dos locales abiertos, para editar_archivos."""
+    return [
+        ("bodegac.txt", data_bodega),
+        (current_local1_filename, data_local1),
+        (current_local2_filename, data_local2),
+    ]
+
+
+def archivos_existentes(nombres):
+    """Pares (archivo, tabla vacía) de los archivos que existen; editar_archivos los carga."""
+    return [(filename, TablaStock()) for filename in nombres if os.path.exists(filename)]
+
+
+# --- Pedidos a proveedores ---
+# Cada cambio de selección muestra las cantidades pedidas del ítem en los tres pedidos;
+# se guardan en memoria y se vuelven a leer solo cuando el archivo cambia en disco.
+pedidos_cache = {}
+
+
+def firma_archivo(filename):
+    """(fecha de modificación, tamaño) del archivo, o None si no existe."""
+    try:
+        estado = os.stat(filename)
+    except OSError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+def pedido(filename):
+    """TablaStock del pedido, releída solo si el archivo cambió. Es de solo lectura:
+    para modificar un pedido se usa editar_archivos."""
+    firma = firma_archivo(filename)
+    cacheado = pedidos_cache.get(filename)
+    if cacheado is None or cacheado[0] != firma:
+        cacheado = pedidos_cache[filename] = (firma, cargar_tabla(filename))
+    return cacheado[1]
 
 
 def refresh_data():
     global data_bodega, data_local1, data_local2
-    data_bodega = parse_file("bodegac.txt")
-    data_local1 = parse_file(current_local1_filename)
-    data_local2 = parse_file(current_local2_filename)
+    data_bodega = cargar_tabla("bodegac.txt")
+    data_local1 = cargar_tabla(current_local1_filename)
+    data_local2 = cargar_tabla(current_local2_filename)
     entry_search.delete(0, tk.END)
     entry_search.insert(0, last_search_term)
     search()
@@ -200,13 +453,13 @@ def change_local_file(target_num):
     if filename:
         if target_num == 1:
             current_local1_filename = filename
-            data_local1 = parse_file(current_local1_filename)
+            data_local1 = cargar_tabla(current_local1_filename)
             label_local1.config(
                 text=f"Local 1 ({os.path.basename(current_local1_filename)})"
             )
         else:
             current_local2_filename = filename
-            data_local2 = parse_file(current_local2_filename)
+            data_local2 = cargar_tabla(current_local2_filename)
             label_local2.config(
                 text=f"Local 2 ({os.path.basename(current_local2_filename)})"
             )
@@ -237,29 +490,12 @@ def on_item_select(event):
     sticky_item = description
 
     # --- Lógica de Alerta Visual (Rojo en Bodega) ---
-    bodega_qty = 0
-    local1_qty = 0
-    local2_qty = 0
-    found_in_bodega = False
-
-    for desc, qty in data_bodega:
-        if desc.strip().lower() == description.lower():
-            bodega_qty = qty
-            found_in_bodega = True
-            break
-
-    for desc, qty in data_local1:
-        if desc.strip().lower() == description.lower():
-            local1_qty = qty
-            break
-
-    for desc, qty in data_local2:
-        if desc.strip().lower() == description.lower():
-            local2_qty = qty
-            break
+    bodega_qty = data_bodega.cantidad(description)
+    local1_qty = data_local1.cantidad(description)
+    local2_qty = data_local2.cantidad(description)
 
     # Si hay en bodega y no hay en local1 O local2, activamos la alerta roja
-    if found_in_bodega and bodega_qty > 0 and (local1_qty == 0 or local2_qty == 0):
+    if bodega_qty > 0 and (local1_qty == 0 or local2_qty == 0):
         tree_bodega.configure(style="Alert.Treeview")
     else:
         tree_bodega.configure(style="Treeview")
@@ -284,13 +520,11 @@ def on_item_select(event):
             if needs_update:
                 if w.selection():
                     w.selection_remove(w.selection())
-                # Buscar y seleccionar
-                for child in w.get_children():
-                    child_values = w.item(child, "values")
-                    if child_values and child_values[0] == description:
-                        w.selection_set(child)
-                        w.see(child)
-                        break
+                # Buscar y seleccionar (aunque la fila aún no se haya creado en la tabla)
+                child = tablas_virtuales[w].iid_de(description)
+                if child:
+                    w.selection_set(child)
+                    w.see(child)
     finally:
         is_syncing_selection = False
 
@@ -306,17 +540,14 @@ def update_provider_quantities(search_term):
         "pdst.txt": pd_st_qty_var,
     }
     for filename, qty_var in provider_files.items():
-        order_data = parse_file(filename)
-        found_qty = 0
-        for desc, qty in order_data:
-            if desc.strip().lower() == search_term.lower():
-                found_qty = qty
-                break
-        qty_var.set(str(found_qty))
+        qty_var.set(str(pedido(filename).cantidad(search_term)))
 
 
 def manual_search(event=None):
-    global last_search_term, search_history
+    global last_search_term, search_history, pending_search
+    if pending_search is not None:
+        root.after_cancel(pending_search)
+        pending_search = None
     last_search_term = entry_search.get().strip()
 
     if last_search_term:
@@ -331,6 +562,25 @@ def manual_search(event=None):
     search()
 
 
+def search_as_you_type(event=None):
+    """Filtra las tablas mientras se escribe, esperando una pausa breve entre teclas."""
+    global pending_search
+    if event is not None and event.keysym in TECLAS_SIN_TEXTO:
+        return
+    if pending_search is not None:
+        root.after_cancel(pending_search)
+    pending_search = root.after(RETRASO_BUSQUEDA_MS, run_pending_search)
+
+
+def run_pending_search():
+    global pending_search
+    pending_search = None
+    # Teclas que no cambian la búsqueda (p. ej. Ctrl+C) no vuelven a llenar las tablas
+    if (entry_search.get().strip(), search_mode_var.get()) == last_table_search:
+        return
+    search(seleccionar=False)
+
+
 def check_qty(item_qty, op, val_str):
     """
     Verifica si la cantidad del ítem cumple con el filtro numérico.
@@ -355,94 +605,100 @@ def check_qty(item_qty, op, val_str):
     return True
 
 
-def check_match(description, search_term, mode):
+class TablaVirtual:
+    """Lista virtual sobre un Treeview de resultados.
+
+    search() entrega todas las filas con mostrar(), pero en el Treeview solo se crean
+    las primeras PAGINA; se agregan más cuando el desplazamiento llega cerca del final.
+    Al mostrar otro resultado se compara con lo que ya está en pantalla: las filas que
+    siguen se conservan (y solo se tocan si cambió la cantidad o la etiqueta), las que
+    sobran se borran en una sola llamada y solo se insertan las nuevas.
     """
-    Verifica si la descripción coincide con el término de búsqueda según el modo.
+    PAGINA = 200
+    MARGEN_CARGA = 0.9  # Fracción visible a partir de la cual se carga la siguiente página
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.filas = []      # Resultado completo: [(clave, values, tags)]
+        self.indices = {}    # descripción -> posición de su primera fila en self.filas
+        self.iids = {}       # clave -> iid de las filas creadas en el Treeview
+        self.mostradas = 0
+        tree.configure(yscrollcommand=self._al_desplazar)
+
+    def mostrar(self, filas):
+        """Reemplaza el contenido por `filas`: [(descripcion, cantidad, tags)]."""
+        repetidas = {}
+        nuevas = []
+        for description, quantity, tags in filas:
+            # Una descripción repetida en el archivo da una fila por aparición
+            n = repetidas.get(description, 0)
+            repetidas[description] = n + 1
+            nuevas.append(((description, n), (description, quantity), tags))
+
+        anteriores = {clave: (values, tags) for clave, values, tags in self.filas[:self.mostradas]}
+        self.filas = nuevas
+        self.indices = {}
+        for i, (clave, values, tags) in enumerate(nuevas):
+            self.indices.setdefault(clave[0], i)
+        self.mostradas = min(len(nuevas), self.PAGINA)
+
+        visibles = {clave for clave, values, tags in nuevas[:self.mostradas]}
+        sobran = [iid for clave, iid in self.iids.items() if clave not in visibles]
+        if sobran:
+            self.tree.delete(*sobran)
+        iids = {}
+        orden = []
+        for clave, values, tags in nuevas[:self.mostradas]:
+            iid = self.iids.get(clave)
+            if iid is None:
+                iid = self.tree.insert("", tk.END, values=values, tags=tags)
+            elif anteriores[clave] != (values, tags):
+                self.tree.item(iid, values=values, tags=tags)
+            iids[clave] = iid
+            orden.append(iid)
+        self.iids = iids
+        # Las filas conservadas casi siempre quedan en orden; si no, se reordena en una llamada
+        if self.tree.get_children() != tuple(orden):
+            self.tree.set_children("", *orden)
+        if orden:
+            self.tree.yview_moveto(0)
+
+    def _cargar_hasta(self, cantidad):
+        cantidad = min(len(self.filas), cantidad)
+        for clave, values, tags in self.filas[self.mostradas:cantidad]:
+            self.iids[clave] = self.tree.insert("", tk.END, values=values, tags=tags)
+        self.mostradas = max(self.mostradas, cantidad)
+
+    def _al_desplazar(self, first, last):
+        if self.mostradas < len(self.filas) and float(last) >= self.MARGEN_CARGA:
+            self._cargar_hasta(self.mostradas + self.PAGINA)
+
+    def iid_de(self, description):
+        """iid de la primera fila con esa descripción (creándola si aún no se muestra), o None."""
+        i = self.indices.get(description)
+        if i is None:
+            return None
+        if i >= self.mostradas:
+            self._cargar_hasta(i + self.PAGINA)
+        return self.iids.get(self.filas[i][0])
+
+    def valores(self):
+        """Valores de todas las filas del resultado, también las que no se han creado."""
+        return [values for clave, values, tags in self.filas]
+
+
+def search(seleccionar=True):
+    """Llena las tres tablas con la búsqueda actual.
+
+    Con seleccionar=False (búsqueda mientras se escribe) no se selecciona ningún
+    ítem, porque al seleccionar se reemplaza el texto del cuadro de búsqueda.
     """
-    desc_lower = description.strip().lower()
-    term_lower = search_term.lower()
-
-    if mode == "phrase":  # Frase Exacta
-        return term_lower in desc_lower
-
-    elif mode == "keywords":  # Palabras Clave
-        words = term_lower.split()
-        if not words:
-            return True
-        return all(word in desc_lower for word in words)
-
-    elif mode == "advanced":  # Avanzada
-        # 1. Separar por coma (si existe) para obtener la base obligatoria
-        if "," in term_lower:
-            base_str, or_str = term_lower.split(",", 1)
-        else:
-            base_str, or_str = "", term_lower
-
-        # 2. Evaluar la base obligatoria (si existe)
-        if base_str:
-            base_parts = base_str.split()
-            for part in base_parts:
-                if part.startswith("-") and len(part) > 1:
-                    exclude_word = part[1:]
-                    # Lógica inteligente: Si solo son letras, exige palabra completa (\b)
-                    if exclude_word.isalpha():
-                        if re.search(
-                            r"\b" + re.escape(exclude_word) + r"\b", desc_lower
-                        ):
-                            return False
-                    else:
-                        if exclude_word in desc_lower:
-                            return False
-                else:
-                    if part not in desc_lower:
-                        return False
-
-        # Si llegamos aquí, la base obligatoria coincide (o no hay base).
-        # 3. Evaluar los grupos OR separados por '|'
-        if not or_str.strip():
-            return True  # Si no hay argumentos OR después de la coma, y la base coincidió, es True.
-
-        or_groups = or_str.split("|")
-        for group in or_groups:
-            parts = group.split()
-            if not parts:
-                continue
-
-            match_group = True
-            for part in parts:
-                if part.startswith("-") and len(part) > 1:
-                    exclude_word = part[1:]
-                    # Lógica inteligente: Si solo son letras, exige palabra completa (\b)
-                    if exclude_word.isalpha():
-                        if re.search(
-                            r"\b" + re.escape(exclude_word) + r"\b", desc_lower
-                        ):
-                            match_group = False
-                            break
-                    else:
-                        if exclude_word in desc_lower:
-                            match_group = False
-                            break
-                else:
-                    if part not in desc_lower:
-                        match_group = False
-                        break
-
-            # Si se cumple CUALQUIERA de los grupos divididos por '|', el ítem coincide
-            if match_group:
-                return True
-
-        return False  # Si evaluó todos los grupos OR y ninguno coincidió
-
-    return False
-
-
-def search():
-    global sticky_item
+    global sticky_item, last_table_search
     search_term = entry_search.get().strip()
     filter_extra = entry_filter.get().strip().lower()
     filter_words = filter_extra.split() if filter_extra else []
     mode = search_mode_var.get()
+    last_table_search = (search_term, mode)
 
     qty_op = qty_op_var.get()
     qty_val = entry_qty_val.get().strip()
@@ -450,12 +706,10 @@ def search():
     # Restablecer el estilo visual de la bodega por defecto al buscar
     tree_bodega.configure(style="Treeview")
 
-    for item in tree_bodega.get_children():
-        tree_bodega.delete(item)
-    for item in tree_local1.get_children():
-        tree_local1.delete(item)
-    for item in tree_local2.get_children():
-        tree_local2.delete(item)
+    # Cada búsqueda empieza sin selección (el foco pegajoso se vuelve a aplicar al final)
+    for tree in (tree_bodega, tree_local1, tree_local2):
+        if tree.selection():
+            tree.selection_remove(*tree.selection())
 
     pd_centro_qty_var.set("-")
     pd_pr_qty_var.set("-")
@@ -467,84 +721,84 @@ def search():
     stats_local2 = {"items": 0, "units": 0, "zeros": 0}
 
     if not search_term:
+        for tabla in (tabla_bodega, tabla_local1, tabla_local2):
+            tabla.mostrar([])
         var_bodega_stats.set("Items: 0 | Unidades: 0 | Sin Stock: 0")
         var_local1_stats.set("Items: 0 | Unidades: 0 | Sin Stock: 0")
         var_local2_stats.set("Items: 0 | Unidades: 0 | Sin Stock: 0")
         return
 
-    # Diccionarios rápidos para saber las cantidades en locales al vuelo
-    local1_dict = {desc.strip().lower(): qty for desc, qty in data_local1}
-    local2_dict = {desc.strip().lower(): qty for desc, qty in data_local2}
+    filas_bodega = []
+    filas_local1 = []
+    filas_local2 = []
 
     # Buscar en bodega
-    for description, quantity in data_bodega:
-        if check_match(description, search_term, mode):
-            if filter_words and not all(
-                word in description.lower() for word in filter_words
-            ):
-                continue
-            if not check_qty(quantity, qty_op, qty_val):
-                continue
-
-            # Lógica para colorear de AZUL los ítems a trasladar (falta en local 1 o local 2)
-            item_tags = ()
-            if quantity > 0 and (local1_dict.get(description.strip().lower(), 0) == 0 or local2_dict.get(description.strip().lower(), 0) == 0):
-                item_tags = ("transfer_alert",)
+    for description, quantity in filtrar_filas("bodegac.txt", data_bodega, search_term, mode):
+        texto = texto_busqueda(description)
+        if filter_words and not all(
+            word in texto for word in filter_words
+        ):
+            continue
+        if not check_qty(quantity, qty_op, qty_val):
+            continue
 
-            item_id = tree_bodega.insert(
-                "", tk.END, values=(description, quantity), tags=item_tags
-            )
+        # Lógica para colorear de AZUL los ítems a trasladar (falta en local 1 o local 2)
+        item_tags = ()
+        if quantity > 0 and (data_local1.cantidad(description) == 0 or data_local2.cantidad(description) == 0):
+            item_tags = ("transfer_alert",)
 
-            if sticky_item and description == sticky_item:
-                tree_bodega.selection_set(item_id)
-                tree_bodega.see(item_id)
+        filas_bodega.append((description, quantity, item_tags))
 
-            stats_bodega["items"] += 1
-            stats_bodega["units"] += quantity
-            if quantity == 0:
-                stats_bodega["zeros"] += 1
+        stats_bodega["items"] += 1
+        stats_bodega["units"] += quantity
+        if quantity == 0:
+            stats_bodega["zeros"] += 1
 
     # Buscar en local 1
-    for description, quantity in data_local1:
-        if check_match(description, search_term, mode):
-            if filter_words and not all(
-                word in description.lower() for word in filter_words
-            ):
-                continue
-            if not check_qty(quantity, qty_op, qty_val):
-                continue
-
-            item_id = tree_local1.insert("", tk.END, values=(description, quantity))
+    for description, quantity in filtrar_filas(current_local1_filename, data_local1, search_term, mode):
+        texto = texto_busqueda(description)
+        if filter_words and not all(
+            word in texto for word in filter_words
+        ):
+            continue
+        if not check_qty(quantity, qty_op, qty_val):
+            continue
 
-            if sticky_item and description == sticky_item:
-                tree_local1.selection_set(item_id)
-                tree_local1.see(item_id)
+        filas_local1.append((description, quantity, ()))
 
-            stats_local1["items"] += 1
-            stats_local1["units"] += quantity
-            if quantity == 0:
-                stats_local1["zeros"] += 1
+        stats_local1["items"] += 1
+        stats_local1["units"] += quantity
+        if quantity == 0:
+            stats_local1["zeros"] += 1
 
     # Buscar en local 2
-    for description, quantity in data_local2:
-        if check_match(description, search_term, mode):
-            if filter_words and not all(
-                word in description.lower() for word in filter_words
-            ):
-                continue
-            if not check_qty(quantity, qty_op, qty_val):
-                continue
+    for description, quantity in filtrar_filas(current_local2_filename, data_local2, search_term, mode):
+        texto = texto_busqueda(description)
+        if filter_words and not all(
+            word in texto for word in filter_words
+        ):
+            continue
+        if not check_qty(quantity, qty_op, qty_val):
+            continue
+
+        filas_local2.append((description, quantity, ()))
 
-            item_id = tree_local2.insert("", tk.END, values=(description, quantity))
+        stats_local2["items"] += 1
+        stats_local2["units"] += quantity
+        if quantity == 0:
+            stats_local2["zeros"] += 1
 
-            if sticky_item and description == sticky_item:
-                tree_local2.selection_set(item_id)
-                tree_local2.see(item_id)
+    # Solo se crean en el Treeview las filas visibles y las que cambiaron
+    tabla_bodega.mostrar(filas_bodega)
+    tabla_local1.mostrar(filas_local1)
+    tabla_local2.mostrar(filas_local2)
 
-            stats_local2["items"] += 1
-            stats_local2["units"] += quantity
-            if quantity == 0:
-                stats_local2["zeros"] += 1
+    if seleccionar and sticky_item:
+        for tabla in (tabla_bodega, tabla_local1, tabla_local2):
+            item_id = tabla.iid_de(sticky_item)
+            if item_id:
+                tabla.tree.selection_set(item_id)
+                tabla.tree.see(item_id)
 
     # Actualizar etiquetas de resumen
     var_bodega_stats.set(
@@ -557,6 +811,9 @@ def search():
         f"Items: {stats_local2['items']} | Unidades: {stats_local2['units']} | Sin Stock: {stats_local2['zeros']}"
     )
 
+    if not seleccionar:
+        return
+
     # --- NUEVO: Seleccionar el primer ítem por defecto ---
     bodega_children = tree_bodega.get_children()
     local1_children = tree_local1.get_children()
@@ -599,10 +856,8 @@ def print_results(target):
         title = f"Reporte de Inventario - Local 2 ({os.path.basename(current_local2_filename)})"
         stats = var_local2_stats.get()
 
-    items = []
-    for child in tree.get_children():
-        vals = tree.item(child, "values")
-        items.append((vals[0], vals[1]))
+    # Todas las filas del resultado, no solo las que ya se crearon en la tabla
+    items = [(vals[0], vals[1]) for vals in tablas_virtuales[tree].valores()]
 
     if not items:
         messagebox.showinfo("Imprimir", f"No hay datos para imprimir en {target}.")
@@ -701,6 +956,12 @@ def merge_duplicates(data_list):
     return list(merged.values())
 
 
+def espejo_de_bodega(bodega_clean, data_list):
+    """Filas de `data_list` (con duplicados fusionados) en el orden de bodega; lo que falta queda en 0."""
+    valores = {desc.lower(): qty for desc, qty in merge_duplicates(data_list)}
+    return [(desc, valores.get(desc.lower(), 0)) for desc, qty in bodega_clean]
+
+
 def normalize_files():
     global data_bodega, data_local1, data_local2
     
@@ -812,51 +1073,24 @@ def normalize_files():
         
         confirm = messagebox.askyesno("Confirmar Normalización Espejo Total", msg)
         if confirm:
-            # Reconstruir local 1
-            l1_dict_clean = {item[0].lower(): item[1] for item in data_local1_clean}
-            new_data_l1 = []
-            for desc, qty in data_bodega_clean:
-                qty_in_l1 = l1_dict_clean.get(desc.lower(), 0)
-                new_data_l1.append((desc, qty_in_l1))
-                
-            # Reconstruir local 2
-            l2_dict_clean = {item[0].lower(): item[1] for item in data_local2_clean}
-            new_data_l2 = []
-            for desc, qty in data_bodega_clean:
-                qty_in_l2 = l2_dict_clean.get(desc.lower(), 0)
-                new_data_l2.append((desc, qty_in_l2))
-                
-            # Reconstruir costos
-            if os.path.exists(cost_filename):
-                cost_dict_clean = {item[0].lower(): item[1] for item in data_cost_clean}
-                new_data_cost = []
-                for desc, val in data_bodega_clean:
-                    val_in_cost = cost_dict_clean.get(desc.lower(), 0)
-                    new_data_cost.append((desc, val_in_cost))
-                update_file(cost_filename, new_data_cost)
-
-            # Reconstruir precios de venta
-            if os.path.exists(acc_filename):
-                acc_dict_clean = {item[0].lower(): item[1] for item in data_acc_clean}
-                new_data_acc = []
-                for desc, val in data_bodega_clean:
-                    val_in_acc = acc_dict_clean.get(desc.lower(), 0)
-                    new_data_acc.append((desc, val_in_acc))
-                update_file(acc_filename, new_data_acc)
-                
-            data_bodega = data_bodega_clean
-            data_local1 = new_data_l1
-            data_local2 = new_data_l2
-            
-            # Guardar archivos
-            update_file("bodegac.txt", data_bodega)
-            update_file(current_local1_filename, data_local1)
-            update_file(current_local2_filename, data_local2)
+            # Se reconstruye sobre el contenido actual de los archivos (pudo cambiar mientras
+            # se confirmaba) y se guardan solo los que cambiaron
+            stock_files = archivos_stock()
+            price_files = archivos_existentes([cost_filename, acc_filename])
+            mirror_files = stock_files[1:] + price_files
+            with editar_archivos(*stock_files, *price_files) as edicion:
+                data_bodega_clean = merge_duplicates(data_bodega)
+                data_bodega.reemplazar(data_bodega_clean)
+                # Locales, costos y precios de venta: espejo de bodega
+                for _, tabla in mirror_files:
+                    tabla.reemplazar(espejo_de_bodega(data_bodega_clean, tabla))
+            if not edicion.ok:
+                return
             
             # Recargar
-            data_bodega = parse_file("bodegac.txt")
-            data_local1 = parse_file(current_local1_filename)
-            data_local2 = parse_file(current_local2_filename)
+            data_bodega = cargar_tabla("bodegac.txt")
+            data_local1 = cargar_tabla(current_local1_filename)
+            data_local2 = cargar_tabla(current_local2_filename)
             entry_search.delete(0, tk.END)
             entry_search.insert(0, last_search_term)
             search()
@@ -889,25 +1123,19 @@ def format_all_files_title_case():
         return
 
     processed_count = 0
-    for filename in files_to_format:
-        data = parse_file(filename)
-        if not data:
-            continue
-
-        formatted_data = []
-        for desc, qty in data:
-            # .title() convierte "hola mundo" a "Hola Mundo"
-            new_desc = desc.title()
-            formatted_data.append((new_desc, qty))
-
-        if update_file(filename, formatted_data):
+    for filename, data in archivos_existentes(files_to_format):
+        with editar_archivos((filename, data)) as edicion:
+            # .title() convierte "hola mundo" a "Hola Mundo"; si ya estaba así no se reescribe
+            data.reemplazar([(desc.title(), qty) for desc, qty in data])
+            changed = data.modificada
+        if edicion.ok and changed:
             processed_count += 1
 
     # Refrescar datos y búsqueda
     global data_bodega, data_local1, data_local2
-    data_bodega = parse_file("bodegac.txt")
-    data_local1 = parse_file(current_local1_filename)
-    data_local2 = parse_file(current_local2_filename)
+    data_bodega = cargar_tabla("bodegac.txt")
+    data_local1 = cargar_tabla(current_local1_filename)
+    data_local2 = cargar_tabla(current_local2_filename)
     search()  # Re-ejecutar búsqueda para ver los cambios
 
 
@@ -946,7 +1174,7 @@ def open_cost_manager():
     cost_window.title(f"Gestor de Costos - {os.path.basename(target_filename)}")
     cost_window.geometry("650x650")
     cost_window.configure(bg=BG_COLOR)
-    cost_data = parse_file(target_filename)
+    cost_data = cargar_tabla(target_filename)
 
     frame_cost_search = tk.Frame(cost_window, bg=BG_COLOR, pady=10)
     frame_cost_search.pack(fill=tk.X, padx=10)
@@ -1091,15 +1319,17 @@ def open_cost_manager():
         mode = cost_search_mode_var.get()
 
         base_words = base_text.split() if base_text else []
+        coincide = compilar_busqueda(search_text, mode)
         tree_cost.delete(*tree_cost.get_children())
 
         for desc, val in cost_data:
+            texto = texto_busqueda(desc)
             # 1. Filtro Base (Asegura que el ítem contenga las palabras clave obligatorias)
-            if base_words and not all(word in desc.lower() for word in base_words):
+            if base_words and not all(word in texto for word in base_words):
                 continue
 
             # 2. Búsqueda Principal usando la inteligencia del motor avanzado
-            if not search_text or check_match(desc, search_text, mode):
+            if not search_text or coincide(texto):
                 tree_cost.insert("", tk.END, values=(desc, val))
 
     # Bindings instantáneos para que la lista se actualice sola mientras escribes o cambias modo
@@ -1134,11 +1364,12 @@ def open_cost_manager():
             return
         new_val = int(new_val_str)
         item_desc = tree_cost.item(selected[0], "values")[0]
-        for i, (desc, val) in enumerate(cost_data):
-            if desc == item_desc:
-                cost_data[i] = (desc, new_val)
-                break
-        if update_file(target_filename, cost_data):
+        # El costo se aplica sobre el contenido actual del archivo, no sobre el de la ventana
+        with editar_archivos((target_filename, cost_data), parent=cost_window) as edicion:
+            i = cost_data.posicion(item_desc)
+            if i != -1:
+                cost_data.fijar_cantidad(i, new_val)
+        if edicion.ok:
             filter_costs()
             entry_new_cost.delete(0, tk.END)
 
@@ -1167,11 +1398,12 @@ def open_cost_manager():
         descriptions_to_update = set()
         for item_id in items_to_update:
             item_vals = tree_cost.item(item_id, "values")
-            descriptions_to_update.add(item_vals[0])
-        for i, (desc, val) in enumerate(cost_data):
-            if desc in descriptions_to_update:
-                cost_data[i] = (desc, new_val)
-        if update_file(target_filename, cost_data):
+            descriptions_to_update.add(texto_busqueda(item_vals[0]))
+        with editar_archivos((target_filename, cost_data), parent=cost_window) as edicion:
+            for i, (desc, val) in enumerate(cost_data):
+                if texto_busqueda(desc) in descriptions_to_update:
+                    cost_data.fijar_cantidad(i, new_val)
+        if edicion.ok:
             filter_costs()
             entry_new_cost.delete(0, tk.END)
 
@@ -1399,45 +1631,29 @@ def transfer_quantity(direction=None, src=None):
     src_list, src_file, src_label = lists[src]
     dst_list, dst_file, dst_label = lists[dst]
 
-    src_index, src_qty = -1, 0
-    dst_index, dst_qty = -1, 0
-
-    # Buscar en origen
-    for i, (desc, qty) in enumerate(src_list):
-        if desc.strip().lower() == search_term.lower():
-            src_index, src_qty = i, qty
-            break
-
-    # Buscar en destino
-    for i, (desc, qty) in enumerate(dst_list):
-        if desc.strip().lower() == search_term.lower():
-            dst_index, dst_qty = i, qty
-            break
-
-    if src_index == -1:
-        messagebox.showerror(
-            "Error", f"El artículo '{search_term}' no existe en {src_label}."
-        )
-        return
-
-    if src_qty < transfer_qty:
-        messagebox.showerror(
-            "Stock Insuficiente",
-            f"No hay suficiente stock en {src_label}. Disponible: {src_qty}",
-        )
-        return
+    # Se valida y descuenta sobre el contenido actual de ambos archivos
+    with editar_archivos((src_file, src_list), (dst_file, dst_list)) as edicion:
+        src_index = src_list.posicion(search_term)
+        if src_index == -1:
+            raise CambioRechazado(
+                "Error", f"El artículo '{search_term}' no existe en {src_label}."
+            )
 
-    exact_desc = src_list[src_index][0]
+        exact_desc, src_qty = src_list[src_index]
+        if src_qty < transfer_qty:
+            raise CambioRechazado(
+                "Stock Insuficiente",
+                f"No hay suficiente stock en {src_label}. Disponible: {src_qty}",
+            )
 
-    # Modificar datos en memoria
-    src_list[src_index] = (exact_desc, src_qty - transfer_qty)
-    if dst_index != -1:
-        dst_list[dst_index] = (exact_desc, dst_qty + transfer_qty)
-    else:
-        dst_list.append((exact_desc, transfer_qty))
+        src_list.fijar_cantidad(src_index, src_qty - transfer_qty)
+        dst_index = dst_list.posicion(search_term)
+        if dst_index != -1:
+            dst_list.fijar_cantidad(dst_index, dst_list[dst_index][1] + transfer_qty)
+        else:
+            dst_list.agregar(exact_desc, transfer_qty)
 
-    # Escribir ambos archivos de forma segura
-    if update_file(src_file, src_list) and update_file(dst_file, dst_list):
+    if edicion.ok:
         entry_transfer_qty.delete(0, tk.END)
         entry_search.delete(0, tk.END)
         entry_search.insert(0, last_search_term)
@@ -1489,35 +1705,29 @@ def adjust_quantity(target, action):
             filename = current_local2_filename
             target = "local2"
 
-    item_index, current_qty = -1, 0
-    for i, (desc, qty) in enumerate(data_list):
-        if desc.strip().lower() == search_term.lower():
-            item_index, current_qty = i, qty
-            break
-
-    if item_index == -1:
-        messagebox.showerror(
-            "Error",
-            f"El artículo seleccionado '{search_term}' no se encontró en {target}.",
-        )
-        return
+    with editar_archivos((filename, data_list)) as edicion:
+        item_index = data_list.posicion(search_term)
+        if item_index == -1:
+            raise CambioRechazado(
+                "Error",
+                f"El artículo seleccionado '{search_term}' no se encontró en {target}.",
+            )
 
-    exact_desc = data_list[item_index][0]
+        current_qty = data_list[item_index][1]
 
-    if action == "add":
-        new_qty = current_qty + adjust_qty
-        data_list[item_index] = (exact_desc, new_qty)
-    elif action == "remove":
-        if current_qty < adjust_qty:
-            messagebox.showerror(
-                "Stock Insuficiente",
-                f"No se pueden quitar {adjust_qty} unidades. Disponible en {target}: {current_qty}",
-            )
-            return
-        new_qty = current_qty - adjust_qty
-        data_list[item_index] = (exact_desc, new_qty)
+        if action == "add":
+            new_qty = current_qty + adjust_qty
+            data_list.fijar_cantidad(item_index, new_qty)
+        elif action == "remove":
+            if current_qty < adjust_qty:
+                raise CambioRechazado(
+                    "Stock Insuficiente",
+                    f"No se pueden quitar {adjust_qty} unidades. Disponible en {target}: {current_qty}",
+                )
+            new_qty = current_qty - adjust_qty
+            data_list.fijar_cantidad(item_index, new_qty)
 
-    if update_file(filename, data_list):
+    if edicion.ok:
         entry_adjust_qty.delete(0, tk.END)
         entry_search.delete(0, tk.END)
         entry_search.insert(0, last_search_term)
@@ -1545,41 +1755,25 @@ def create_new_item(event=None):
         )
         return
 
-    all_descriptions = {item[0].lower() for item in data_bodega} | {
-        item[0].lower() for item in data_local1
-    } | {
-        item[0].lower() for item in data_local2
-    }
-    if new_item_desc.lower() in all_descriptions:
-        messagebox.showerror(
-            "Ítem Existente", f"El ítem '{new_item_desc}' ya existe en el inventario."
-        )
-        return
+    stock_files = archivos_stock()
+    # Si existen los archivos de costos y precios de venta, el ítem se agrega también allí con 0
+    price_files = archivos_existentes(["dbcst.txt", "dbacc.txt"])
 
-    # Sin confirmación para mayor agilidad
-    data_bodega.append((new_item_desc, initial_qty))
-    data_local1.append((new_item_desc, 0))
-    data_local2.append((new_item_desc, 0))
+    with editar_archivos(*stock_files, *price_files) as edicion:
+        if any(tabla.contiene(new_item_desc) for _, tabla in stock_files):
+            raise CambioRechazado(
+                "Ítem Existente", f"El ítem '{new_item_desc}' ya existe en el inventario."
+            )
 
-    # Si existe el archivo de costos, agregamos el ítem también allí con costo 0
-    cost_filename = "dbcst.txt"
-    if os.path.exists(cost_filename):
-        cost_data = parse_file(cost_filename)
-        if not any(item[0].lower() == new_item_desc.lower() for item in cost_data):
-            cost_data.append((new_item_desc, 0))
-            update_file(cost_filename, cost_data)
+        # Sin confirmación para mayor agilidad
+        data_bodega.agregar(new_item_desc, initial_qty)
+        data_local1.agregar(new_item_desc, 0)
+        data_local2.agregar(new_item_desc, 0)
+        for _, tabla in price_files:
+            if not tabla.contiene(new_item_desc):
+                tabla.agregar(new_item_desc, 0)
 
-    # Si existe el archivo de precios de venta, agregamos el ítem también allí con precio 0
-    acc_filename = "dbacc.txt"
-    if os.path.exists(acc_filename):
-        acc_data = parse_file(acc_filename)
-        if not any(item[0].lower() == new_item_desc.lower() for item in acc_data):
-            acc_data.append((new_item_desc, 0))
-            update_file(acc_filename, acc_data)
-
-    if (update_file("bodegac.txt", data_bodega) and 
-        update_file(current_local1_filename, data_local1) and 
-        update_file(current_local2_filename, data_local2)):
+    if edicion.ok:
         sticky_item = new_item_desc
         entry_new_item.delete(0, tk.END)
         entry_new_qty_bodega.delete(0, tk.END)
@@ -1617,30 +1811,25 @@ def modify_purchase_order(filename, action):
         )
         return
 
-    order_data = parse_file(filename)
-    item_found_in_order = False
-
-    for i, (desc, qty) in enumerate(order_data):
-        if desc.strip().lower() == search_term.lower():
-            item_found_in_order = True
+    order_data = TablaStock()
+    with editar_archivos((filename, order_data)) as edicion:
+        i = order_data.posicion(search_term)
+        if i != -1:
+            qty = order_data[i][1]
             if action == "add":
-                order_data[i] = (desc, qty + pedido_qty)
+                order_data.fijar_cantidad(i, qty + pedido_qty)
             elif action == "remove":
                 new_qty = qty - pedido_qty
                 if new_qty <= 0:
-                    order_data.pop(i)  # Elimina de la lista si llega a 0 o menos
+                    order_data.eliminar(i)  # Elimina de la lista si llega a 0 o menos
                 else:
-                    order_data[i] = (desc, new_qty)
-            break
-
-    if not item_found_in_order:
-        if action == "add":
-            order_data.append((search_term, pedido_qty))
-        elif action == "remove":
-            # No hay nada que quitar
-            return
+                    order_data.fijar_cantidad(i, new_qty)
+        elif action == "add":
+            order_data.agregar(search_term, pedido_qty)
+        else:
+            return  # No hay nada que quitar
 
-    if update_file(filename, order_data):
+    if edicion.ok:
         entry_pedido_qty.delete(0, tk.END)
         entry_search.delete(0, tk.END)
         entry_search.insert(0, last_search_term)
@@ -1658,43 +1847,27 @@ def clean_orders():
     if not confirm:
         return
 
-    # Crear conjunto de ítems que ya tienen stock (> 0) en bodega o locales
-    items_with_stock = set()
-    for desc, qty in data_bodega:
-        if qty > 0:
-            items_with_stock.add(desc.strip().lower())
-    for desc, qty in data_local1:
-        if qty > 0:
-            items_with_stock.add(desc.strip().lower())
-    for desc, qty in data_local2:
-        if qty > 0:
-            items_with_stock.add(desc.strip().lower())
-
-    files_to_clean = ["pdcentro.txt", "pdpr.txt", "pdst.txt"]
+    stock_files = archivos_stock()
+    order_files = archivos_existentes(PROVIDER_FILES)
     total_removed = 0
     removed_details = []  # NUEVO: Lista para guardar el registro de eliminados
 
-    for filename in files_to_clean:
-        order_data = parse_file(filename)
-        if not order_data:
-            continue
-
-        new_order_data = []
-        for desc, qty in order_data:
-            if desc.strip().lower() not in items_with_stock:
-                new_order_data.append((desc, qty))
-            else:
-                total_removed += 1
-                # Guardamos el detalle de lo que se eliminó
-                provider_name = filename.replace(".txt", "").upper()
-                removed_details.append(f"{provider_name}: {desc} (Cant: {qty})")
-
-        # Solo actualizar el archivo si se eliminó al menos un elemento
-        if len(new_order_data) != len(order_data):
-            update_file(filename, new_order_data)
+    # Las existencias se consultan ya releídas; solo se reescriben los pedidos que cambian
+    with editar_archivos(*stock_files, *order_files) as edicion:
+        for filename, order_data in order_files:
+            with_stock = set()
+            for desc, qty in order_data:
+                # Se busca el ítem por descripción en cada tabla (sin recorrerlas)
+                if any(tabla.cantidad(desc) > 0 for _, tabla in stock_files):
+                    with_stock.add(texto_busqueda(desc))
+                    total_removed += 1
+                    # Guardamos el detalle de lo que se eliminó
+                    provider_name = filename.replace(".txt", "").upper()
+                    removed_details.append(f"{provider_name}: {desc} (Cant: {qty})")
+            order_data.quitar(with_stock)
 
     # NUEVO: Mostrar el resultado detallado en una ventana
-    if total_removed > 0:
+    if edicion.ok and total_removed > 0:
         detail_window = tk.Toplevel(root)
         detail_window.title("Registro de Limpieza")
         detail_window.geometry("550x400")
@@ -1850,51 +2023,19 @@ def delete_item():
         "Confirmar Eliminación", f"¿Está seguro de que desea eliminar '{search_term}'?"
     )
     if confirm:
-        global data_bodega, data_local1, data_local2
-        item_exists = any(
-            item[0].strip().lower() == search_term.lower() for item in data_bodega
-        ) or any(
-            item[0].strip().lower() == search_term.lower() for item in data_local1
-        ) or any(
-            item[0].strip().lower() == search_term.lower() for item in data_local2
-        )
-        if not item_exists:
-            messagebox.showinfo(
-                "No Encontrado", f"El ítem '{search_term}' no se encontró."
-            )
-            return
-        data_bodega = [
-            item
-            for item in data_bodega
-            if item[0].strip().lower() != search_term.lower()
-        ]
-        data_local1 = [
-            item
-            for item in data_local1
-            if item[0].strip().lower() != search_term.lower()
-        ]
-        data_local2 = [
-            item
-            for item in data_local2
-            if item[0].strip().lower() != search_term.lower()
-        ]
-        # Eliminar también de dbcst.txt si existe
-        cost_filename = "dbcst.txt"
-        if os.path.exists(cost_filename):
-            cost_data = parse_file(cost_filename)
-            cost_data = [item for item in cost_data if item[0].strip().lower() != search_term.lower()]
-            update_file(cost_filename, cost_data)
-
-        # Eliminar también de dbacc.txt si existe
-        acc_filename = "dbacc.txt"
-        if os.path.exists(acc_filename):
-            acc_data = parse_file(acc_filename)
-            acc_data = [item for item in acc_data if item[0].strip().lower() != search_term.lower()]
-            update_file(acc_filename, acc_data)
-
-        if (update_file("bodegac.txt", data_bodega) and 
-            update_file(current_local1_filename, data_local1) and 
-            update_file(current_local2_filename, data_local2)):
+        textos = {texto_busqueda(search_term)}
+        stock_files = archivos_stock()
+        # También de dbcst.txt y dbacc.txt si existen (solo se reescriben si estaba)
+        price_files = archivos_existentes(["dbcst.txt", "dbacc.txt"])
+        with editar_archivos(*stock_files, *price_files) as edicion:
+            if not any(tabla.contiene(search_term) for _, tabla in stock_files):
+                raise CambioRechazado(
+                    "No Encontrado", f"El ítem '{search_term}' no se encontró.", messagebox.showinfo
+                )
+            for _, tabla in stock_files + price_files:
+                tabla.quitar(textos)
+
+        if edicion.ok:
             sticky_item = ""  # Limpiamos el foco pegajoso porque el ítem se eliminó
             entry_search.delete(0, tk.END)
             entry_search.insert(0, last_search_term)
@@ -1902,14 +2043,8 @@ def delete_item():
 
 
 def delete_filtered_items():
-    global data_bodega, data_local1, data_local2
-    
     # 1. Obtener los artículos actualmente filtrados en la tabla de Bodega
-    items_to_delete = []
-    for item_id in tree_bodega.get_children():
-        values = tree_bodega.item(item_id, "values")
-        if values:
-            items_to_delete.append(values[0])
+    items_to_delete = [values[0] for values in tabla_bodega.valores()]
             
     if not items_to_delete:
         messagebox.showwarning(
@@ -1937,44 +2072,19 @@ def delete_filtered_items():
         return
         
     # 3. Proceder con la eliminación en memoria y archivos
-    lower_descs = {desc.strip().lower() for desc in items_to_delete}
+    lower_descs = {texto_busqueda(desc) for desc in items_to_delete}
     
-    # Filtrar en memoria
-    data_bodega = [item for item in data_bodega if item[0].strip().lower() not in lower_descs]
-    data_local1 = [item for item in data_local1 if item[0].strip().lower() not in lower_descs]
-    data_local2 = [item for item in data_local2 if item[0].strip().lower() not in lower_descs]
-    
-    # Guardar los inventarios principales
-    update_file("bodegac.txt", data_bodega)
-    update_file(current_local1_filename, data_local1)
-    update_file(current_local2_filename, data_local2)
-    
-    # Costos
-    cost_filename = "dbcst.txt"
-    if os.path.exists(cost_filename):
-        cost_data = parse_file(cost_filename)
-        cost_data = [item for item in cost_data if item[0].strip().lower() not in lower_descs]
-        update_file(cost_filename, cost_data)
-        
-    # Precios de Venta
-    acc_filename = "dbacc.txt"
-    if os.path.exists(acc_filename):
-        acc_data = parse_file(acc_filename)
-        acc_data = [item for item in acc_data if item[0].strip().lower() not in lower_descs]
-        update_file(acc_filename, acc_data)
-        
-    # Pedidos proveedores
-    provider_files = ["pdcentro.txt", "pdpr.txt", "pdst.txt"]
-    for filename in provider_files:
-        if os.path.exists(filename):
-            order_data = parse_file(filename)
-            if order_data:
-                order_data = [item for item in order_data if item[0].strip().lower() not in lower_descs]
-                update_file(filename, order_data)
+    # Inventarios principales, costos, precios de venta y pedidos (solo se guardan los que cambian)
+    files = archivos_stock() + archivos_existentes(["dbcst.txt", "dbacc.txt"] + PROVIDER_FILES)
+    with editar_archivos(*files) as edicion:
+        for _, tabla in files:
+            tabla.quitar(lower_descs)
                 
     # 4. Limpiar búsqueda y actualizar
     entry_search.delete(0, tk.END)
     search()
+    if not edicion.ok:
+        return
     
     messagebox.showinfo(
         "Eliminación Masiva Exitosa",
@@ -1984,7 +2094,6 @@ def delete_filtered_items():
 
 def edit_item(event=None):
     global sticky_item
-    global data_bodega, data_local1, data_local2
     old_desc = entry_search.get().strip()
     new_desc = entry_edit_item.get().strip()
     if not old_desc:
@@ -1998,84 +2107,29 @@ def edit_item(event=None):
     if old_desc.lower() == new_desc.lower():
         messagebox.showinfo("Sin Cambios", "El nuevo nombre es igual al actual.")
         return
-    all_descriptions = {item[0].lower() for item in data_bodega} | {
-        item[0].lower() for item in data_local1
-    } | {
-        item[0].lower() for item in data_local2
-    }
-    if new_desc.lower() in all_descriptions:
-        messagebox.showerror(
-            "Ítem Existente", "El ítem ya existe. Por favor elija otro nombre."
-        )
-        return
+    stock_files = archivos_stock()
+    # El nombre cambia también en los pedidos, dbcst.txt y dbacc.txt si existen
+    other_files = archivos_existentes(PROVIDER_FILES + ["dbcst.txt", "dbacc.txt"])
+
+    with editar_archivos(*stock_files, *other_files) as edicion:
+        if any(tabla.contiene(new_desc) for _, tabla in stock_files):
+            raise CambioRechazado(
+                "Ítem Existente", "El ítem ya existe. Por favor elija otro nombre."
+            )
 
-    # Sin confirmación para mayor agilidad
-    item_found_and_changed = False
-    for i, (desc, qty) in enumerate(data_bodega):
-        if desc.strip().lower() == old_desc.lower():
-            data_bodega[i] = (new_desc, qty)
-            item_found_and_changed = True
-            break
-
-    for i, (desc, qty) in enumerate(data_local1):
-        if desc.strip().lower() == old_desc.lower():
-            data_local1[i] = (new_desc, qty)
-            item_found_and_changed = True
-            break
-
-    for i, (desc, qty) in enumerate(data_local2):
-        if desc.strip().lower() == old_desc.lower():
-            data_local2[i] = (new_desc, qty)
-            item_found_and_changed = True
-            break
-
-    if not item_found_and_changed:
-        messagebox.showinfo("No Encontrado", "No se encontró el ítem.")
-        return
+        # Sin confirmación para mayor agilidad
+        item_found_and_changed = False
+        for _, tabla in stock_files:
+            if tabla.renombrar(old_desc, new_desc):
+                item_found_and_changed = True
 
-    provider_files = ["pdcentro.txt", "pdpr.txt", "pdst.txt"]
-    for filename in provider_files:
-        order_data = parse_file(filename)
-        if not order_data:
-            continue
-        item_found_in_order = False
-        for i, (desc, qty) in enumerate(order_data):
-            if desc.strip().lower() == old_desc.lower():
-                order_data[i] = (new_desc, qty)
-                item_found_in_order = True
-                break
-        if item_found_in_order:
-            update_file(filename, order_data)
-
-    # Editar también en dbcst.txt si existe
-    cost_filename = "dbcst.txt"
-    if os.path.exists(cost_filename):
-        cost_data = parse_file(cost_filename)
-        cost_changed = False
-        for i, (desc, qty) in enumerate(cost_data):
-            if desc.strip().lower() == old_desc.lower():
-                cost_data[i] = (new_desc, qty)
-                cost_changed = True
-                break
-        if cost_changed:
-            update_file(cost_filename, cost_data)
-
-    # Editar también en dbacc.txt si existe
-    acc_filename = "dbacc.txt"
-    if os.path.exists(acc_filename):
-        acc_data = parse_file(acc_filename)
-        acc_changed = False
-        for i, (desc, qty) in enumerate(acc_data):
-            if desc.strip().lower() == old_desc.lower():
-                acc_data[i] = (new_desc, qty)
-                acc_changed = True
-                break
-        if acc_changed:
-            update_file(acc_filename, acc_data)
-
-    if (update_file("bodegac.txt", data_bodega) and 
-        update_file(current_local1_filename, data_local1) and 
-        update_file(current_local2_filename, data_local2)):
+        if not item_found_and_changed:
+            raise CambioRechazado("No Encontrado", "No se encontró el ítem.", messagebox.showinfo)
+
+        for _, tabla in other_files:
+            tabla.renombrar(old_desc, new_desc)
+
+    if edicion.ok:
         sticky_item = new_desc
         entry_edit_item.delete(0, tk.END)
         entry_search.delete(0, tk.END)
@@ -2193,9 +2247,11 @@ def clear_search(event=None):
 
 
 # --- Carga de Datos ---
-data_bodega = parse_file("bodegac.txt")
-data_local1 = parse_file(current_local1_filename)
-data_local2 = parse_file(current_local2_filename)
+data_bodega = cargar_tabla("bodegac.txt")
+data_local1 = cargar_tabla(current_local1_filename)
+data_local2 = cargar_tabla(current_local2_filename)
+for provider_file in PROVIDER_FILES:
+    pedido(provider_file)  # Deja los pedidos en memoria
 
 # --- Configuración de la Interfaz Gráfica ---
 root = tk.Tk()
@@ -2291,6 +2347,7 @@ entry_search = ttk.Combobox(entry_search_container, font=("Helvetica", 12), widt
 entry_search.pack(expand=True, fill=tk.BOTH, padx=1, pady=1)
 entry_search.bind("<Return>", manual_search)
 entry_search.bind("<<ComboboxSelected>>", manual_search)
+entry_search.bind("<KeyRelease>", search_as_you_type)
 entry_search["values"] = search_history  # NUEVO: Asignar historial cargado
 
 button_search = tk.Button(
@@ -2687,6 +2744,11 @@ btn_print_local2 = tk.Button(
 btn_print_local2.pack(side=tk.RIGHT, padx=(5, 0))
 
 # --- BINDINGS (Eventos de Clic) ---
+tabla_bodega = TablaVirtual(tree_bodega)
+tabla_local1 = TablaVirtual(tree_local1)
+tabla_local2 = TablaVirtual(tree_local2)
+tablas_virtuales = {tree_bodega: tabla_bodega, tree_local1: tabla_local1, tree_local2: tabla_local2}
+
 tree_bodega.bind("<<TreeviewSelect>>", on_item_select)
 tree_local1.bind("<<TreeviewSelect>>", on_item_select)
 tree_local2.bind("<<TreeviewSelect>>", on_item_select)
@@ -8,6 +8,7 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 import subprocess
 import hashlib
+from almacenamiento import abrir_atomico, bloqueo_archivo
 
 # --- PARCHE DE COMPATIBILIDAD para hashlib en versiones antiguas de Python ---
 try:
@@ -517,29 +518,32 @@ class GestorInventario:
         if not os.path.exists(self.archivo_costos):
             with open(self.archivo_costos, "w", encoding="utf-8") as f:
                 pass
-        if not os.path.exists(self.archivo_ventas):
-            with open(self.archivo_ventas, "w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(
-                    [
-                        "Timestamp",
-                        "ID_Venta",
-                        "Descripcion",
-                        "Cantidad",
-                        "CostoUnitario",
-                        "PrecioUnitario",
-                        "TotalVenta",
-                        "Ganancia",
-                        "ArchivoOrigen",
-                        "Cliente",
-                        "MedioPago",
-                        "Estado",
-                    ]
-                )
-        if not os.path.exists(self.archivo_clientes):
-            with open(self.archivo_clientes, "w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(["Nombre", "Contacto"])
+        # El servidor también crea y agrega a estos archivos: se revisan bajo su bloqueo
+        with bloqueo_archivo(self.archivo_ventas):
+            if not os.path.exists(self.archivo_ventas):
+                with open(self.archivo_ventas, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(
+                        [
+                            "Timestamp",
+                            "ID_Venta",
+                            "Descripcion",
+                            "Cantidad",
+                            "CostoUnitario",
+                            "PrecioUnitario",
+                            "TotalVenta",
+                            "Ganancia",
+                            "ArchivoOrigen",
+                            "Cliente",
+                            "MedioPago",
+                            "Estado",
+                        ]
+                    )
+        with bloqueo_archivo(self.archivo_clientes):
+            if not os.path.exists(self.archivo_clientes):
+                with open(self.archivo_clientes, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["Nombre", "Contacto"])
 
         if not os.path.exists(self.directorio_facturas):
             os.makedirs(self.directorio_facturas)
@@ -562,20 +566,24 @@ class GestorInventario:
         if not nombre or nombre.lower() == "cliente general":
             return
 
-        clientes = self.obtener_clientes()
-        # Actualizar solo si es un cliente nuevo o si su contacto cambió
-        if nombre not in clientes or clientes[nombre] != contacto:
-            clientes[nombre] = contacto
-            try:
-                with open(
-                    self.archivo_clientes, "w", encoding="utf-8", newline=""
+        try:
+            # Lectura y reescritura bajo el mismo bloqueo: el servidor agrega clientes a
+            # este archivo y no deben perderse al reescribirlo
+            with bloqueo_archivo(self.archivo_clientes):
+                clientes = self.obtener_clientes()
+                # Actualizar solo si es un cliente nuevo o si su contacto cambió
+                if nombre in clientes and clientes[nombre] == contacto:
+                    return
+                clientes[nombre] = contacto
+                with abrir_atomico(
+                    self.archivo_clientes, encoding="utf-8", newline=""
                 ) as f:
                     writer = csv.writer(f)
                     writer.writerow(["Nombre", "Contacto"])
                     for n, c in clientes.items():
                         writer.writerow([n, c])
-            except Exception as e:
-                print(f"Error guardando cliente: {e}")
+        except Exception as e:
+            print(f"Error guardando cliente: {e}")
 
     def procesar_item_venta(
         self, id_venta, timestamp, item_details, cliente, medio_pago
@@ -586,7 +594,7 @@ class GestorInventario:
             costo = item_details["costo"]
 
             success, msg = self.modificar_cantidad(
-                item_details["linea_num"], -cantidad_vendida
+                item_details["linea_num"], -cantidad_vendida, item_details["desc"]
             )
             if not success:
                 return (
@@ -614,8 +622,11 @@ class GestorInventario:
                 "Completada",  # Nuevo estado
             ]
 
-            with open(self.archivo_ventas, "a", encoding="utf-8", newline="") as f:
-                csv.writer(f).writerow(venta_data)
+            # Bajo el bloqueo: el registro se reemplaza atómicamente en otros programas y un
+            # agregado sin bloqueo podría caer en el archivo ya reemplazado
+            with bloqueo_archivo(self.archivo_ventas):
+                with open(self.archivo_ventas, "a", encoding="utf-8", newline="") as f:
+                    csv.writer(f).writerow(venta_data)
 
             return True, "Item procesado."
         except Exception as e:
@@ -628,24 +639,25 @@ class GestorInventario:
             return False, f"El archivo '{archivo_local}' no existe."
 
         try:
-            with open(archivo_local, "r", encoding="utf-8") as f:
-                lineas = f.readlines()
+            with bloqueo_archivo(archivo_local):
+                with open(archivo_local, "r", encoding="utf-8") as f:
+                    lineas = f.readlines()
 
-            item_encontrado = False
-            descripcion_stripped = descripcion.strip()
-            for i, linea in enumerate(lineas):
-                partes = linea.strip().rsplit(" ", 1)
-                if len(partes) == 2 and partes[0].strip() == descripcion_stripped:
-                    nueva_cantidad = int(partes[1]) + cantidad
-                    lineas[i] = f"    {descripcion_stripped} {nueva_cantidad}\n"
-                    item_encontrado = True
-                    break
+                item_encontrado = False
+                descripcion_stripped = descripcion.strip()
+                for i, linea in enumerate(lineas):
+                    partes = linea.strip().rsplit(" ", 1)
+                    if len(partes) == 2 and partes[0].strip() == descripcion_stripped:
+                        nueva_cantidad = int(partes[1]) + cantidad
+                        lineas[i] = f"    {descripcion_stripped} {nueva_cantidad}\n"
+                        item_encontrado = True
+                        break
 
-            if not item_encontrado:
-                lineas.append(f"    {descripcion_stripped} {cantidad}\n")
+                if not item_encontrado:
+                    lineas.append(f"    {descripcion_stripped} {cantidad}\n")
 
-            with open(archivo_local, "w", encoding="utf-8") as f:
-                f.writelines(lineas)
+                with abrir_atomico(archivo_local, encoding="utf-8") as f:
+                    f.writelines(lineas)
             return (
                 True,
                 f"{cantidad} unidad(es) de '{descripcion_stripped}' devueltas a {archivo_local}.",
@@ -658,171 +670,175 @@ class GestorInventario:
             id_venta_anular
         )  # Forzar a string para evitar errores de tipo
         try:
-            try:
-                with open(self.archivo_ventas, "r", encoding="utf-8") as f:
-                    reader = csv.reader(f)
-                    all_lines = list(reader)
-            except FileNotFoundError:
-                return False, "El archivo de registro de ventas no existe."
+            # El registro queda bloqueado desde la lectura hasta el reemplazo: una venta que
+            # el servidor agregue mientras tanto no se pierde al reescribir el archivo
+            with bloqueo_archivo(self.archivo_ventas):
+                try:
+                    with open(self.archivo_ventas, "r", encoding="utf-8") as f:
+                        reader = csv.reader(f)
+                        all_lines = list(reader)
+                except FileNotFoundError:
+                    return False, "El archivo de registro de ventas no existe."
 
-            if not all_lines:
-                return False, "El registro de ventas está vacío."
+                if not all_lines:
+                    return False, "El registro de ventas está vacío."
 
-            header = all_lines[0]
+                header = all_lines[0]
 
-            if "ID_Venta" in header:
-                has_header = True
-                start_index = 1
-                try:
-                    id_venta_idx = header.index("ID_Venta")
-                    desc_idx = header.index("Descripcion")
-                    cant_idx = header.index("Cantidad")
-
-                    if "Estado" not in header:
-                        header.append("Estado")
-                        for i in range(start_index, len(all_lines)):
-                            all_lines[i].append("Completada")
-
-                    estado_idx = header.index("Estado")
-                except ValueError as e:
-                    return (
-                        False,
-                        f"El encabezado del archivo de ventas es incorrecto. Falta la columna: {e}",
-                    )
-            else:
-                has_header = False
-                start_index = 0
-                id_venta_idx = 1
-                desc_idx = 2
-                cant_idx = 3
-                estado_idx = 11
-
-            items_restaurados = []
-            venta_encontrada = False
-            lineas_restantes = [header] if has_header else []
-
-            for i in range(start_index, len(all_lines)):
-                row = all_lines[i]
-                while len(row) <= estado_idx:
-                    row.append("")
-                if not row[estado_idx]:
-                    row[estado_idx] = "Completada"
-
-                # Si coincide el ID, restauramos el stock y NO agregamos la fila a lineas_restantes (se elimina)
-                if row[id_venta_idx] == id_venta_anular:
-                    venta_encontrada = True
-                    desc = row[desc_idx]
+                if "ID_Venta" in header:
+                    has_header = True
+                    start_index = 1
                     try:
-                        cant = int(row[cant_idx])
-                        archivo_origen = "local.txt"
-                        if has_header and "ArchivoOrigen" in header:
-                            archivo_origen_idx = header.index("ArchivoOrigen")
-                            if len(row) > archivo_origen_idx and row[archivo_origen_idx]:
-                                archivo_origen = row[archivo_origen_idx]
-                        elif len(row) > 8 and row[8]:
-                            archivo_origen = row[8]
-                        success, msg = self._restaurar_stock_item(desc, cant, archivo_origen)
-                        if not success:
-                            return False, f"No se pudo restaurar el stock: {msg}"
-                        items_restaurados.append(msg)
-                    except (ValueError, IndexError):
+                        id_venta_idx = header.index("ID_Venta")
+                        desc_idx = header.index("Descripcion")
+                        cant_idx = header.index("Cantidad")
+
+                        if "Estado" not in header:
+                            header.append("Estado")
+                            for i in range(start_index, len(all_lines)):
+                                all_lines[i].append("Completada")
+
+                        estado_idx = header.index("Estado")
+                    except ValueError as e:
                         return (
                             False,
-                            f"Dato inválido en la venta {id_venta_anular}. No se pudo anular.",
+                            f"El encabezado del archivo de ventas es incorrecto. Falta la columna: {e}",
                         )
                 else:
-                    lineas_restantes.append(row)
-
-            if not venta_encontrada:
-                return False, "No se encontró la venta o ya estaba anulada."
-
-            if not has_header:
-                new_header = [
-                    "Timestamp",
-                    "ID_Venta",
-                    "Descripcion",
-                    "Cantidad",
-                    "CostoUnitario",
-                    "PrecioUnitario",
-                    "TotalVenta",
-                    "Ganancia",
-                    "ArchivoOrigen",
-                    "Cliente",
-                    "MedioPago",
-                    "Estado",
-                ]
-                lineas_restantes.insert(0, new_header)
+                    has_header = False
+                    start_index = 0
+                    id_venta_idx = 1
+                    desc_idx = 2
+                    cant_idx = 3
+                    estado_idx = 11
+
+                items_restaurados = []
+                venta_encontrada = False
+                lineas_restantes = [header] if has_header else []
+
+                for i in range(start_index, len(all_lines)):
+                    row = all_lines[i]
+                    while len(row) <= estado_idx:
+                        row.append("")
+                    if not row[estado_idx]:
+                        row[estado_idx] = "Completada"
+
+                    # Si coincide el ID, restauramos el stock y NO agregamos la fila a lineas_restantes (se elimina)
+                    if row[id_venta_idx] == id_venta_anular:
+                        venta_encontrada = True
+                        desc = row[desc_idx]
+                        try:
+                            cant = int(row[cant_idx])
+                            archivo_origen = "local.txt"
+                            if has_header and "ArchivoOrigen" in header:
+                                archivo_origen_idx = header.index("ArchivoOrigen")
+                                if len(row) > archivo_origen_idx and row[archivo_origen_idx]:
+                                    archivo_origen = row[archivo_origen_idx]
+                            elif len(row) > 8 and row[8]:
+                                archivo_origen = row[8]
+                            success, msg = self._restaurar_stock_item(desc, cant, archivo_origen)
+                            if not success:
+                                return False, f"No se pudo restaurar el stock: {msg}"
+                            items_restaurados.append(msg)
+                        except (ValueError, IndexError):
+                            return (
+                                False,
+                                f"Dato inválido en la venta {id_venta_anular}. No se pudo anular.",
+                            )
+                    else:
+                        lineas_restantes.append(row)
+
+                if not venta_encontrada:
+                    return False, "No se encontró la venta o ya estaba anulada."
+
+                if not has_header:
+                    new_header = [
+                        "Timestamp",
+                        "ID_Venta",
+                        "Descripcion",
+                        "Cantidad",
+                        "CostoUnitario",
+                        "PrecioUnitario",
+                        "TotalVenta",
+                        "Ganancia",
+                        "ArchivoOrigen",
+                        "Cliente",
+                        "MedioPago",
+                        "Estado",
+                    ]
+                    lineas_restantes.insert(0, new_header)
 
-            with open(self.archivo_ventas, "w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerows(lineas_restantes)
+                with abrir_atomico(self.archivo_ventas, encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerows(lineas_restantes)
 
-            return True, "Venta eliminada por completo con éxito.\n" + "\n".join(
-                items_restaurados
-            )
+                return True, "Venta eliminada por completo con éxito.\n" + "\n".join(
+                    items_restaurados
+                )
 
         except Exception as e:
             return False, f"Error inesperado al anular la venta: {e}"
 
     def modificar_venta_completa(self, id_venta, item_match, nuevos_datos):
         try:
-            with open(self.archivo_ventas, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                all_lines = list(reader)
-
-            if not all_lines:
-                return False, "El registro de ventas está vacío."
-
-            # Índices por defecto
-            id_venta_idx = 1
-            desc_idx = 2
-            cant_idx = 3
-            costo_idx = 4
-            precio_idx = 5
-            total_idx = 6
-            ganancia_idx = 7
-            cliente_idx = 9
-            medio_pago_idx = 10
-
-            changes_made = False
-            item_updated = False
-
-            for i in range(1, len(all_lines)):
-                row = all_lines[i]
-                if len(row) > medio_pago_idx and row[id_venta_idx] == id_venta:
-                    # 1. Actualizar datos generales (Cliente, MedioPago) para TODA la venta
-                    row[cliente_idx] = nuevos_datos["cliente"]
-                    row[medio_pago_idx] = nuevos_datos["medio_pago"]
-                    changes_made = True
-
-                    # 2. Actualizar datos específicos del ítem (si coincide la fila exacta)
-                    if (
-                        not item_updated
-                        and row[desc_idx] == item_match["desc"]
-                        and str(row[cant_idx]) == str(item_match["cant"])
-                    ):
-                        row[desc_idx] = nuevos_datos["desc"]
-                        row[cant_idx] = str(nuevos_datos["cant"])
-                        row[costo_idx] = f"{nuevos_datos['costo']:.2f}"
-                        row[precio_idx] = f"{nuevos_datos['precio']:.2f}"
-
-                        # Recalcular Total y Ganancia
-                        total = nuevos_datos["cant"] * nuevos_datos["precio"]
-                        ganancia = (
-                            nuevos_datos["precio"] - nuevos_datos["costo"]
-                        ) * nuevos_datos["cant"]
-                        row[total_idx] = f"{total:.2f}"
-                        row[ganancia_idx] = f"{ganancia:.2f}"
-
-                        item_updated = True
-
-            if changes_made:
-                with open(self.archivo_ventas, "w", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerows(all_lines)
-                return True, "Datos de la venta actualizados correctamente."
-            else:
-                return False, "No se encontró la venta con ese ID."
+            with bloqueo_archivo(self.archivo_ventas):
+                with open(self.archivo_ventas, "r", encoding="utf-8") as f:
+                    reader = csv.reader(f)
+                    all_lines = list(reader)
+
+                if not all_lines:
+                    return False, "El registro de ventas está vacío."
+
+                # Índices por defecto
+                id_venta_idx = 1
+                desc_idx = 2
+                cant_idx = 3
+                costo_idx = 4
+                precio_idx = 5
+                total_idx = 6
+                ganancia_idx = 7
+                cliente_idx = 9
+                medio_pago_idx = 10
+
+                changes_made = False
+                item_updated = False
+
+                for i in range(1, len(all_lines)):
+                    row = all_lines[i]
+                    if len(row) > medio_pago_idx and row[id_venta_idx] == id_venta:
+                        # 1. Actualizar datos generales (Cliente, MedioPago) para TODA la venta
+                        row[cliente_idx] = nuevos_datos["cliente"]
+                        row[medio_pago_idx] = nuevos_datos["medio_pago"]
+                        changes_made = True
+
+                        # 2. Actualizar datos específicos del ítem (si coincide la fila exacta)
+                        if (
+                            not item_updated
+                            and row[desc_idx] == item_match["desc"]
+                            and str(row[cant_idx]) == str(item_match["cant"])
+                        ):
+                            row[desc_idx] = nuevos_datos["desc"]
+                            row[cant_idx] = str(nuevos_datos["cant"])
+                            row[costo_idx] = f"{nuevos_datos['costo']:.2f}"
+                            row[precio_idx] = f"{nuevos_datos['precio']:.2f}"
+
+                            # Recalcular Total y Ganancia
+                            total = nuevos_datos["cant"] * nuevos_datos["precio"]
+                            ganancia = (
+                                nuevos_datos["precio"] - nuevos_datos["costo"]
+                            ) * nuevos_datos["cant"]
+                            row[total_idx] = f"{total:.2f}"
+                            row[ganancia_idx] = f"{ganancia:.2f}"
+
+                            item_updated = True
+
+                if changes_made:
+                    with abrir_atomico(self.archivo_ventas, encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        writer.writerows(all_lines)
+                    return True, "Datos de la venta actualizados correctamente."
+                else:
+                    return False, "No se encontró la venta con ese ID."
 
         except Exception as e:
             return False, f"Error al modificar la venta: {e}"
@@ -1043,33 +1059,39 @@ class GestorInventario:
         except Exception as e:
             return [], [f"Error al leer: {e}"]
 
-    def modificar_linea(self, num_linea, desc, cant):
+    def modificar_linea(self, num_linea, desc, cant, desc_actual=None):
         try:
-            lineas = self._leer_lineas_archivo()
-            if 1 <= num_linea <= len(lineas):
-                lineas[num_linea - 1] = f"    {desc} {int(cant)}\n"
-                self._escribir_lineas_archivo(lineas)
-                return True, "Ítem modificado."
+            # Leer, modificar y escribir con el archivo bloqueado (el servidor también lo escribe)
+            with bloqueo_archivo(self.archivo_inventario):
+                lineas = self._leer_lineas_archivo()
+                i = self._ubicar_linea(lineas, num_linea, desc_actual)
+                if i is not None:
+                    lineas[i] = f"    {desc} {int(cant)}\n"
+                    self._escribir_lineas_archivo(lineas)
+                    return True, "Ítem modificado."
             return False, "Número de línea fuera de rango."
         except ValueError:
             return False, "Cantidad debe ser un número."
         except Exception as e:
             return False, f"Error: {e}"
 
-    def modificar_cantidad(self, num_linea, cambio):
+    def modificar_cantidad(self, num_linea, cambio, descripcion=None):
         try:
-            lineas = self._leer_lineas_archivo()
-            if 1 <= num_linea <= len(lineas):
-                partes = lineas[num_linea - 1].strip().rsplit(" ", 1)
-                if len(partes) == 2:
-                    desc, cant_str = partes
-                    nueva_cant = int(cant_str) + int(cambio)
-                    if nueva_cant < 0:
-                        return False, "Stock no puede ser negativo."
-                    lineas[num_linea - 1] = f"    {desc.strip()} {nueva_cant}\n"
-                    self._escribir_lineas_archivo(lineas)
-                    return True, "Stock actualizado."
-                return False, "Formato de línea inválido."
+            # El cambio se suma a la cantidad que hay ahora en el archivo, leída con el bloqueo tomado
+            with bloqueo_archivo(self.archivo_inventario):
+                lineas = self._leer_lineas_archivo()
+                i = self._ubicar_linea(lineas, num_linea, descripcion)
+                if i is not None:
+                    partes = lineas[i].strip().rsplit(" ", 1)
+                    if len(partes) == 2:
+                        desc, cant_str = partes
+                        nueva_cant = int(cant_str) + int(cambio)
+                        if nueva_cant < 0:
+                            return False, "Stock no puede ser negativo."
+                        lineas[i] = f"    {desc.strip()} {nueva_cant}\n"
+                        self._escribir_lineas_archivo(lineas)
+                        return True, "Stock actualizado."
+                    return False, "Formato de línea inválido."
             return False, "Número de línea fuera de rango."
         except ValueError:
             return False, "Cantidad debe ser un número."
@@ -1079,30 +1101,29 @@ class GestorInventario:
     def transferir_a_local(self, descripcion, cantidad_transferida):
         archivo_local = "local.txt"
         try:
-            if not os.path.exists(archivo_local):
-                with open(archivo_local, "w", encoding="utf-8") as f:
-                    pass
-
-            with open(archivo_local, "r", encoding="utf-8") as f:
-                lineas = f.readlines()
-
-            item_encontrado = False
-            descripcion_stripped = descripcion.strip()
-            for i, linea in enumerate(lineas):
-                partes = linea.strip().rsplit(" ", 1)
-                if len(partes) == 2:
-                    desc_local, cant_actual_str = partes
-                    if desc_local.strip() == descripcion_stripped:
-                        nueva_cantidad = int(cant_actual_str) + cantidad_transferida
-                        lineas[i] = f"    {descripcion_stripped} {nueva_cantidad}\n"
-                        item_encontrado = True
-                        break
-
-            if not item_encontrado:
-                lineas.append(f"    {descripcion_stripped} {cantidad_transferida}\n")
-
-            with open(archivo_local, "w", encoding="utf-8") as f:
-                f.writelines(lineas)
+            with bloqueo_archivo(archivo_local):
+                lineas = []
+                if os.path.exists(archivo_local):
+                    with open(archivo_local, "r", encoding="utf-8") as f:
+                        lineas = f.readlines()
+
+                item_encontrado = False
+                descripcion_stripped = descripcion.strip()
+                for i, linea in enumerate(lineas):
+                    partes = linea.strip().rsplit(" ", 1)
+                    if len(partes) == 2:
+                        desc_local, cant_actual_str = partes
+                        if desc_local.strip() == descripcion_stripped:
+                            nueva_cantidad = int(cant_actual_str) + cantidad_transferida
+                            lineas[i] = f"    {descripcion_stripped} {nueva_cantidad}\n"
+                            item_encontrado = True
+                            break
+
+                if not item_encontrado:
+                    lineas.append(f"    {descripcion_stripped} {cantidad_transferida}\n")
+
+                with abrir_atomico(archivo_local, encoding="utf-8") as f:
+                    f.writelines(lineas)
             return (
                 True,
                 f"Item '{descripcion_stripped}' actualizado en {archivo_local}.",
@@ -1110,13 +1131,15 @@ class GestorInventario:
         except Exception as e:
             return False, f"No se pudo actualizar {archivo_local}: {e}"
 
-    def eliminar_linea(self, num_linea):
+    def eliminar_linea(self, num_linea, descripcion=None):
         try:
-            lineas = self._leer_lineas_archivo()
-            if 1 <= num_linea <= len(lineas):
-                linea_eliminada = lineas.pop(num_linea - 1)
-                self._escribir_lineas_archivo(lineas)
-                return True, f"Eliminado: {linea_eliminada.strip()}"
+            with bloqueo_archivo(self.archivo_inventario):
+                lineas = self._leer_lineas_archivo()
+                i = self._ubicar_linea(lineas, num_linea, descripcion)
+                if i is not None:
+                    linea_eliminada = lineas.pop(i)
+                    self._escribir_lineas_archivo(lineas)
+                    return True, f"Eliminado: {linea_eliminada.strip()}"
             return False, "Número de línea fuera de rango."
         except Exception as e:
             return False, f"Error: {e}"
@@ -1140,12 +1163,31 @@ class GestorInventario:
             messagebox.showerror("Error", f"No se pudo leer historial de ventas: {e}")
             return []
 
+    @staticmethod
+    def _ubicar_linea(lineas, num_linea, descripcion=None):
+        """Índice en `lineas` (recién leídas) de la línea num_linea, o None.
+
+        Si el archivo se reescribió después de mostrarlo (servidor.py lo compacta ordenado),
+        el número puede apuntar a otro ítem; con `descripcion` se comprueba y se busca por ella.
+        """
+        def desc_de(linea):
+            return linea.strip().rsplit(" ", 1)[0].strip()
+
+        if 1 <= num_linea <= len(lineas):
+            if descripcion is None or desc_de(lineas[num_linea - 1]) == descripcion.strip():
+                return num_linea - 1
+        if descripcion is not None:
+            for i, linea in enumerate(lineas):
+                if desc_de(linea) == descripcion.strip():
+                    return i
+        return None
+
     def _leer_lineas_archivo(self):
         with open(self.archivo_inventario, "r", encoding="utf-8") as f:
             return f.readlines()
 
     def _escribir_lineas_archivo(self, lineas):
-        with open(self.archivo_inventario, "w", encoding="utf-8") as f:
+        with bloqueo_archivo(self.archivo_inventario), abrir_atomico(self.archivo_inventario, encoding="utf-8") as f:
             f.writelines(lineas)
 
 
@@ -2056,7 +2098,7 @@ class InventarioGUI:
             messagebox.showerror("Error", "Ambos campos son obligatorios.")
             return
 
-        success, message = self.gestor.modificar_linea(linea, nueva_desc, nueva_cant)
+        success, message = self.gestor.modificar_linea(linea, nueva_desc, nueva_cant, values[1])
         if success:
             self.populate_inventory_treeview()
             self.show_action_panel("close")
@@ -2075,14 +2117,15 @@ class InventarioGUI:
         if change == -1:
             try:
                 lineas = self.gestor._leer_lineas_archivo()
-                partes = lineas[int(linea) - 1].strip().rsplit(" ", 1)
+                i = self.gestor._ubicar_linea(lineas, int(linea), desc)
+                partes = lineas[i].strip().rsplit(" ", 1)
                 cant_actual_en_archivo = int(partes[1])
                 if cant_actual_en_archivo <= 0:
                     messagebox.showerror(
                         "Error", f"No hay stock en '{archivo_actual}' para restar."
                     )
                     return
-            except (IndexError, ValueError):
+            except (IndexError, TypeError, ValueError):
                 messagebox.showerror(
                     "Error", "No se pudo leer la cantidad actual del archivo."
                 )
@@ -2092,21 +2135,21 @@ class InventarioGUI:
         msg = ""
 
         if archivo_actual == "bodegac.txt" and change == -1:
-            s_resta, m_resta = self.gestor.modificar_cantidad(int(linea), -1)
+            s_resta, m_resta = self.gestor.modificar_cantidad(int(linea), -1, desc)
             if s_resta:
                 s_trans, m_trans = self.gestor.transferir_a_local(desc, 1)
                 if s_trans:
                     success = True
                     msg = "1 unidad restada de Bodega y transferida a Local."
                 else:
-                    self.gestor.modificar_cantidad(int(linea), +1)
+                    self.gestor.modificar_cantidad(int(linea), +1, desc)
                     success = False
                     msg = f"Error al transferir a local: {m_trans}"
             else:
                 success = False
                 msg = m_resta
         else:
-            success, msg = self.gestor.modificar_cantidad(int(linea), change)
+            success, msg = self.gestor.modificar_cantidad(int(linea), change, desc)
 
         if success:
             yview_pos = self.inventory_tree.yview()
@@ -3501,7 +3544,7 @@ class InventarioGUI:
         desc = values[1]
 
         if messagebox.askyesno("Confirmar", f"¿Eliminar '{desc}' permanentemente?"):
-            success, msg = self.gestor.eliminar_linea(linea)
+            success, msg = self.gestor.eliminar_linea(linea, desc)
             if success:
                 self.populate_inventory_treeview()
                 messagebox.showinfo("Éxito", msg)
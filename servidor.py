@@ -6,11 +6,33 @@ import json
 import os
 import csv
 import re
+import io
+import gzip
+import zlib
+import errno
+import queue
+import sqlite3
+import argparse
+import atexit
+import bisect
+import collections
+import hashlib
+import email.utils
+import logging.handlers
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from almacenamiento import abrir_atomico, bloqueo_archivo, obtener_bloqueo
+from busqueda import IndiceTrigramas
 from datetime import datetime
 import urllib.parse
 
 PORT = 8000
 ADMIN_PIN = "7802"
+MODO_SERVIDOR = "hilos"  # "hilos" (concurrente) o "simple" (una petición a la vez)
+MAX_WORKERS = 8
+MODOS_BUSQUEDA = ("phrase", "keywords", "advanced")  # Mismos modos que comparador.py
+POR_PAGINA_REPORTES = 200  # Ventas del detalle de /api/reportes por página
+MAX_POR_PAGINA_REPORTES = 5000
 
 import random
 import time
@@ -172,7 +194,7 @@ def generar_factura_txt(id_venta, timestamp_str, items, cliente, medio_pago):
         print(f"Error generando factura txt: {e}")
         return False
 
-def generar_anulacion_txt(id_venta, timestamp_venta, items, cliente, medio_pago):
+def generar_anulacion_txt(id_venta, timestamp_venta, items, cliente, medio_pago, fecha_anulacion=None):
     os.makedirs("facturas", exist_ok=True)
     nombre_factura = f"Anulacion_POS_{id_venta}.txt"
     ruta_factura = os.path.join("facturas", nombre_factura)
@@ -186,7 +208,8 @@ def generar_anulacion_txt(id_venta, timestamp_venta, items, cliente, medio_pago)
             f.write(f"Recibo Anulado No: {id_venta}".center(ancho_factura) + "\n")
             f.write("-" * ancho_factura + "\n")
             
-            for l in wrap_text(f"Fecha Anulacion: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", ancho_factura):
+            fecha_anulacion = fecha_anulacion or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for l in wrap_text(f"Fecha Anulacion: {fecha_anulacion}", ancho_factura):
                 f.write(l + "\n")
             for l in wrap_text(f"Fecha Venta: {timestamp_venta}", ancho_factura):
                 f.write(l + "\n")
@@ -226,6 +249,137 @@ def generar_anulacion_txt(id_venta, timestamp_venta, items, cliente, medio_pago)
         print(f"Error generando anulacion txt: {e}")
         return False
 
+class ColaRecibos:
+    """Genera los recibos TXT (ventas y anulaciones) en un hilo aparte.
+
+    Las peticiones solo encolan el trabajo y responden de inmediato con el ticket;
+    si la escritura falla se reintenta con espera creciente hasta MAX_INTENTOS y
+    luego queda en la lista de fallidos que muestra /api/recibos/estado.
+    """
+    MAX_INTENTOS = 4
+    ESPERA_REINTENTO = 1.0
+    MAX_FALLIDOS = 200
+
+    def __init__(self):
+        self._cola = queue.Queue()
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._fallidos = {}
+        self._completados = 0
+        self._hilo = None
+
+    def _iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._trabajar, name="recibos", daemon=True)
+            self._hilo.start()
+
+    def _encolar(self, tipo, id_venta, funcion, args):
+        clave = f"{tipo}:{id_venta}"
+        tarea = {
+            "clave": clave,
+            "tipo": tipo,
+            "id_venta": id_venta,
+            "funcion": funcion,
+            "args": args,
+            "intentos": 0,
+            "encolado": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "error": None
+        }
+        with self._lock:
+            self._pendientes[clave] = tarea
+            self._fallidos.pop(clave, None)
+            self._iniciar()
+        self._cola.put(tarea)
+
+    def encolar_factura(self, id_venta, timestamp_str, items, cliente, medio_pago):
+        self._encolar("factura", id_venta, generar_factura_txt,
+                      (id_venta, timestamp_str, [dict(i) for i in items], cliente, medio_pago))
+
+    def encolar_anulacion(self, id_venta, timestamp_venta, items, cliente, medio_pago):
+        fecha_anulacion = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._encolar("anulacion", id_venta, generar_anulacion_txt,
+                      (id_venta, timestamp_venta, [dict(i) for i in items], cliente, medio_pago, fecha_anulacion))
+
+    def _trabajar(self):
+        while True:
+            tarea = self._cola.get()
+            try:
+                self._procesar(tarea)
+            finally:
+                self._cola.task_done()
+
+    def _procesar(self, tarea):
+        tarea["intentos"] += 1
+        try:
+            ok = tarea["funcion"](*tarea["args"])
+            if not ok:
+                tarea["error"] = "No se pudo escribir el archivo del recibo."
+        except Exception as e:
+            ok = False
+            tarea["error"] = str(e)
+
+        with self._lock:
+            if self._pendientes.get(tarea["clave"]) is not tarea:
+                return  # Reemplazada por un encolado más reciente
+            if ok:
+                del self._pendientes[tarea["clave"]]
+                self._completados += 1
+                return
+            if tarea["intentos"] >= self.MAX_INTENTOS:
+                del self._pendientes[tarea["clave"]]
+                self._fallidos[tarea["clave"]] = tarea
+                while len(self._fallidos) > self.MAX_FALLIDOS:
+                    del self._fallidos[next(iter(self._fallidos))]
+                print(f"Error generando recibo {tarea['clave']} tras {tarea['intentos']} intentos: {tarea['error']}")
+                return
+
+        espera = self.ESPERA_REINTENTO * (2 ** (tarea["intentos"] - 1))
+        timer = threading.Timer(espera, self._cola.put, args=(tarea,))
+        timer.daemon = True
+        timer.start()
+
+    def reintentar_fallidos(self):
+        with self._lock:
+            fallidos = list(self._fallidos.values())
+            self._fallidos.clear()
+            for tarea in fallidos:
+                tarea["intentos"] = 0
+                self._pendientes[tarea["clave"]] = tarea
+            if fallidos:
+                self._iniciar()
+        for tarea in fallidos:
+            self._cola.put(tarea)
+        return len(fallidos)
+
+    def estado(self):
+        def resumen(tarea):
+            return {
+                "tipo": tarea["tipo"],
+                "id_venta": tarea["id_venta"],
+                "intentos": tarea["intentos"],
+                "encolado": tarea["encolado"],
+                "error": tarea["error"]
+            }
+        with self._lock:
+            return {
+                "pendientes": [resumen(t) for t in self._pendientes.values()],
+                "fallidos": [resumen(t) for t in self._fallidos.values()],
+                "completados": self._completados
+            }
+
+    def esperar(self, timeout=10.0):
+        """Espera a que se vacíe la cola (al cerrar el servidor)."""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            with self._lock:
+                if not self._pendientes:
+                    return True
+            time.sleep(0.05)
+        return False
+
+cola_recibos = ColaRecibos()
+atexit.register(cola_recibos.esperar)
+
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -237,6 +391,209 @@ def get_local_ip():
         s.close()
     return IP
 
+# --- BLOQUEOS POR ARCHIVO ---
+# En modo concurrente varias peticiones pueden escribir el mismo archivo a la vez,
+# y las aplicaciones Tk pueden estar abiertas sobre la misma carpeta. Cada archivo
+# tiene un bloqueo reentrante (para que un traslado pueda llamar a
+# adjust_product_stock mientras ya sostiene el del origen) que además toma un lock
+# de archivo entre procesos (ver almacenamiento.py).
+
+def get_file_lock(filename):
+    return obtener_bloqueo(filename)
+
+def file_locks(*filenames):
+    # Se adquieren siempre en el mismo orden para evitar bloqueos mutuos
+    return bloqueo_archivo(*filenames)
+
+_id_venta_lock = threading.Lock()
+_ultimo_id_venta = ""
+
+def generar_id_venta():
+    """Genera un ID de venta basado en la hora, único aunque lleguen dos ventas en el mismo segundo."""
+    global _ultimo_id_venta
+    with _id_venta_lock:
+        id_venta = datetime.now().strftime("%Y%m%d%H%M%S")
+        if id_venta <= _ultimo_id_venta.split("-")[0]:
+            base, _, seq = _ultimo_id_venta.partition("-")
+            id_venta = f"{base}-{int(seq or 0) + 1}"
+        _ultimo_id_venta = id_venta
+        return id_venta
+
+# --- MÉTRICAS DE PETICIONES (/api/metricas) ---
+
+_contexto_metricas = threading.local()
+
+@contextmanager
+def medir_io():
+    """Suma el tiempo del bloque a la E/S de archivos de la petición en curso, si la hay."""
+    ctx = getattr(_contexto_metricas, "peticion", None)
+    if ctx is None or ctx["nivel"]:
+        # Hilos de fondo, o ya dentro de otra medición (no se cuenta dos veces)
+        yield
+        return
+    ctx["nivel"] += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        ctx["io"] += time.perf_counter() - inicio
+        ctx["nivel"] -= 1
+
+class MetricasServidor:
+    """Contadores por ruta: peticiones, estados, histograma de latencia, bytes y E/S.
+
+    Los percentiles se estiman del histograma (interpolando dentro del intervalo),
+    así el costo por petición es fijo sin importar cuántas se hayan atendido.
+    """
+    LIMITES_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    MAX_RUTAS = 200  # Rutas raras (escaneos, 404) se agrupan en "otros"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas = {}
+        self.inicio = time.time()
+
+    def registrar(self, metodo, ruta, estado, segundos, io, bytes_entrada, bytes_salida):
+        ms = segundos * 1000
+        with self._lock:
+            clave = (metodo, ruta)
+            r = self._rutas.get(clave)
+            if r is None:
+                if len(self._rutas) >= self.MAX_RUTAS:
+                    clave = (metodo, "otros")
+                    r = self._rutas.get(clave)
+                if r is None:
+                    r = {"peticiones": 0, "estados": {}, "histograma": [0] * (len(self.LIMITES_MS) + 1),
+                         "suma_ms": 0.0, "max_ms": 0.0, "io_ms": 0.0, "bytes_entrada": 0, "bytes_salida": 0}
+                    self._rutas[clave] = r
+            r["peticiones"] += 1
+            r["estados"][estado] = r["estados"].get(estado, 0) + 1
+            r["histograma"][bisect.bisect_left(self.LIMITES_MS, ms)] += 1
+            r["suma_ms"] += ms
+            r["max_ms"] = max(r["max_ms"], ms)
+            r["io_ms"] += io * 1000
+            r["bytes_entrada"] += bytes_entrada
+            r["bytes_salida"] += bytes_salida
+
+    def _percentil(self, r, p):
+        objetivo = p * r["peticiones"]
+        acumulado = 0
+        for i, cantidad in enumerate(r["histograma"]):
+            if cantidad and acumulado + cantidad >= objetivo:
+                inferior = self.LIMITES_MS[i - 1] if i > 0 else 0.0
+                superior = self.LIMITES_MS[i] if i < len(self.LIMITES_MS) else r["max_ms"]
+                valor = inferior + (superior - inferior) * (objetivo - acumulado) / cantidad
+                return round(min(valor, r["max_ms"]), 3)
+            acumulado += cantidad
+        return 0.0
+
+    def instantanea(self):
+        with self._lock:
+            rutas = []
+            for (metodo, ruta), r in sorted(self._rutas.items(), key=lambda par: -par[1]["suma_ms"]):
+                rutas.append({
+                    "metodo": metodo,
+                    "ruta": ruta,
+                    "peticiones": r["peticiones"],
+                    "estados": {str(k): v for k, v in sorted(r["estados"].items())},
+                    "latencia_ms": {
+                        "promedio": round(r["suma_ms"] / r["peticiones"], 3),
+                        "p50": self._percentil(r, 0.50),
+                        "p95": self._percentil(r, 0.95),
+                        "p99": self._percentil(r, 0.99),
+                        "max": round(r["max_ms"], 3)
+                    },
+                    "tiempo_total_ms": round(r["suma_ms"], 3),
+                    "io_archivos_ms": round(r["io_ms"], 3),
+                    "computo_ms": round(max(0.0, r["suma_ms"] - r["io_ms"]), 3),
+                    "bytes_entrada": r["bytes_entrada"],
+                    "bytes_salida": r["bytes_salida"]
+                })
+        return {
+            "desde": datetime.fromtimestamp(self.inicio).strftime("%Y-%m-%d %H:%M:%S"),
+            "segundos_activo": round(time.time() - self.inicio, 1),
+            "rutas": rutas
+        }
+
+    def prometheus(self):
+        """Las mismas métricas en el formato de texto de Prometheus."""
+        def escapar(valor):
+            return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def etiquetas(metodo, ruta, **extra):
+            pares = [("metodo", metodo), ("ruta", ruta)] + list(extra.items())
+            return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+        with self._lock:
+            rutas = sorted(self._rutas.items())
+            lineas = [
+                "# HELP pos_peticiones_total Peticiones atendidas por ruta y estado HTTP.",
+                "# TYPE pos_peticiones_total counter"
+            ]
+            for (metodo, ruta), r in rutas:
+                for estado, cantidad in sorted(r["estados"].items()):
+                    lineas.append(f"pos_peticiones_total{etiquetas(metodo, ruta, estado=estado)} {cantidad}")
+            lineas += [
+                "# HELP pos_latencia_segundos Tiempo de respuesta por ruta.",
+                "# TYPE pos_latencia_segundos histogram"
+            ]
+            for (metodo, ruta), r in rutas:
+                acumulado = 0
+                for limite, cantidad in zip(self.LIMITES_MS, r["histograma"]):
+                    acumulado += cantidad
+                    lineas.append(f"pos_latencia_segundos_bucket{etiquetas(metodo, ruta, le=limite / 1000)} {acumulado}")
+                lineas.append(f"pos_latencia_segundos_bucket{etiquetas(metodo, ruta, le='+Inf')} {r['peticiones']}")
+                lineas.append(f"pos_latencia_segundos_sum{etiquetas(metodo, ruta)} {r['suma_ms'] / 1000:.6f}")
+                lineas.append(f"pos_latencia_segundos_count{etiquetas(metodo, ruta)} {r['peticiones']}")
+            for nombre, clave, ayuda, escala in [
+                ("pos_io_archivos_segundos_total", "io_ms", "Tiempo en lectura/escritura de archivos.", 1000),
+                ("pos_bytes_entrada_total", "bytes_entrada", "Bytes recibidos en el cuerpo de las peticiones.", 1),
+                ("pos_bytes_salida_total", "bytes_salida", "Bytes enviados (cabeceras y cuerpo).", 1),
+            ]:
+                lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} counter"]
+                for (metodo, ruta), r in rutas:
+                    valor = r[clave] / escala if escala != 1 else r[clave]
+                    lineas.append(f"{nombre}{etiquetas(metodo, ruta)} {valor}")
+        lineas += [
+            "# HELP pos_eventos_clientes Conexiones abiertas en /api/eventos.",
+            "# TYPE pos_eventos_clientes gauge",
+            f"pos_eventos_clientes {bus_eventos.clientes()}",
+        ]
+        return "\n".join(lineas) + "\n"
+
+metricas = MetricasServidor()
+
+def iniciar_log_metricas(ruta, intervalo=60.0, max_bytes=1_000_000, copias=5):
+    """Escribe una línea JSON con las métricas cada `intervalo` segundos en un log rotativo."""
+    registro = logging.getLogger("pos.metricas")
+    registro.setLevel(logging.INFO)
+    registro.propagate = False
+    registro.addHandler(logging.handlers.RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=copias, encoding="utf-8"))
+
+    def volcar():
+        while True:
+            time.sleep(intervalo)
+            try:
+                registro.info(json.dumps(metricas.instantanea(), ensure_ascii=False))
+            except Exception as e:
+                print(f"Error escribiendo el log de métricas: {e}")
+
+    threading.Thread(target=volcar, name="pos-metricas", daemon=True).start()
+
+class SalidaContada:
+    """Envuelve wfile para contar los bytes enviados en cada petición."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self.bytes = 0
+
+    def write(self, datos):
+        self.bytes += len(datos)
+        return self._wfile.write(datos)
+
+    def __getattr__(self, nombre):
+        return getattr(self._wfile, nombre)
+
 # --- HELPER DATABASE FUNCTIONS ---
 
 def parse_stock_file(filename):
@@ -281,135 +638,1369 @@ def parse_cost_file(filename="dbcst.txt"):
         print(f"Error parseando costos: {e}")
     return costs
 
-def obtener_ultimos_precios():
-    precios = {}
-    archivo_ventas = "registro_ventas.csv"
-    if os.path.exists(archivo_ventas):
+# --- DIARIO DE STOCK (cambios incrementales + instantánea periódica) ---
+
+class DiarioStock:
+    """Vista en memoria de un archivo de stock con un diario de cambios en disco.
+
+    Cada cambio (una venta, un ajuste, un traslado) se agrega como una línea JSON
+    con sus deltas a <archivo>.diario y se hace fsync, sin reescribir el archivo de
+    stock. Un compactador escribe cada pocos segundos la instantánea en el formato
+    de siempre ("    <descripcion> <cantidad>") para que comparador, inventario_gui
+    y existencias.html sigan leyendo el .txt, y deja el diario vacío.
+
+    Si otra herramienta modifica el .txt, la vista se recarga desde el archivo y se
+    vuelven a aplicar encima los deltas que todavía no se habían compactado; los de
+    productos que ya no están en el .txt se descartan, salvo que el cambio los haya creado.
+    """
+    INTERVALO_COMPACTACION = 2.0
+    MAX_PENDIENTES = 500
+
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.archivo_diario = f"{archivo}.diario"
+        self.lock = get_file_lock(archivo)
+        self.version = 0
+        self._stock = None
+        self._pendientes = []
+        self._firma_instantanea = None
+        self._timer = None
+
+    # --- Carga y recuperación ---
+
+    def _leer_diario(self):
+        cabecera = None
+        registros = []
+        compactando = False
+        if not os.path.exists(self.archivo_diario):
+            return cabecera, registros, compactando
+        with open(self.archivo_diario, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    # Línea cortada por un corte de luz a mitad de escritura
+                    continue
+                if "instantanea" in registro:
+                    cabecera = registro["instantanea"]
+                elif registro.get("compactando"):
+                    compactando = True
+                elif "cambios" in registro:
+                    registros.append(registro)
+        return cabecera, registros, compactando
+
+    def _reescribir_diario(self, registros):
+        """Deja el diario con la cabecera del .txt actual y los registros pendientes."""
+        with abrir_atomico(self.archivo_diario, encoding="utf-8") as f:
+            f.write(json.dumps({"instantanea": list(self._firma_instantanea or [])}) + "\n")
+            for registro in registros:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    def _cargar(self):
+        firma = CatalogoProductos.firma_archivo(self.archivo)
+        with medir_io():
+            stock = parse_stock_file(self.archivo)
+            cabecera, registros, compactando = self._leer_diario()
+        actual = list(firma) if firma else []
+        if compactando and cabecera is not None and cabecera != actual:
+            # Se cortó una compactación después de escribir la instantánea:
+            # los cambios del diario ya están incluidos en el .txt.
+            # Sin cabecera no se puede saber si llegó a escribirse: se reaplican los cambios
+            registros = []
+        aplicados = []
+        descartados = False
+        for registro in registros:
+            nuevos = set(registro.get("nuevos", ()))
+            cambios = {}
+            for desc, delta in registro["cambios"].items():
+                if desc not in stock and desc not in nuevos:
+                    # El producto se borró o renombró en el .txt: no se vuelve a crear
+                    print(f"Advertencia: se descarta el cambio pendiente de '{desc}' ({delta:+}) "
+                          f"porque ya no está en {self.archivo}.")
+                    descartados = True
+                    continue
+                stock[desc] = stock.get(desc, 0) + delta
+                cambios[desc] = delta
+            if cambios:
+                aplicados.append(dict(registro, cambios=cambios))
+        registros = aplicados
+        self._stock = stock
+        self._pendientes = registros
+        self._firma_instantanea = firma
+        if (compactando or descartados or cabecera != actual) and os.path.exists(self.archivo_diario):
+            # El .txt ya no es el de la cabecera (lo editó otra herramienta o se cortó una
+            # compactación): el diario pasa a describir los pendientes sobre el archivo
+            # actual, así una compactación cortada más adelante se recupera bien
+            self._reescribir_diario(registros)
+        self.version += 1
+        if registros:
+            self._programar_compactacion()
+
+    def _asegurar_cargado(self):
+        if self._stock is None:
+            self._cargar()
+
+    def comprobar(self):
+        """Detecta cambios externos en el .txt. Devuelve la versión actual de la vista."""
+        with self.lock:
+            if self._stock is None:
+                self._cargar()
+            elif CatalogoProductos.firma_archivo(self.archivo) != self._firma_instantanea:
+                self._cargar()
+            return self.version
+
+    # --- Lectura ---
+
+    @contextmanager
+    def bloqueo(self):
+        """Bloquea el archivo y entrega la vista actual (solo lectura) para validar cambios."""
+        with self.lock:
+            self.comprobar()
+            yield self._stock
+
+    def vista(self):
+        with self.lock:
+            self._asegurar_cargado()
+            return dict(self._stock)
+
+    # --- Escritura ---
+
+    def registrar(self, cambios):
+        """Agrega {descripcion: delta} al diario y a la vista. Devuelve las nuevas cantidades.
+
+        Debe llamarse dentro de bloqueo() después de validar los cambios.
+        """
+        with self.lock:
+            self._asegurar_cargado()
+            # Un delta 0 solo se registra si crea el producto (con cantidad 0)
+            cambios = {desc: delta for desc, delta in cambios.items() if delta or desc not in self._stock}
+            if not cambios:
+                return {}
+            registro = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "cambios": cambios}
+            nuevos = [desc for desc in cambios if desc not in self._stock]
+            if nuevos:
+                # Al reaplicar el diario solo se crean los productos que este cambio creó
+                registro["nuevos"] = nuevos
+            nuevo = not os.path.exists(self.archivo_diario) or os.path.getsize(self.archivo_diario) == 0
+            with medir_io(), open(self.archivo_diario, "a", encoding="utf-8") as f:
+                if nuevo:
+                    # La cabecera identifica el .txt sobre el que se aplican los cambios: si una
+                    # compactación se corta, _cargar sabe si la instantánea llegó a reemplazarlo
+                    f.write(json.dumps({"instantanea": list(self._firma_instantanea or [])}) + "\n")
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            nuevas = {}
+            for desc, delta in cambios.items():
+                nuevas[desc] = self._stock.get(desc, 0) + delta
+                self._stock[desc] = nuevas[desc]
+            self._pendientes.append(registro)
+            self.version += 1
+
+            if len(self._pendientes) >= self.MAX_PENDIENTES:
+                self.compactar()
+            else:
+                self._programar_compactacion()
+            return nuevas
+
+    def _programar_compactacion(self):
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.INTERVALO_COMPACTACION, self._compactar_seguro)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _compactar_seguro(self):
         try:
-            with open(archivo_ventas, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                header = next(reader, None)
-                if header:
-                    desc_idx = header.index("Descripcion") if "Descripcion" in header else 2
-                    precio_idx = header.index("PrecioUnitario") if "PrecioUnitario" in header else 5
-                    estado_idx = header.index("Estado") if "Estado" in header else -1
-                    for row in reader:
-                        if row and len(row) > max(desc_idx, precio_idx):
-                            if estado_idx != -1 and len(row) > estado_idx and row[estado_idx] == "Anulada":
-                                continue
-                            try:
-                                precios[row[desc_idx].strip()] = float(row[precio_idx])
-                            except ValueError:
-                                continue
+            self.compactar()
+        except Exception as e:
+            print(f"Error compactando el diario de {self.archivo}: {e}")
+
+    def compactar(self):
+        """Escribe la instantánea del stock en el .txt y vacía el diario."""
+        with self.lock:
+            self._timer = None
+            if self._stock is None:
+                return
+            if CatalogoProductos.firma_archivo(self.archivo) != self._firma_instantanea:
+                # Alguien escribió el .txt desde la última lectura: primero se combinan sus cambios
+                self._cargar()
+            if not self._pendientes and os.path.exists(self.archivo_diario):
+                return
+
+            if self._pendientes:
+                with open(self.archivo_diario, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"compactando": True}) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            lineas = [f"    {desc} {qty}\n" for desc, qty in self._stock.items()]
+            lineas.sort(key=lambda x: x.strip().rsplit(' ', 1)[0].lower())
+            with abrir_atomico(self.archivo, encoding='utf-8') as f:
+                f.writelines(lineas)
+            self._firma_instantanea = CatalogoProductos.firma_archivo(self.archivo)
+
+            self._reescribir_diario([])
+            self._pendientes = []
+
+_diarios_stock = {}
+_diarios_guard = threading.Lock()
+
+def obtener_diario(filename):
+    with _diarios_guard:
+        diario = _diarios_stock.get(filename)
+        if diario is None:
+            diario = DiarioStock(filename)
+            _diarios_stock[filename] = diario
+        return diario
+
+def compactar_diarios():
+    for diario in list(_diarios_stock.values()):
+        try:
+            diario.compactar()
         except Exception as e:
-            print(f"Error al obtener últimos precios: {e}")
-    return precios
+            print(f"Error compactando el diario de {diario.archivo}: {e}")
+
+atexit.register(compactar_diarios)
+
+# --- EVENTOS EN VIVO (/api/eventos) ---
+
+class BusEventos:
+    """Difunde cambios de stock y de caja a los navegadores con Server-Sent Events.
+
+    Las conexiones de /api/eventos no ocupan un hilo del pool: el handler envía las
+    cabeceras y entrega el socket a este bus, y un solo hilo escribe cada evento en
+    todos los sockets. Los sockets son no bloqueantes: lo que el kernel no acepta
+    queda en un pequeño búfer por cliente que se reintenta, y si ese búfer supera
+    MAX_PENDIENTE o no se vacía en TIMEOUT_ENVIO el cliente se desconecta, así un
+    teléfono lento no retrasa los eventos de los demás. Los últimos MAX_HISTORIAL eventos se guardan para que un
+    cliente que se reconecta con Last-Event-ID reciba lo que se perdió; si ya no
+    están (o el servidor se reinició: los ids llevan la hora de arranque), recibe un
+    evento "reinicio" y debe recargar completo.
+    """
+    MAX_HISTORIAL = 500
+    MAX_CLIENTES = 64
+    INTERVALO_LATIDO = 15.0  # Comentario periódico para que proxies y teléfonos no corten la conexión
+    TIMEOUT_ENVIO = 2.0  # Un cliente que no recibe en este tiempo se desconecta
+    MAX_PENDIENTE = 256 * 1024  # Bytes sin enviar por cliente; alcanza para reenviar el historial
+    INTERVALO_REINTENTO = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._historial = collections.deque(maxlen=self.MAX_HISTORIAL)
+        self._arranque = format(int(time.time() * 1000), "x")
+        self._ultimo_id = 0
+        self._enviado_hasta = 0
+        self._clientes = {}  # socket -> [bytes pendientes, desde cuándo hay pendientes]
+        self._adoptados = set()
+        self._cola = queue.Queue()
+        self._hilo = None
+
+    def _formatear(self, id_evento, tipo, datos):
+        return f"id: {self._arranque}-{id_evento}\nevent: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    def publicar(self, tipo, datos):
+        with self._lock:
+            self._ultimo_id += 1
+            mensaje = self._formatear(self._ultimo_id, tipo, datos)
+            self._historial.append((self._ultimo_id, mensaje))
+            self._cola.put(("evento", self._ultimo_id, mensaje))
+
+    def suscribir(self, sock, last_event_id=None):
+        """Adopta el socket de una petición a /api/eventos (cabeceras ya enviadas)."""
+        ultimo_id = None
+        if last_event_id:
+            arranque, _, numero = last_event_id.strip().partition("-")
+            ultimo_id = int(numero) if arranque == self._arranque and numero.isdigit() else -1
+        with self._lock:
+            if len(self._adoptados) >= self.MAX_CLIENTES:
+                return False
+            self._adoptados.add(sock)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._trabajar, name="pos-eventos", daemon=True)
+                self._hilo.start()
+        self._cola.put(("cliente", ultimo_id, sock))
+        return True
+
+    def adoptado(self, sock):
+        with self._lock:
+            return sock in self._adoptados
+
+    def clientes(self):
+        with self._lock:
+            return len(self._adoptados)
+
+    def _trabajar(self):
+        proximo_latido = time.monotonic() + self.INTERVALO_LATIDO
+        while True:
+            # Con envíos pendientes se vuelve a intentar seguido; si no, se espera el latido
+            hay_pendientes = any(p[0] for p in self._clientes.values())
+            espera = self.INTERVALO_REINTENTO if hay_pendientes else max(0.0, proximo_latido - time.monotonic())
+            try:
+                tipo, valor, dato = self._cola.get(timeout=espera)
+            except queue.Empty:
+                tipo = None
+            if tipo == "evento":
+                self._enviado_hasta = valor
+                self._difundir(dato)
+            elif tipo == "cliente":
+                self._agregar_cliente(dato, valor)
+            elif time.monotonic() >= proximo_latido:
+                self._difundir(b": latido\n\n")
+            else:
+                self._difundir(b"")
+            if time.monotonic() >= proximo_latido:
+                proximo_latido = time.monotonic() + self.INTERVALO_LATIDO
+
+    def _agregar_cliente(self, sock, ultimo_id):
+        # Lo publicado hasta _enviado_hasta ya salió a los demás; lo posterior llegará por la cola
+        with self._lock:
+            historial = [(i, m) for i, m in self._historial if i <= self._enviado_hasta]
+        partes = [b"retry: 3000\n\n"]
+        if ultimo_id is not None:
+            perdidos = ultimo_id < self._enviado_hasta and (not historial or historial[0][0] > ultimo_id + 1)
+            if ultimo_id < 0 or perdidos:
+                partes.append(self._formatear(self._enviado_hasta, "reinicio", {}))
+            else:
+                partes.extend(m for i, m in historial if i > ultimo_id)
+        try:
+            sock.setblocking(False)
+        except OSError:
+            self._cerrar(sock)
+            return
+        self._clientes[sock] = [bytearray(), 0.0]
+        self._enviar(sock, b"".join(partes))
+
+    def _difundir(self, mensaje):
+        for sock in list(self._clientes):
+            self._enviar(sock, mensaje)
+
+    def _enviar(self, sock, datos):
+        """Escribe sin bloquear lo pendiente del cliente más `datos`; lo desconecta si se atrasa."""
+        pendiente = self._clientes[sock]
+        buf = pendiente[0]
+        if not buf and not datos:
+            return
+        if not buf:
+            pendiente[1] = time.monotonic()
+        buf += datos
+        try:
+            del buf[:sock.send(buf)]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._quitar(sock)
+            return
+        if buf and (len(buf) > self.MAX_PENDIENTE or time.monotonic() - pendiente[1] > self.TIMEOUT_ENVIO):
+            self._quitar(sock)
+
+    def _quitar(self, sock):
+        self._clientes.pop(sock, None)
+        self._cerrar(sock)
+
+    def _cerrar(self, sock):
+        with self._lock:
+            self._adoptados.discard(sock)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+bus_eventos = BusEventos()
+
+# --- CATÁLOGO DE PRODUCTOS EN MEMORIA ---
+
+ARCHIVOS_STOCK = ["local.txt", "local_2.txt", "bodegac.txt"]
+
+class CatalogoProductos:
+    """Tabla combinada de productos (stock por ubicación + costo + precio) en memoria.
+
+    Cada archivo fuente se vuelve a leer solo cuando cambia su mtime o tamaño, y
+    como mucho se hace stat una vez por INTERVALO_VERIFICACION. Las escrituras del
+    propio servidor (deduct_stock, adjust_product_stock) actualizan la tabla en
+    sitio con actualizar_stock(), así que las lecturas no tocan el disco. Para los
+    archivos de stock la firma es la versión de su DiarioStock.
+
+    Cada lote de cambios incrementa la revisión del catálogo y marca con ella los
+    productos afectados, para que los clientes pidan solo lo que cambió desde la
+    revisión que ya tienen (cambios_desde). La revisión arranca en el instante de
+    inicio en milisegundos, así una revisión de un proceso anterior siempre queda
+    por debajo de revision_base y se responde con el catálogo completo.
+    """
+    INTERVALO_VERIFICACION = 1.0
+
+    def __init__(self, archivos_stock=None, archivo_costos="dbcst.txt", archivo_precios="dbacc.txt"):
+        self.archivos_stock = list(archivos_stock or ARCHIVOS_STOCK)
+        self.archivo_costos = archivo_costos
+        self.archivo_precios = archivo_precios
+        self._lock = threading.RLock()
+        self._lock_verificacion = threading.Lock()
+        # El stock se lee de la vista del diario (incluye cambios aún no compactados)
+        self._fuentes = {f: (lambda archivo: obtener_diario(archivo).vista()) for f in self.archivos_stock}
+        self._fuentes[archivo_costos] = parse_cost_file
+        self._fuentes[archivo_precios] = parse_cost_file
+        self._datos = {}
+        self._firmas = {}
+        self._productos = {}
+        self._orden = []
+        self._ultima_verificacion = None
+        self.revision_base = int(time.time() * 1000)
+        self._version = self.revision_base
+        self._revs = {}
+        self._eliminados = {}
+        self._json_cache = None
+        self._json_cache_version = -1
+        self._gzip_cache = None
+        self._gzip_cache_version = -1
+        self._existencias_cache = None
+        self._indice = IndiceTrigramas()
+
+    @staticmethod
+    def firma_archivo(filename):
+        try:
+            st = os.stat(filename)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _firma_fuente(self, archivo):
+        if archivo in self.archivos_stock:
+            return obtener_diario(archivo).comprobar()
+        return self.firma_archivo(archivo)
+
+    def _campo(self, archivo):
+        if archivo == self.archivo_costos:
+            return "costo"
+        if archivo == self.archivo_precios:
+            return "precio_sugerido"
+        return None
+
+    def _nuevo_producto(self, desc):
+        return {
+            "descripcion": desc,
+            "costo": 0.0,
+            "precio_sugerido": 0.0,
+            "stock": {f: 0 for f in self.archivos_stock}
+        }
+
+    def _asignar(self, archivo, desc, valor, ordenar=True):
+        producto = self._productos.get(desc)
+        creado = producto is None
+        if creado:
+            if valor is None:
+                return False
+            producto = self._nuevo_producto(desc)
+            self._productos[desc] = producto
+            self._indice.agregar(desc)
+            if ordenar:
+                bisect.insort(self._orden, desc)
+            else:
+                self._orden.append(desc)
+
+        campo = self._campo(archivo)
+        if campo:
+            nuevo = valor if valor is not None else 0.0
+            cambiado = producto[campo] != nuevo
+            producto[campo] = nuevo
+        else:
+            nuevo = valor if valor is not None else 0
+            cambiado = producto["stock"][archivo] != nuevo
+            producto["stock"][archivo] = nuevo
+
+        # Un producto deja de existir cuando ya no aparece en ninguna fuente
+        if valor is None and not any(desc in d for d in self._datos.values()):
+            del self._productos[desc]
+            self._indice.quitar(desc)
+            idx = bisect.bisect_left(self._orden, desc)
+            if idx < len(self._orden) and self._orden[idx] == desc:
+                del self._orden[idx]
+            self._revs.pop(desc, None)
+            self._eliminados[desc] = self._version + 1
+            return True
+
+        if cambiado or creado:
+            self._revs[desc] = self._version + 1
+            self._eliminados.pop(desc, None)
+            return True
+        return False
+
+    def _cargar_archivo(self, archivo, nuevos):
+        anteriores = self._datos.get(archivo, {})
+        self._datos[archivo] = nuevos
+        cambios = 0
+        total_orden = len(self._orden)
+        for desc, valor in nuevos.items():
+            if anteriores.get(desc) != valor or desc not in self._productos:
+                cambios += self._asignar(archivo, desc, valor, ordenar=False)
+        if len(self._orden) != total_orden:
+            self._orden.sort()
+        for desc in anteriores.keys() - nuevos.keys():
+            cambios += self._asignar(archivo, desc, None)
+        if cambios:
+            self._version += 1
+
+    def verificar(self, forzar=False):
+        """Relee los archivos que cambiaron en disco desde la última verificación."""
+        with self._lock_verificacion:
+            with self._lock:
+                ahora = time.monotonic()
+                if (not forzar and self._ultima_verificacion is not None
+                        and ahora - self._ultima_verificacion < self.INTERVALO_VERIFICACION):
+                    return
+                self._ultima_verificacion = ahora
+            # Las fuentes se leen sin el bloqueo del catálogo: las escrituras de stock llaman a
+            # actualizar_stock() con el bloqueo del diario tomado (diario -> catálogo), así que
+            # aquí nunca se pide un diario teniendo el catálogo
+            leidos = []
+            for archivo, fuente in self._fuentes.items():
+                firma = self._firma_fuente(archivo)
+                if archivo not in self._datos or firma != self._firmas.get(archivo):
+                    with medir_io():
+                        leidos.append((archivo, firma, fuente(archivo)))
+            if leidos:
+                with self._lock:
+                    for archivo, firma, nuevos in leidos:
+                        self._firmas[archivo] = firma
+                        self._cargar_archivo(archivo, nuevos)
+
+    def actualizar_stock(self, archivo, cambios, firma_anterior=None):
+        """Aplica en memoria {descripcion: nueva_cantidad} tras una escritura del servidor.
+
+        firma_anterior es la versión del diario antes de registrar los cambios; si no
+        coincide con la que tenemos, alguien más lo modificó y se relee completo.
+        """
+        firma_nueva = self._firma_fuente(archivo)
+        with self._lock:
+            if archivo not in self._datos:
+                return
+            if firma_anterior is not None and firma_anterior != self._firmas.get(archivo):
+                self._firmas[archivo] = None
+                self._ultima_verificacion = None
+                return
+            datos = self._datos[archivo]
+            cambiado = False
+            for desc, qty in cambios.items():
+                datos[desc] = qty
+                cambiado |= self._asignar(archivo, desc, qty)
+            if cambiado:
+                self._version += 1
+                bus_eventos.publicar("stock", {
+                    "archivo": archivo,
+                    "cambios": cambios,
+                    "revision_anterior": self._version - 1,
+                    "revision": self._version
+                })
+            self._firmas[archivo] = firma_nueva
+
+    def revision(self):
+        self.verificar()
+        with self._lock:
+            return self._version
+
+    def stock(self, archivo):
+        self.verificar()
+        with self._lock:
+            return dict(self._datos.get(archivo, {}))
+
+    def productos(self):
+        self.verificar()
+        with self._lock:
+            return [self._productos[desc] for desc in self._orden]
+
+    def buscar(self, q, mode="keywords", limite=50):
+        """Productos cuya descripción cumple la búsqueda de comparador (check_match).
+
+        Devuelve (total, primeros `limite` productos en orden alfabético).
+        """
+        self.verificar()
+        with self._lock:
+            claves = sorted(self._indice.buscar(q, mode))
+            return len(claves), [self._productos[desc] for desc in claves[:limite]]
+
+    def json_productos(self):
+        """Respuesta completa de /api/productos ya serializada, junto con su revisión.
+
+        Se regenera solo cuando el catálogo cambió desde la última vez.
+        """
+        self.verificar()
+        with self._lock:
+            if self._json_cache_version != self._version:
+                productos = [self._productos[desc] for desc in self._orden]
+                self._json_cache = json.dumps({
+                    "revision": self._version,
+                    "completo": True,
+                    "productos": productos
+                }).encode('utf-8')
+                self._json_cache_version = self._version
+            return self._version, self._json_cache
+
+    def json_productos_gzip(self):
+        """Como json_productos() pero además con el cuerpo comprimido en gzip (también en caché)."""
+        revision, body = self.json_productos()
+        with self._lock:
+            if self._gzip_cache_version != revision:
+                self._gzip_cache = comprimir_gzip(body)
+                self._gzip_cache_version = revision
+            return revision, body, self._gzip_cache
+
+    def json_existencias(self):
+        """Cantidades de todos los archivos de stock en formato columnar, para existencias.html.
+
+        {"revision", "archivos": [...], "descripciones": [...], "cantidades": [[...], ...]}
+        donde cantidades[i][j] es el stock de descripciones[j] en archivos[i] (null si el
+        producto no aparece en ese archivo). Devuelve (revision, body, body_gzip), en caché
+        por revisión.
+        """
+        self.verificar()
+        with self._lock:
+            if self._existencias_cache is None or self._existencias_cache[0] != self._version:
+                datos = [self._datos.get(archivo, {}) for archivo in self.archivos_stock]
+                descripciones = [desc for desc in self._orden if any(desc in d for d in datos)]
+                body = json.dumps({
+                    "revision": self._version,
+                    "archivos": self.archivos_stock,
+                    "descripciones": descripciones,
+                    "cantidades": [[d.get(desc) for desc in descripciones] for d in datos]
+                }, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+                self._existencias_cache = (self._version, body, comprimir_gzip(body))
+            return self._existencias_cache
+
+    def json_cambios_desde(self, desde):
+        """Productos modificados y descripciones eliminadas después de la revisión `desde`.
+
+        Si `desde` no pertenece a este proceso se devuelve el catálogo completo.
+        """
+        self.verificar()
+        with self._lock:
+            completo = desde < self.revision_base or desde > self._version
+        if completo:
+            return self.json_productos()
+        with self._lock:
+            productos = [self._productos[d] for d, rev in self._revs.items() if rev > desde]
+            productos.sort(key=lambda p: p["descripcion"])
+            eliminados = sorted(d for d, rev in self._eliminados.items() if rev > desde)
+            body = json.dumps({
+                "revision": self._version,
+                "desde": desde,
+                "completo": False,
+                "productos": productos,
+                "eliminados": eliminados
+            }).encode('utf-8')
+            return self._version, body
+
+catalogo = CatalogoProductos()
+
+# --- LIBRO DE VENTAS (índice SQLite de registro_ventas.csv) ---
+
+ARCHIVO_VENTAS = "registro_ventas.csv"
+ARCHIVO_ANULACIONES = "anulaciones_ventas.csv"
+COLUMNAS_VENTAS = [
+    "Timestamp", "ID_Venta", "Descripcion", "Cantidad",
+    "CostoUnitario", "PrecioUnitario", "TotalVenta", "Ganancia",
+    "ArchivoOrigen", "Cliente", "MedioPago", "Estado"
+]
+
+def _a_float(valor):
+    try:
+        return float(valor or 0.0)
+    except ValueError:
+        return None
+
+def _a_int(valor):
+    try:
+        return int(valor or 0)
+    except ValueError:
+        return None
+
+class LibroVentas:
+    """Índice SQLite (WAL) de registro_ventas.csv para no recorrer todo el historial.
+
+    El CSV sigue siendo el formato que leen y escriben las apps de escritorio
+    (inventario_gui, analisis_vnt); la base es un índice derivado de él. Antes de
+    cada consulta sincronizar() compara la firma del CSV con la última importada:
+    si solo se agregaron filas al final importa únicamente esas, y si otra
+    herramienta reescribió el archivo lo reimporta completo.
+
+    Las anulaciones no reescriben el CSV: se agregan como lápida al final de
+    anulaciones_ventas.csv y se borran del índice por ID_Venta. Las lápidas no se
+    borran nunca, así una venta anulada que vuelve a llegar (un lote reenviado)
+    se reconoce como ya registrada. compactar() retira esas filas del CSV para las
+    apps de escritorio, pero solo al iniciar el servidor o con --compactar-ventas:
+    reescribe el CSV y obliga a reimportar el índice completo.
+
+    Junto con las filas se mantienen resúmenes diarios (por local, por medio de
+    pago y por producto, en centavos) que se actualizan en cada importación y
+    anulación, así un reporte por rango suma N días en vez de recorrer las ventas.
+    resumen_venta guarda una entrada por venta y día para paginar el detalle por
+    venta completa y no por fila del CSV.
+    """
+    ESQUEMA_VERSION = "3"
+    TABLAS_RESUMEN = ("resumen_dia", "resumen_local", "resumen_pago", "resumen_producto", "resumen_venta")
+    TAM_COLA = 64
+
+    def __init__(self, archivo_csv=ARCHIVO_VENTAS, ruta_db=None, archivo_anulaciones=ARCHIVO_ANULACIONES):
+        self.archivo_csv = archivo_csv
+        self.ruta_db = ruta_db or os.path.splitext(archivo_csv)[0] + ".db"
+        self.archivo_anulaciones = archivo_anulaciones
+        self._local = threading.local()
+        self._firma = None
+        self._esquema_listo = False
+        self._anuladas = None
+        # Cambia cada vez que las filas se renumeran (reimportación completa)
+        self.generacion = 0
+
+    def _conexion(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta_db, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        if not self._esquema_listo:
+            self._crear_esquema(con)
+        return con
+
+    def _crear_esquema(self, con):
+        with con:
+            con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+            fila = con.execute("SELECT valor FROM meta WHERE clave = 'esquema'").fetchone()
+            if fila is None or fila["valor"] != self.ESQUEMA_VERSION:
+                # La base es derivada del CSV: ante un esquema distinto se reconstruye
+                con.execute("DROP TABLE IF EXISTS ventas")
+                for tabla in self.TABLAS_RESUMEN:
+                    con.execute(f"DROP TABLE IF EXISTS {tabla}")
+                con.execute("DELETE FROM meta")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS ventas (
+                    fila INTEGER PRIMARY KEY,
+                    timestamp TEXT,
+                    fecha TEXT,
+                    id_venta TEXT,
+                    descripcion TEXT,
+                    cantidad INTEGER,
+                    costo_unitario REAL,
+                    precio_unitario REAL,
+                    total_venta REAL,
+                    ganancia REAL,
+                    archivo_origen TEXT,
+                    cliente TEXT,
+                    medio_pago TEXT,
+                    estado TEXT,
+                    crudo TEXT
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha, archivo_origen)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ventas_id ON ventas(id_venta)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ventas_origen ON ventas(archivo_origen)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ventas_descripcion ON ventas(descripcion)")
+            # Resúmenes diarios de las filas reportables (ver _fila_reportable)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resumen_dia (
+                    fecha TEXT PRIMARY KEY,
+                    lineas INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resumen_local (
+                    fecha TEXT, origen TEXT,
+                    lineas INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    ganancia INTEGER NOT NULL DEFAULT 0,
+                    ultima_fila INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fecha, origen)
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resumen_pago (
+                    fecha TEXT, medio_pago TEXT,
+                    lineas INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    ultima_fila INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fecha, medio_pago)
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resumen_producto (
+                    fecha TEXT, descripcion TEXT,
+                    unidades INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    ganancia INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fecha, descripcion)
+                )
+            """)
+            # Filas antiguas sin ID_Venta cuentan cada una como venta propia ("#<fila>")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resumen_venta (
+                    fecha TEXT, clave TEXT,
+                    lineas INTEGER NOT NULL DEFAULT 0,
+                    ultima_fila INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fecha, clave)
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_resumen_venta_fila ON resumen_venta(ultima_fila)")
+            con.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('esquema', ?)", (self.ESQUEMA_VERSION,))
+        self._esquema_listo = True
+
+    # --- Importación desde el CSV ---
+
+    @staticmethod
+    def _indices(header):
+        return {col: (header.index(col) if col in header else None) for col in COLUMNAS_VENTAS}
+
+    def _fila_a_registro(self, numero, row, idx, tiene_estado):
+        def campo(col):
+            i = idx[col]
+            if i is None or i >= len(row):
+                return None
+            return row[i]
+
+        timestamp = campo("Timestamp") or ""
+        estado = campo("Estado")
+        if estado is None and not tiene_estado:
+            estado = "Completada"
+        return (
+            numero,
+            timestamp,
+            timestamp.split(" ")[0],
+            campo("ID_Venta"),
+            campo("Descripcion"),
+            _a_int(campo("Cantidad")),
+            _a_float(campo("CostoUnitario")),
+            _a_float(campo("PrecioUnitario")),
+            _a_float(campo("TotalVenta")),
+            _a_float(campo("Ganancia")),
+            campo("ArchivoOrigen"),
+            campo("Cliente"),
+            campo("MedioPago"),
+            estado,
+            json.dumps(row, ensure_ascii=False)
+        )
+
+    def _leer_meta(self, con):
+        return {r["clave"]: r["valor"] for r in con.execute("SELECT clave, valor FROM meta")}
+
+    def _importar(self, con, desde_offset, meta):
+        """Importa las filas del CSV a partir de desde_offset (0 = reimportación completa)."""
+        with open(self.archivo_csv, "rb") as f:
+            f.seek(desde_offset)
+            datos = f.read()
+        # Solo se consumen líneas completas; una escritura a medias se importa en la próxima
+        fin = datos.rfind(b"\n") + 1
+        datos = datos[:fin]
+        texto = datos.decode("utf-8", errors="replace")
+        reader = csv.reader(io.StringIO(texto, newline=""))
+
+        if desde_offset == 0:
+            con.execute("DELETE FROM ventas")
+            for tabla in self.TABLAS_RESUMEN:
+                con.execute(f"DELETE FROM {tabla}")
+            self.generacion += 1
+            header = next(reader, None) or []
+            if "ID_Venta" not in header:
+                # Archivo sin encabezado: columnas en el orden estándar
+                reader = csv.reader(io.StringIO(texto, newline=""))
+                header = list(COLUMNAS_VENTAS)
+            meta["cabecera"] = json.dumps(header)
+            numero = 0
+        else:
+            header = json.loads(meta.get("cabecera") or json.dumps(COLUMNAS_VENTAS))
+            # Las filas anuladas se borran: el número sigue desde el mayor ya asignado
+            numero = max(int(meta.get("fila") or 0),
+                         con.execute("SELECT COALESCE(MAX(fila), 0) FROM ventas").fetchone()[0])
+
+        idx = self._indices(header)
+        tiene_estado = idx["Estado"] is not None
+        id_idx = idx["ID_Venta"]
+        anuladas = self._ids_anulados()
+        registros = []
+        for row in reader:
+            if not row:
+                continue
+            if anuladas and id_idx is not None and id_idx < len(row) and row[id_idx] in anuladas:
+                continue
+            numero += 1
+            registros.append(self._fila_a_registro(numero, row, idx, tiene_estado))
+        con.executemany(
+            "INSERT INTO ventas VALUES (" + ", ".join(["?"] * 15) + ")", registros
+        )
+        self._acumular(con, registros, 1)
+
+        meta["fila"] = str(numero)
+        offset = desde_offset + fin
+        with open(self.archivo_csv, "rb") as f:
+            f.seek(max(0, offset - self.TAM_COLA))
+            cola = f.read(min(offset, self.TAM_COLA))
+        meta["offset"] = str(offset)
+        meta["cola"] = cola.hex()
+        return len(registros)
+
+    # --- Resúmenes diarios ---
+
+    @staticmethod
+    def _fila_reportable(fila):
+        # Mismo criterio que el listado de /api/reportes: fecha y montos completos
+        return bool(fila[1]) and None not in (fila[5], fila[6], fila[7], fila[8], fila[9])
+
+    @staticmethod
+    def _centavos(valor):
+        return int(round(valor * 100))
+
+    def _acumular(self, con, filas, signo):
+        """Suma (signo=1) o resta (signo=-1) filas de ventas en los resúmenes diarios.
+
+        `filas` son tuplas en el orden de la tabla ventas (o sqlite3.Row de SELECT *).
+        """
+        dias, locales, pagos, productos, ventas = {}, {}, {}, {}, {}
+        for fila in filas:
+            if not self._fila_reportable(fila):
+                continue
+            numero, fecha = fila[0], fila[2]
+            dias[fecha] = dias.get(fecha, 0) + signo
+            r = ventas.setdefault((fecha, self._clave_venta(fila[3], numero)), [0, 0])
+            r[0] += signo; r[1] = max(r[1], numero)
+            if fila[13] != "Completada":
+                continue
+            total = self._centavos(fila[8]) * signo
+            ganancia = self._centavos(fila[9]) * signo
+            origen = fila[10] or "Desconocido"
+            pago = fila[12] if fila[12] is not None else "Efectivo"
+            desc = (fila[4] or "").strip()
+
+            r = locales.setdefault((fecha, origen), [0, 0, 0, 0])
+            r[0] += signo; r[1] += total; r[2] += ganancia; r[3] = max(r[3], numero)
+            r = pagos.setdefault((fecha, pago), [0, 0, 0])
+            r[0] += signo; r[1] += total; r[2] = max(r[2], numero)
+            r = productos.setdefault((fecha, desc), [0, 0, 0])
+            r[0] += fila[5] * signo; r[1] += total; r[2] += ganancia
+
+        con.executemany("""
+            INSERT INTO resumen_dia (fecha, lineas) VALUES (?, ?)
+            ON CONFLICT(fecha) DO UPDATE SET lineas = lineas + excluded.lineas
+        """, list(dias.items()))
+        con.executemany("""
+            INSERT INTO resumen_local (fecha, origen, lineas, total, ganancia, ultima_fila) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(fecha, origen) DO UPDATE SET
+                lineas = lineas + excluded.lineas, total = total + excluded.total,
+                ganancia = ganancia + excluded.ganancia, ultima_fila = MAX(ultima_fila, excluded.ultima_fila)
+        """, [k + tuple(v) for k, v in locales.items()])
+        con.executemany("""
+            INSERT INTO resumen_pago (fecha, medio_pago, lineas, total, ultima_fila) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(fecha, medio_pago) DO UPDATE SET
+                lineas = lineas + excluded.lineas, total = total + excluded.total,
+                ultima_fila = MAX(ultima_fila, excluded.ultima_fila)
+        """, [k + tuple(v) for k, v in pagos.items()])
+        con.executemany("""
+            INSERT INTO resumen_producto (fecha, descripcion, unidades, total, ganancia) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(fecha, descripcion) DO UPDATE SET
+                unidades = unidades + excluded.unidades, total = total + excluded.total,
+                ganancia = ganancia + excluded.ganancia
+        """, [k + tuple(v) for k, v in productos.items()])
+        con.executemany("""
+            INSERT INTO resumen_venta (fecha, clave, lineas, ultima_fila) VALUES (?, ?, ?, ?)
+            ON CONFLICT(fecha, clave) DO UPDATE SET
+                lineas = lineas + excluded.lineas, ultima_fila = MAX(ultima_fila, excluded.ultima_fila)
+        """, [k + tuple(v) for k, v in ventas.items()])
+        if signo < 0:
+            con.execute("DELETE FROM resumen_dia WHERE lineas <= 0")
+            con.execute("DELETE FROM resumen_local WHERE lineas <= 0")
+            con.execute("DELETE FROM resumen_pago WHERE lineas <= 0")
+            con.execute("DELETE FROM resumen_producto WHERE unidades <= 0 AND total = 0")
+            con.execute("DELETE FROM resumen_venta WHERE lineas <= 0")
+
+    @staticmethod
+    def _clave_venta(id_venta, numero):
+        return id_venta if id_venta else f"#{numero}"
+
+    def sincronizar(self):
+        """Pone el índice al día con el CSV. Devuelve el número de filas importadas."""
+        firma = CatalogoProductos.firma_archivo(self.archivo_csv)
+        if firma is not None and firma == self._firma:
+            return 0
+
+        with file_locks(self.archivo_csv), medir_io():
+            con = self._conexion()
+            firma = CatalogoProductos.firma_archivo(self.archivo_csv)
+            with con:
+                meta = self._leer_meta(con)
+                if firma is None:
+                    con.execute("DELETE FROM ventas")
+                    for tabla in self.TABLAS_RESUMEN:
+                        con.execute(f"DELETE FROM {tabla}")
+                    self.generacion += 1
+                    con.execute("DELETE FROM meta WHERE clave IN ('firma', 'offset', 'cola', 'cabecera', 'fila')")
+                    self._firma = None
+                    return 0
+                if meta.get("firma") == json.dumps(firma):
+                    self._firma = firma
+                    return 0
+
+                offset = int(meta.get("offset") or 0)
+                desde = 0
+                if 0 < offset < firma[1]:
+                    cola = bytes.fromhex(meta.get("cola") or "")
+                    with open(self.archivo_csv, "rb") as f:
+                        f.seek(offset - len(cola))
+                        if f.read(len(cola)) == cola:
+                            desde = offset
+
+                importadas = self._importar(con, desde, meta)
+                meta["firma"] = json.dumps(firma)
+                con.executemany(
+                    "INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", list(meta.items())
+                )
+            self._firma = firma
+            return importadas
+
+    def reimportar(self):
+        """Importación completa (one-shot) del CSV, ignorando el estado guardado."""
+        with file_locks(self.archivo_csv):
+            con = self._conexion()
+            with con:
+                con.execute("DELETE FROM meta WHERE clave = 'firma'")
+                con.execute("DELETE FROM meta WHERE clave = 'offset'")
+            self._firma = None
+            return self.sincronizar()
+
+    def exportar_csv(self, destino):
+        """Escribe el contenido del índice en el formato de registro_ventas.csv."""
+        self.sincronizar()
+        con = self._conexion()
+        meta = self._leer_meta(con)
+        header = json.loads(meta.get("cabecera") or json.dumps(COLUMNAS_VENTAS))
+        with abrir_atomico(destino, encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for fila in con.execute("SELECT crudo FROM ventas ORDER BY fila"):
+                writer.writerow(json.loads(fila["crudo"]))
+
+    # --- Anulaciones ---
+
+    def _ids_anulados(self):
+        if self._anuladas is None:
+            anuladas = set()
+            if os.path.exists(self.archivo_anulaciones):
+                with open(self.archivo_anulaciones, "r", encoding="utf-8") as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    for row in reader:
+                        if len(row) >= 2:
+                            anuladas.add(row[1])
+            self._anuladas = anuladas
+        return self._anuladas
+
+    def anulada(self, id_venta):
+        """True si id_venta tiene lápida en el log de anulaciones."""
+        with file_locks(self.archivo_csv, self.archivo_anulaciones):
+            return id_venta in self._ids_anulados()
+
+    def anular(self, id_venta):
+        """Registra la anulación de una venta y devuelve sus filas (lista vacía si no existe).
+
+        El costo no depende del tamaño del historial: una búsqueda por el índice de
+        ID_Venta, una línea agregada al log de anulaciones y un DELETE indexado.
+        """
+        with file_locks(self.archivo_csv, self.archivo_anulaciones):
+            filas = self.consultar("SELECT * FROM ventas WHERE id_venta = ? ORDER BY fila", (id_venta,))
+            if not filas:
+                return []
+
+            nuevo = not os.path.exists(self.archivo_anulaciones)
+            with medir_io(), open(self.archivo_anulaciones, "a", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                if nuevo:
+                    writer.writerow(["Timestamp", "ID_Venta"])
+                writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), id_venta])
+                f.flush()
+                os.fsync(f.fileno())
+            self._ids_anulados().add(id_venta)
+
+            con = self._conexion()
+            with con:
+                con.execute("DELETE FROM ventas WHERE id_venta = ?", (id_venta,))
+                self._acumular(con, filas, -1)
+        return filas
+
+    def compactar(self):
+        """Retira del CSV las filas de ventas anuladas. Devuelve cuántas filas quitó.
+
+        Las lápidas se conservan. Si no hubo anulaciones desde la última compactación
+        no se lee el CSV, y si ninguna fila estaba anulada tampoco se reescribe.
+        """
+        with file_locks(self.archivo_csv, self.archivo_anulaciones):
+            anuladas = self._ids_anulados()
+            con = self._conexion()
+            if not anuladas or self._leer_meta(con).get("anuladas_compactadas") == str(len(anuladas)):
+                return 0
+            eliminadas = 0
+            if os.path.exists(self.archivo_csv):
+                with open(self.archivo_csv, "r", encoding="utf-8") as f:
+                    reader = csv.reader(f)
+                    header = next(reader, None)
+                    rows = list(reader)
+
+                id_idx = header.index("ID_Venta") if header and "ID_Venta" in header else 1
+                restantes = []
+                for row in rows:
+                    if row and len(row) > id_idx and row[id_idx] in anuladas:
+                        eliminadas += 1
+                        continue
+                    restantes.append(row)
+
+                if eliminadas:
+                    with abrir_atomico(self.archivo_csv, encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        if header:
+                            writer.writerow(header)
+                        writer.writerows(restantes)
+
+            self.sincronizar()
+            with con:
+                con.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('anuladas_compactadas', ?)",
+                            (str(len(anuladas)),))
+            return eliminadas
+
+    # --- Consultas ---
+
+    def consultar(self, sql, params=()):
+        self.sincronizar()
+        return self._conexion().execute(sql, params).fetchall()
+
+    def iterar(self, sql, params=()):
+        """Como consultar() pero devuelve el cursor para recorrer las filas sin cargarlas todas."""
+        self.sincronizar()
+        return self._conexion().execute(sql, params)
+
+    def ultima_fila(self):
+        return self.consultar("SELECT COALESCE(MAX(fila), 0) FROM ventas")[0][0]
+
+    def ventas_del_dia(self, fecha, local_file=None, solo_completadas=True):
+        sql = "SELECT * FROM ventas WHERE fecha = ?"
+        params = [fecha]
+        if solo_completadas:
+            sql += " AND estado = 'Completada'"
+        if local_file:
+            sql += " AND archivo_origen = ?"
+            params.append(local_file)
+        return self.consultar(sql + " ORDER BY fila", params)
+
+    def total_ventas_dia(self, fecha, local_file=None):
+        sql = "SELECT COALESCE(SUM(total_venta), 0.0) FROM ventas WHERE fecha = ? AND estado = 'Completada'"
+        params = [fecha]
+        if local_file:
+            sql += " AND archivo_origen = ?"
+            params.append(local_file)
+        return self.consultar(sql, params)[0][0]
+
+    def ventas_rango(self, fecha_inicio, fecha_fin, limite=-1, desplazamiento=0, iterar=False):
+        """Filas reportables del rango, de la más reciente a la más antigua.
+
+        La paginación es por venta: `limite` y `desplazamiento` cuentan ventas de
+        resumen_venta, y se devuelven todas las filas de las ventas de la página.
+        """
+        reportable = (
+            "v.timestamp != '' AND v.cantidad IS NOT NULL AND v.costo_unitario IS NOT NULL "
+            "AND v.precio_unitario IS NOT NULL AND v.total_venta IS NOT NULL AND v.ganancia IS NOT NULL"
+        )
+        return (self.iterar if iterar else self.consultar)(f"""
+            WITH pagina AS (
+                SELECT fecha, clave FROM resumen_venta WHERE fecha >= ? AND fecha <= ?
+                ORDER BY ultima_fila DESC LIMIT ? OFFSET ?
+            )
+            SELECT v.* FROM pagina p JOIN ventas v ON v.id_venta = p.clave AND v.fecha = p.fecha
+            WHERE {reportable}
+            UNION ALL
+            SELECT v.* FROM pagina p JOIN ventas v ON v.fila = CAST(substr(p.clave, 2) AS INTEGER)
+            WHERE p.clave LIKE '#%' AND {reportable}
+            ORDER BY fila DESC
+        """, (fecha_inicio, fecha_fin, limite, desplazamiento))
+
+    def resumen_rango(self, fecha_inicio, fecha_fin, max_productos=20):
+        """Totales de /api/reportes sumando los resúmenes diarios del rango."""
+        rango = (fecha_inicio, fecha_fin)
+        lineas = self.consultar(
+            "SELECT COALESCE(SUM(lineas), 0) FROM resumen_dia WHERE fecha >= ? AND fecha <= ?", rango
+        )[0][0]
+        num_ventas = self.consultar(
+            "SELECT COUNT(*) FROM resumen_venta WHERE fecha >= ? AND fecha <= ?", rango
+        )[0][0]
+        # Locales y medios de pago en el orden de su venta más reciente
+        por_local = self.consultar("""
+            SELECT origen, SUM(lineas) AS lineas, SUM(total) AS total, SUM(ganancia) AS ganancia
+            FROM resumen_local WHERE fecha >= ? AND fecha <= ?
+            GROUP BY origen ORDER BY MAX(ultima_fila) DESC
+        """, rango)
+        por_pago = self.consultar("""
+            SELECT medio_pago, SUM(total) AS total FROM resumen_pago
+            WHERE fecha >= ? AND fecha <= ?
+            GROUP BY medio_pago ORDER BY MAX(ultima_fila) DESC
+        """, rango)
+        por_producto = self.consultar("""
+            SELECT descripcion, SUM(unidades) AS unidades, SUM(total) AS total, SUM(ganancia) AS ganancia
+            FROM resumen_producto WHERE fecha >= ? AND fecha <= ?
+            GROUP BY descripcion ORDER BY total DESC LIMIT ?
+        """, rango + (max_productos,))
+        return {
+            "total_ventas": sum(r["total"] for r in por_local) / 100,
+            "total_ganancia": sum(r["ganancia"] for r in por_local) / 100,
+            "sales_count": sum(r["lineas"] for r in por_local),
+            "por_local": {r["origen"]: r["total"] / 100 for r in por_local},
+            "por_medio_pago": {r["medio_pago"]: r["total"] / 100 for r in por_pago},
+            "por_producto": [
+                {"descripcion": r["descripcion"], "unidades": r["unidades"],
+                 "total": r["total"] / 100, "ganancia": r["ganancia"] / 100}
+                for r in por_producto
+            ],
+            "total_lineas": lineas,
+            "num_ventas": num_ventas
+        }
+
+    def ids_registrados(self, ids):
+        """Subconjunto de `ids` que ya está en el registro (incluidas las ventas anuladas)."""
+        ids = list(set(ids))
+        encontrados = set()
+        for i in range(0, len(ids), 500):
+            bloque = ids[i:i + 500]
+            marcas = ", ".join("?" * len(bloque))
+            filas = self.consultar(f"SELECT DISTINCT id_venta FROM ventas WHERE id_venta IN ({marcas})", bloque)
+            encontrados.update(f["id_venta"] for f in filas)
+        # Los dos bloqueos juntos y en el mismo orden que anular() y compactar(); quien
+        # llame con el registro ya bloqueado debe haber tomado también las anulaciones
+        with file_locks(self.archivo_csv, self.archivo_anulaciones):
+            encontrados.update(self._ids_anulados() & set(ids))
+        return encontrados
+
+    def ultimos_precios(self):
+        filas = self.consultar("""
+            SELECT descripcion, precio_unitario FROM ventas
+            WHERE fila IN (
+                SELECT MAX(fila) FROM ventas
+                WHERE COALESCE(estado, '') != 'Anulada' AND precio_unitario IS NOT NULL
+                GROUP BY TRIM(descripcion)
+            )
+        """)
+        return {f["descripcion"].strip(): f["precio_unitario"] for f in filas if f["descripcion"] is not None}
+
+libro_ventas = LibroVentas()
+
+def obtener_ultimos_precios():
+    try:
+        return libro_ventas.ultimos_precios()
+    except Exception as e:
+        print(f"Error al obtener últimos precios: {e}")
+        return {}
 
 def deduct_stock(archivo_origen, items):
     if not os.path.exists(archivo_origen):
         return False, f"El archivo de stock {archivo_origen} no existe."
     
-    try:
-        with open(archivo_origen, 'r', encoding='utf-8') as f:
-            lineas = f.readlines()
-            
-        stock_map = {}
-        for idx, line in enumerate(lineas):
-            line_stripped = line.strip()
-            if not line_stripped:
-                continue
-            partes = line_stripped.rsplit(' ', 1)
-            if len(partes) == 2:
-                desc, qty_str = partes
-                try:
-                    stock_map[desc.strip()] = {
-                        "index": idx,
-                        "qty": int(qty_str)
-                    }
-                except ValueError:
-                    continue
-                    
-        # Verificar stock disponible para todos los items antes de modificar nada
-        for item in items:
-            desc = item["descripcion"].strip()
-            cant = int(item["cantidad"])
-            if desc not in stock_map:
-                return False, f"El producto '{desc}' no se encuentra en el stock de {archivo_origen}."
-            if stock_map[desc]["qty"] < cant:
-                return False, f"Stock insuficiente para '{desc}' en {archivo_origen}. Disponible: {stock_map[desc]['qty']}, requerido: {cant}."
+    # Agrupar por descripción: un producto repetido en la venta se descuenta completo
+    requeridos = {}
+    for item in items:
+        desc = item["descripcion"].strip()
+        requeridos[desc] = requeridos.get(desc, 0) + int(item["cantidad"])
+    
+    diario = obtener_diario(archivo_origen)
+    with diario.bloqueo() as stock:
+        try:
+            version = diario.version
+            # Verificar stock disponible para todos los items antes de modificar nada
+            for desc, cant in requeridos.items():
+                if desc not in stock:
+                    return False, f"El producto '{desc}' no se encuentra en el stock de {archivo_origen}."
+                if stock[desc] < cant:
+                    return False, f"Stock insuficiente para '{desc}' en {archivo_origen}. Disponible: {stock[desc]}, requerido: {cant}."
                 
-        # Realizar deducción
-        for item in items:
-            desc = item["descripcion"].strip()
-            cant = int(item["cantidad"])
-            idx = stock_map[desc]["index"]
-            new_qty = stock_map[desc]["qty"] - cant
-            lineas[idx] = f"    {desc} {new_qty}\n"
+            # Realizar deducción (una línea en el diario, sin reescribir el archivo)
+            nuevas_cantidades = diario.registrar({desc: -cant for desc, cant in requeridos.items()})
+            catalogo.actualizar_stock(archivo_origen, nuevas_cantidades, version)
             
-        with open(archivo_origen, 'w', encoding='utf-8') as f:
-            f.writelines(lineas)
-            
-        return True, "Stock actualizado correctamente."
-    except Exception as e:
-        return False, f"Error al actualizar stock: {e}"
+            return True, "Stock actualizado correctamente."
+        except Exception as e:
+            return False, f"Error al actualizar stock: {e}"
+
+def deduct_stock_batch(archivo_origen, ventas):
+    """Descuenta varias ventas de un archivo de stock con un solo registro en el diario.
+
+    Las ventas se revisan en orden contra el stock que van dejando las anteriores;
+    las que no alcanzan quedan fuera sin afectar a las demás. Devuelve una lista de
+    (success, msg) en el mismo orden que `ventas` (cada una es una lista de items).
+    """
+    if not os.path.exists(archivo_origen):
+        return [(False, f"El archivo de stock {archivo_origen} no existe.")] * len(ventas)
+
+    diario = obtener_diario(archivo_origen)
+    with diario.bloqueo() as stock:
+        try:
+            version = diario.version
+            disponible = {}
+            total = {}
+            resultados = []
+            for items in ventas:
+                requeridos = {}
+                for item in items:
+                    desc = item["descripcion"].strip()
+                    requeridos[desc] = requeridos.get(desc, 0) + int(item["cantidad"])
+
+                error = None
+                for desc, cant in requeridos.items():
+                    if desc not in stock:
+                        error = f"El producto '{desc}' no se encuentra en el stock de {archivo_origen}."
+                        break
+                    actual = disponible.get(desc, stock[desc])
+                    if actual < cant:
+                        error = f"Stock insuficiente para '{desc}' en {archivo_origen}. Disponible: {actual}, requerido: {cant}."
+                        break
+                if error:
+                    resultados.append((False, error))
+                    continue
+
+                for desc, cant in requeridos.items():
+                    disponible[desc] = disponible.get(desc, stock[desc]) - cant
+                    total[desc] = total.get(desc, 0) + cant
+                resultados.append((True, "Stock actualizado correctamente."))
+
+            if total:
+                nuevas_cantidades = diario.registrar({desc: -cant for desc, cant in total.items()})
+                catalogo.actualizar_stock(archivo_origen, nuevas_cantidades, version)
+            return resultados
+        except Exception as e:
+            return [(False, f"Error al actualizar stock: {e}")] * len(ventas)
 
 def restore_stock(archivo_origen, desc, cant):
     return adjust_product_stock(archivo_origen, desc, cant)
 
+def restore_stock_batch(archivo_origen, cantidades):
+    return adjust_stock_batch(archivo_origen, cantidades)
+
 def adjust_product_stock(filename, desc, cambio):
-    desc_stripped = desc.strip()
-    try:
-        lineas = []
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                lineas = f.readlines()
-                
-        item_encontrado = False
-        for idx, line in enumerate(lineas):
-            line_stripped = line.strip()
-            if not line_stripped:
-                continue
-            partes = line_stripped.rsplit(' ', 1)
-            if len(partes) == 2 and partes[0].strip() == desc_stripped:
-                try:
-                    current_qty = int(partes[1])
-                    new_qty = current_qty + cambio
-                    if new_qty < 0:
+    return adjust_stock_batch(filename, {desc.strip(): cambio})
+
+def adjust_stock_batch(filename, cambios):
+    """Aplica {descripcion: cambio} a un archivo de stock con un solo registro en el diario.
+
+    Si algún producto quedaría en negativo no se modifica nada.
+    """
+    cambios = {desc.strip(): cambio for desc, cambio in cambios.items()}
+    diario = obtener_diario(filename)
+    with diario.bloqueo() as stock:
+        try:
+            version = diario.version
+            for desc, cambio in cambios.items():
+                if desc in stock:
+                    if stock[desc] + cambio < 0:
                         return False, "La cantidad de existencias no puede ser menor a cero."
-                    lineas[idx] = f"    {desc_stripped} {new_qty}\n"
-                    item_encontrado = True
-                    break
-                except ValueError:
-                    continue
-                    
-        if not item_encontrado:
-            if cambio < 0:
-                return False, "El producto no existe y no se pueden restar unidades."
-            lineas.append(f"    {desc_stripped} {cambio}\n")
+                elif cambio < 0:
+                    return False, "El producto no existe y no se pueden restar unidades."
             
-        # Re-filtrar y limpiar líneas vacías o rotas
-        formatted_lines = []
-        for line in lineas:
-            line_stripped = line.strip()
-            if not line_stripped:
-                continue
-            partes = line_stripped.rsplit(' ', 1)
-            if len(partes) == 2:
-                try:
-                    int(partes[1])
-                    formatted_lines.append(line)
-                except ValueError:
-                    continue
-                    
-        # Ordenar alfabéticamente por descripción
-        formatted_lines.sort(key=lambda x: x.strip().rsplit(' ', 1)[0].lower())
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.writelines(formatted_lines)
+            nuevas_cantidades = diario.registrar(cambios)
+            catalogo.actualizar_stock(filename, nuevas_cantidades, version)
             
-        return True, "Stock ajustado correctamente."
-    except Exception as e:
-        return False, f"Error al ajustar stock en archivo: {e}"
+            return True, "Stock ajustado correctamente."
+        except Exception as e:
+            return False, f"Error al ajustar stock en archivo: {e}"
 
 def transfer_product_stock(producto, origen, destino, cantidad):
     producto_stripped = producto.strip()
@@ -423,59 +2014,506 @@ def transfer_product_stock(producto, origen, destino, cantidad):
     if origen not in allowed_sources or destino not in allowed_sources:
         return False, "Ubicaciones de origen o destino no válidas."
         
-    try:
-        # 1. Leer stock de origen y verificar disponibilidad
-        origen_stock = parse_stock_file(origen)
-        if producto_stripped not in origen_stock:
-            return False, f"El producto '{producto_stripped}' no existe en la ubicación de origen: {origen}."
-        if origen_stock[producto_stripped] < cantidad:
-            return False, f"Stock insuficiente en la ubicación de origen: {origen}. Disponible: {origen_stock[producto_stripped]}, requerido: {cantidad}."
+    with file_locks(origen, destino):
+        try:
+            # 1. Leer stock de origen y verificar disponibilidad
+            origen_stock = obtener_diario(origen).vista()
+            if producto_stripped not in origen_stock:
+                return False, f"El producto '{producto_stripped}' no existe en la ubicación de origen: {origen}."
+            if origen_stock[producto_stripped] < cantidad:
+                return False, f"Stock insuficiente en la ubicación de origen: {origen}. Disponible: {origen_stock[producto_stripped]}, requerido: {cantidad}."
             
-        # 2. Restar en origen
-        success_orig, msg_orig = adjust_product_stock(origen, producto_stripped, -cantidad)
-        if not success_orig:
-            return False, f"Error al restar del origen: {msg_orig}"
+            # 2. Restar en origen
+            success_orig, msg_orig = adjust_product_stock(origen, producto_stripped, -cantidad)
+            if not success_orig:
+                return False, f"Error al restar del origen: {msg_orig}"
             
-        # 3. Sumar en destino
-        success_dest, msg_dest = adjust_product_stock(destino, producto_stripped, cantidad)
-        if not success_dest:
-            # Revertir resta en origen si falla la suma
-            adjust_product_stock(origen, producto_stripped, cantidad)
-            return False, f"Error al sumar al destino: {msg_dest}"
+            # 3. Sumar en destino
+            success_dest, msg_dest = adjust_product_stock(destino, producto_stripped, cantidad)
+            if not success_dest:
+                # Revertir resta en origen si falla la suma
+                adjust_product_stock(origen, producto_stripped, cantidad)
+                return False, f"Error al sumar al destino: {msg_dest}"
             
-        return True, "Traslado realizado con éxito."
-    except Exception as e:
-        return False, f"Error al procesar traslado: {e}"
-
-def save_customer(nombre, contacto):
-    nombre = nombre.strip()
-    contacto = contacto.strip()
-    if not nombre or nombre.lower() == "cliente general":
-        return True
-    
-    archivo_clientes = "clientes.csv"
-    clientes = {}
-    try:
-        if os.path.exists(archivo_clientes):
-            with open(archivo_clientes, "r", encoding="utf-8") as f:
+            return True, "Traslado realizado con éxito."
+        except Exception as e:
+            return False, f"Error al procesar traslado: {e}"
+
+class DirectorioClientes:
+    """Índice en memoria de clientes.csv con escritura solo por agregado.
+
+    Registrar o actualizar un cliente agrega una fila al final del CSV (la última
+    fila de un nombre es la que vale, igual que al leerlo con un dict en
+    inventario_gui). Cuando se acumulan filas obsoletas, una compactación en segundo
+    plano reescribe el archivo sin duplicados. Si otra herramienta modifica el
+    archivo se detecta por su firma y se vuelve a leer.
+    """
+    MAX_OBSOLETAS = 200
+    RETRASO_COMPACTACION = 5.0
+    LIMITE_BUSQUEDA = 20
+
+    def __init__(self, archivo="clientes.csv"):
+        self.archivo = archivo
+        self._clientes = {}
+        self._minusculas = {}
+        self._firma = False
+        self._obsoletas = 0
+        self._timer = None
+
+    def _cargar(self):
+        clientes = {}
+        filas = 0
+        if os.path.exists(self.archivo):
+            with medir_io(), open(self.archivo, "r", encoding="utf-8") as f:
                 reader = csv.reader(f)
                 next(reader, None)  # header
                 for row in reader:
-                    if row and len(row) >= 1:
+                    if row and len(row) >= 1 and row[0].strip():
                         clientes[row[0].strip()] = row[1].strip() if len(row) > 1 else ""
-                        
-        if nombre not in clientes or clientes[nombre] != contacto:
-            clientes[nombre] = contacto
-            with open(archivo_clientes, "w", encoding="utf-8", newline="") as f:
+                        filas += 1
+        self._clientes = clientes
+        self._minusculas = {n: (n.lower(), c.lower()) for n, c in clientes.items()}
+        self._obsoletas = filas - len(clientes)
+        if self._obsoletas > self.MAX_OBSOLETAS:
+            self._programar_compactacion()
+
+    def _verificar(self):
+        firma = CatalogoProductos.firma_archivo(self.archivo)
+        if firma != self._firma:
+            self._cargar()
+            self._firma = firma
+
+    def registrar(self, nombre, contacto=None):
+        """Agrega o actualiza un cliente. Con contacto=None se conserva el contacto que ya tenga."""
+        with file_locks(self.archivo):
+            self._verificar()
+            existente = self._clientes.get(nombre)
+            if contacto is None:
+                if existente is not None:
+                    return
+                contacto = ""
+            if existente == contacto:
+                return
+
+            nuevo = not os.path.exists(self.archivo)
+            with medir_io(), open(self.archivo, "a+b") as f:
+                # Si alguien dejó el archivo sin salto de línea final no se pega la fila
+                if not nuevo and f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) not in (b"\n", b"\r"):
+                        f.write(b"\r\n")
+                texto = io.StringIO(newline="")
+                writer = csv.writer(texto)
+                if nuevo:
+                    writer.writerow(["Nombre", "Contacto"])
+                writer.writerow([nombre, contacto])
+                f.write(texto.getvalue().encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._clientes[nombre] = contacto
+            self._minusculas[nombre] = (nombre.lower(), contacto.lower())
+            self._firma = CatalogoProductos.firma_archivo(self.archivo)
+            if existente is not None:
+                self._obsoletas += 1
+                if self._obsoletas > self.MAX_OBSOLETAS:
+                    self._programar_compactacion()
+
+    def _programar_compactacion(self):
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.RETRASO_COMPACTACION, self._compactar_seguro)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _compactar_seguro(self):
+        try:
+            self.compactar()
+        except Exception as e:
+            print(f"Error compactando {self.archivo}: {e}")
+
+    def compactar(self):
+        """Reescribe clientes.csv con una fila por cliente."""
+        with file_locks(self.archivo):
+            self._timer = None
+            self._verificar()
+            if not self._obsoletas:
+                return
+            with abrir_atomico(self.archivo, encoding="utf-8", newline="") as f:
                 writer = csv.writer(f)
                 writer.writerow(["Nombre", "Contacto"])
-                for n, c in clientes.items():
+                for n, c in self._clientes.items():
                     writer.writerow([n, c])
+            self._obsoletas = 0
+            self._firma = CatalogoProductos.firma_archivo(self.archivo)
+
+    def listar(self):
+        with file_locks(self.archivo):
+            self._verificar()
+            return [{"nombre": n, "contacto": c} for n, c in self._clientes.items()]
+
+    def buscar(self, q, limite=None):
+        """Clientes cuyo nombre o contacto contiene `q`; primero los que empiezan por `q`.
+
+        Devuelve (resultados, total_coincidencias).
+        """
+        limite = limite or self.LIMITE_BUSQUEDA
+        q = q.strip().lower()
+        with file_locks(self.archivo):
+            self._verificar()
+            prefijo, contiene = [], []
+            for nombre, (nombre_min, contacto_min) in self._minusculas.items():
+                if nombre_min.startswith(q) or (" " + q) in nombre_min or contacto_min.startswith(q):
+                    prefijo.append(nombre)
+                elif q in nombre_min or q in contacto_min:
+                    contiene.append(nombre)
+            prefijo.sort(key=str.lower)
+            contiene.sort(key=str.lower)
+            nombres = (prefijo + contiene)[:limite]
+            resultados = [{"nombre": n, "contacto": self._clientes[n]} for n in nombres]
+            return resultados, len(prefijo) + len(contiene)
+
+directorio_clientes = DirectorioClientes()
+
+def save_customer(nombre, contacto=None):
+    nombre = nombre.strip()
+    contacto = contacto.strip() if contacto is not None else None
+    if not nombre or nombre.lower() == "cliente general":
+        return True
+    
+    try:
+        directorio_clientes.registrar(nombre, contacto)
         return True
     except Exception as e:
         print(f"Error al guardar cliente: {e}")
         return False
 
+# --- REGISTRO DE VENTAS ---
+
+ORIGENES_VENTA = ["local.txt", "local_2.txt", "bodegac.txt"]
+MAX_VENTAS_LOTE = 500
+
+def append_ventas(ventas):
+    """Agrega al registro las filas de varias ventas con una sola escritura.
+
+    Cada venta es un dict con timestamp, id_venta, items, archivo_origen, cliente y medio_pago.
+    """
+    archivo_ventas = ARCHIVO_VENTAS
+    with file_locks(archivo_ventas), medir_io():
+        if not os.path.exists(archivo_ventas):
+            try:
+                with open(archivo_ventas, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(COLUMNAS_VENTAS)
+            except Exception as e:
+                print(f"Error creando registro_ventas: {e}")
+
+        with open(archivo_ventas, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            for venta in ventas:
+                for item in venta["items"]:
+                    desc = item["descripcion"].strip()
+                    cant = int(item["cantidad"])
+                    precio = float(item["precio"])
+                    costo = float(item["costo"])
+                    total_item = cant * precio
+                    ganancia_item = total_item - (cant * costo)
+
+                    writer.writerow([
+                        venta["timestamp"],
+                        venta["id_venta"],
+                        desc,
+                        cant,
+                        f"{costo:.2f}",
+                        f"{precio:.2f}",
+                        f"{total_item:.2f}",
+                        f"{ganancia_item:.2f}",
+                        venta["archivo_origen"],
+                        venta["cliente"],
+                        venta["medio_pago"],
+                        "Completada"
+                    ])
+
+class CacheIdempotencia:
+    """Respuestas de /api/ventas ya enviadas, por id_venta, para contestar reintentos.
+
+    Se guarda en memoria un máximo de MAX_ENTRADAS (se descartan las más antiguas) y
+    cada respuesta se agrega con fsync a un archivo JSON por línea, así sobrevive a un
+    reinicio. Cuando el archivo acumula el doble de líneas se reescribe solo con las
+    vigentes. Solo se guardan ventas registradas: un error no modificó nada y el
+    reintento se puede procesar de nuevo.
+    """
+    MAX_ENTRADAS = 2000
+
+    def __init__(self, archivo="idempotencia_ventas.jsonl"):
+        self.archivo = archivo
+        self._lock = threading.Lock()
+        self._entradas = None
+        self._lineas = 0
+
+    def _cargar(self):
+        self._entradas = collections.OrderedDict()
+        self._lineas = 0
+        if not os.path.exists(self.archivo):
+            return
+        with open(self.archivo, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                    self._entradas[registro["id_venta"]] = registro["respuesta"]
+                    self._entradas.move_to_end(registro["id_venta"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # Línea cortada por un cierre inesperado
+                self._lineas += 1
+        while len(self._entradas) > self.MAX_ENTRADAS:
+            self._entradas.popitem(last=False)
+
+    def obtener(self, id_venta):
+        with self._lock:
+            if self._entradas is None:
+                self._cargar()
+            return self._entradas.get(id_venta)
+
+    def guardar(self, id_venta, respuesta):
+        with self._lock:
+            if self._entradas is None:
+                self._cargar()
+            with medir_io(), open(self.archivo, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"id_venta": id_venta, "respuesta": respuesta}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._lineas += 1
+            self._entradas[id_venta] = respuesta
+            self._entradas.move_to_end(id_venta)
+            while len(self._entradas) > self.MAX_ENTRADAS:
+                self._entradas.popitem(last=False)
+            if self._lineas > 2 * self.MAX_ENTRADAS:
+                self._compactar()
+
+    def _compactar(self):
+        try:
+            with abrir_atomico(self.archivo, encoding="utf-8") as f:
+                for id_venta, respuesta in self._entradas.items():
+                    f.write(json.dumps({"id_venta": id_venta, "respuesta": respuesta}, ensure_ascii=False) + "\n")
+            self._lineas = len(self._entradas)
+        except Exception as e:
+            print(f"Error compactando {self.archivo}: {e}")
+
+idempotencia_ventas = CacheIdempotencia()
+
+def respuesta_venta_registrada(id_venta):
+    """Respuesta para un id_venta que ya está en el registro, o None si no está.
+
+    Una venta anulada responde siempre 409, aunque su respuesta siga en la caché.
+    Si no, se busca la respuesta original en la caché; si ya salió de ella (o la
+    venta llegó por /api/ventas/lote) se arma a partir de las filas del registro.
+    Devuelve (status, respuesta).
+    """
+    if libro_ventas.anulada(id_venta):
+        return 409, {"error": "La venta ya fue registrada y luego anulada.", "id_venta": id_venta}
+    respuesta = idempotencia_ventas.obtener(id_venta)
+    if respuesta is not None:
+        return 200, respuesta
+    if not libro_ventas.ids_registrados([id_venta]):
+        return None
+    filas = libro_ventas.consultar("SELECT * FROM ventas WHERE id_venta = ? ORDER BY fila", (id_venta,))
+    if not filas:
+        return 409, {"error": "La venta ya fue registrada y luego anulada.", "id_venta": id_venta}
+    ultima = filas[-1]
+    items = [{
+        "descripcion": f["descripcion"],
+        "cantidad": f["cantidad"],
+        "precio": f["precio_unitario"],
+        "costo": f["costo_unitario"]
+    } for f in filas]
+    return 200, {
+        "message": "Venta registrada con éxito.",
+        "id_venta": id_venta,
+        "timestamp": ultima["timestamp"],
+        "ticket": {
+            "id_venta": id_venta,
+            "timestamp": ultima["timestamp"],
+            "cliente": ultima["cliente"],
+            "medio_pago": ultima["medio_pago"],
+            "items": items
+        }
+    }
+
+def registrar_venta(id_venta, items, archivo_origen, cliente, medio_pago):
+    """Descuenta el stock y agrega la venta al registro. Devuelve (status, respuesta, nueva).
+
+    Con un id_venta del cliente es idempotente: la revisión de duplicados y la
+    escritura van bajo el bloqueo del registro (igual que en /api/ventas/lote) y un
+    reintento recibe la respuesta original con nueva=False, sin tocar el stock.
+    """
+    # Las anulaciones se bloquean junto con el registro (ver registrar_lote_ventas)
+    with file_locks(ARCHIVO_VENTAS, libro_ventas.archivo_anulaciones):
+        if id_venta:
+            previa = respuesta_venta_registrada(id_venta)
+            if previa is not None:
+                return previa[0], previa[1], False
+        else:
+            id_venta = generar_id_venta()
+
+        success, msg = deduct_stock(archivo_origen, items)
+        if not success:
+            return 400, {"error": msg}, False
+
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            append_ventas([{
+                "timestamp": timestamp,
+                "id_venta": id_venta,
+                "items": items,
+                "archivo_origen": archivo_origen,
+                "cliente": cliente,
+                "medio_pago": medio_pago
+            }])
+        except Exception:
+            # La venta no quedó en el registro: se devuelve el stock para que el reintento
+            # con el mismo id_venta no lo descuente dos veces
+            cantidades = {}
+            for item in items:
+                desc = item["descripcion"].strip()
+                cantidades[desc] = cantidades.get(desc, 0) + int(item["cantidad"])
+            success, msg = restore_stock_batch(archivo_origen, cantidades)
+            if not success:
+                print(f"Error devolviendo el stock de la venta {id_venta}: {msg}")
+            raise
+        respuesta = {
+            "message": "Venta registrada con éxito.",
+            "id_venta": id_venta,
+            "timestamp": timestamp,
+            "ticket": {
+                "id_venta": id_venta,
+                "timestamp": timestamp,
+                "cliente": cliente,
+                "medio_pago": medio_pago,
+                "items": items
+            }
+        }
+        try:
+            idempotencia_ventas.guardar(id_venta, respuesta)
+        except Exception as e:
+            print(f"Error guardando la respuesta de la venta {id_venta}: {e}")
+    publicar_caja(timestamp[:10], archivo_origen, "venta")
+    return 200, respuesta, True
+
+def _normalizar_venta_lote(data):
+    """Valida una venta del lote. Devuelve (venta, None) o (None, mensaje de error)."""
+    if not isinstance(data, dict):
+        return None, "Formato de venta inválido."
+    id_venta = str(data.get("id_venta") or "").strip()
+    if not id_venta:
+        return None, "Cada venta del lote necesita su id_venta."
+    archivo_origen = str(data.get("archivo_origen") or "local.txt").strip()
+    if archivo_origen not in ORIGENES_VENTA:
+        return None, f"Origen de inventario no válido: {archivo_origen}"
+    items = data.get("items") or []
+    if not isinstance(items, list) or not items:
+        return None, "La venta debe contener al menos un producto."
+    try:
+        items = [{
+            **item,
+            "descripcion": str(item["descripcion"]).strip(),
+            "cantidad": int(item["cantidad"]),
+            "precio": float(item["precio"]),
+            "costo": float(item["costo"])
+        } for item in items]
+    except (KeyError, TypeError, ValueError):
+        return None, "Cada producto necesita descripcion, cantidad, precio y costo válidos."
+    if any(item["cantidad"] <= 0 for item in items):
+        return None, "Las cantidades deben ser mayores a cero."
+
+    # Las ventas hechas sin conexión conservan la hora en que se hicieron
+    timestamp = str(data.get("timestamp") or "").strip()
+    try:
+        datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        "id_venta": id_venta,
+        "timestamp": timestamp,
+        "items": items,
+        "archivo_origen": archivo_origen,
+        "cliente": str(data.get("cliente") or "Regular").strip(),
+        "medio_pago": str(data.get("medio_pago") or "Efectivo").strip()
+    }, None
+
+def registrar_lote_ventas(ventas_data):
+    """Registra un lote de ventas hechas sin conexión, una sola vez cada una.
+
+    El stock se descuenta con un registro por archivo para todo el lote y las filas
+    de todas las ventas aceptadas se agregan al CSV en una sola escritura. Devuelve
+    un resultado por venta, en el mismo orden, con estado "registrada", "duplicada"
+    (el id_venta ya estaba registrado), "conflicto" (stock), "invalida" o "error"
+    (no se pudo escribir el registro; el stock del lote se devuelve).
+    """
+    resultados = []
+    validas = []
+    for data in ventas_data:
+        venta, error = _normalizar_venta_lote(data)
+        if error:
+            resultados.append({"id_venta": (data.get("id_venta") if isinstance(data, dict) else None),
+                               "estado": "invalida", "mensaje": error})
+        else:
+            resultados.append({"id_venta": venta["id_venta"]})
+            validas.append((len(resultados) - 1, venta))
+
+    # El registro queda bloqueado desde la revisión de duplicados hasta la escritura,
+    # así un reintento simultáneo del mismo lote no puede registrar dos veces. Las
+    # anulaciones se bloquean a la vez (y en el orden de file_locks) porque
+    # ids_registrados las lee: tomarlas después invertiría el orden de anular()
+    with file_locks(ARCHIVO_VENTAS, libro_ventas.archivo_anulaciones):
+        ya_registrados = libro_ventas.ids_registrados(v["id_venta"] for _, v in validas)
+        vistos = set()
+        por_archivo = {}
+        for pos, venta in validas:
+            id_venta = venta["id_venta"]
+            if id_venta in ya_registrados or id_venta in vistos:
+                resultados[pos].update(estado="duplicada", mensaje="La venta ya estaba registrada.")
+                continue
+            vistos.add(id_venta)
+            por_archivo.setdefault(venta["archivo_origen"], []).append((pos, venta))
+
+        aceptadas = []
+        for archivo_origen, pendientes in por_archivo.items():
+            estados = deduct_stock_batch(archivo_origen, [v["items"] for _, v in pendientes])
+            for (pos, venta), (success, msg) in zip(pendientes, estados):
+                if success:
+                    aceptadas.append((pos, venta))
+                else:
+                    resultados[pos].update(estado="conflicto", mensaje=msg)
+
+        aceptadas.sort(key=lambda par: par[0])
+        if aceptadas:
+            try:
+                append_ventas([v for _, v in aceptadas])
+            except Exception as e:
+                # El stock ya se descontó: se devuelve para no dejarlo descuadrado
+                for archivo_origen in por_archivo:
+                    cantidades = {}
+                    for _, venta in aceptadas:
+                        if venta["archivo_origen"] == archivo_origen:
+                            for item in venta["items"]:
+                                cantidades[item["descripcion"]] = cantidades.get(item["descripcion"], 0) + item["cantidad"]
+                    if cantidades:
+                        restore_stock_batch(archivo_origen, cantidades)
+                for pos, _ in aceptadas:
+                    resultados[pos].update(estado="error", mensaje=f"Error al registrar la venta en archivo: {e}")
+                return resultados
+
+    for fecha, archivo_origen in sorted({(v["timestamp"][:10], v["archivo_origen"]) for _, v in aceptadas}):
+        publicar_caja(fecha, archivo_origen, "venta")
+    for pos, venta in aceptadas:
+        resultados[pos].update(estado="registrada", mensaje="Venta registrada con éxito.", timestamp=venta["timestamp"])
+        cliente = venta["cliente"]
+        if cliente and cliente != "Regular" and cliente != "Cliente General":
+            save_customer(cliente)
+        cola_recibos.encolar_factura(venta["id_venta"], venta["timestamp"], venta["items"], cliente, venta["medio_pago"])
+    return resultados
+
 def get_caja_filenames(local_file):
     if not local_file or local_file == "local.txt":
         return "caja_registros.csv", "movimientos_caja.csv"
@@ -499,73 +2537,268 @@ def get_conteo_filename(local_file):
         name_clean = "".join(c for c in local_file if c.isalnum() or c in "._-").replace(".txt", "")
         return f"conteo_caja_historial_{name_clean}.csv"
 
+def _monto_electronico(row):
+    """Parte no efectivo de una venta según su MedioPago (None si no se puede interpretar)."""
+    medio_pago_str = row["medio_pago"]
+    total_electronico = 0.0
+    if ":" in medio_pago_str:
+        pagos = medio_pago_str.split(", ")
+        for pago in pagos:
+            if "Efectivo" not in pago:
+                monto_str_part = pago.split("$")[-1].strip()
+                monto_limpio = re.sub(r"[^\d,.]", "", monto_str_part)
+                if not monto_limpio:
+                    continue
+                if "," in monto_limpio and ("." not in monto_limpio or monto_limpio.rfind(",") > monto_limpio.rfind(".")):
+                    monto_procesado = monto_limpio.replace(".", "").replace(",", ".")
+                else:
+                    monto_procesado = monto_limpio.replace(",", "")
+                if monto_procesado:
+                    total_electronico += float(monto_procesado)
+    else:
+        if medio_pago_str.strip() not in ["Efectivo", "N/A", ""]:
+            if row["total_venta"] is None:
+                return None
+            total_electronico += row["total_venta"]
+    return total_electronico
+
 def obtener_pagos_electronicos_del_dia(fecha_str, local_file=None):
     total_electronico = 0.0
     ventas_procesadas = set()
-    archivo_ventas = "registro_ventas.csv"
-    if not os.path.exists(archivo_ventas):
-        return 0.0
     try:
-        with open(archivo_ventas, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader, None)
-            if not header:
-                return 0.0
-            
-            estado_idx = header.index("Estado") if "Estado" in header else -1
-            medio_pago_idx = header.index("MedioPago") if "MedioPago" in header else 10
-            id_venta_idx = header.index("ID_Venta") if "ID_Venta" in header else 1
-            total_venta_idx = header.index("TotalVenta") if "TotalVenta" in header else 6
-            timestamp_idx = header.index("Timestamp") if "Timestamp" in header else 0
-            archivo_origen_idx = header.index("ArchivoOrigen") if "ArchivoOrigen" in header else -1
-
-            for row in reader:
-                if not row or len(row) <= max(timestamp_idx, id_venta_idx, medio_pago_idx):
+        filas = libro_ventas.consultar(
+            "SELECT id_venta, medio_pago, total_venta, archivo_origen FROM ventas "
+            "WHERE fecha = ? AND COALESCE(estado, '') != 'Anulada' AND id_venta IS NOT NULL "
+            "AND medio_pago IS NOT NULL ORDER BY fila",
+            (fecha_str,)
+        )
+    except Exception as e:
+        print(f"Error obteniendo pagos electrónicos: {e}")
+        return 0.0
+
+    for row in filas:
+        if local_file and row["archivo_origen"] is not None and row["archivo_origen"] != local_file:
+            continue
+        try:
+            id_venta = row["id_venta"]
+            if id_venta in ventas_procesadas:
+                continue
+            monto = _monto_electronico(row)
+            if monto is None:
+                continue
+            total_electronico += monto
+            ventas_procesadas.add(id_venta)
+        except (ValueError, IndexError, TypeError):
+            continue
+    return total_electronico
+
+class ResumenCaja:
+    """Acumulados de caja de un día y un local: registro, movimientos y ventas."""
+
+    def __init__(self, fecha, local_file):
+        self.fecha = fecha
+        self.local_file = local_file
+        self.archivo_registros, self.archivo_movimientos = get_caja_filenames(local_file)
+        # Registro de apertura/cierre
+        self.firma_registros = False
+        self.registro = None
+        # Movimientos
+        self.firma_movimientos = False
+        self.movimientos = []
+        self.total_movimientos = 0.0
+        # Ventas (se avanza por número de fila del libro de ventas)
+        self.generacion = None
+        self.ultima_fila = 0
+        self.ventas = []
+        self.total_ventas = 0.0
+        self.pagos_electronicos = 0.0
+        self.ids_electronicos = set()
+
+    # --- Registro ---
+
+    def _cargar_registro(self):
+        self.registro = None
+        if not os.path.exists(self.archivo_registros):
+            return
+        try:
+            with medir_io(), open(self.archivo_registros, "r", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    if row.get("Fecha") == self.fecha:
+                        self.registro = row
+                        break
+        except Exception as e:
+            print(f"Error leyendo {self.archivo_registros}: {e}")
+
+    # --- Movimientos ---
+
+    def _cargar_movimientos(self):
+        self.movimientos = []
+        self.total_movimientos = 0.0
+        if not os.path.exists(self.archivo_movimientos):
+            return
+        try:
+            with medir_io(), open(self.archivo_movimientos, "r", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    if row.get("Timestamp", "").startswith(self.fecha):
+                        try:
+                            self.agregar_movimiento({
+                                "timestamp": row["Timestamp"],
+                                "tipo": row["Tipo"],
+                                "descripcion": row["Descripcion"],
+                                "monto": float(row.get("Monto") or 0.0)
+                            })
+                        except ValueError:
+                            continue
+        except Exception as e:
+            print(f"Error leyendo {self.archivo_movimientos}: {e}")
+
+    def agregar_movimiento(self, movimiento):
+        self.total_movimientos += movimiento["monto"]
+        self.movimientos.append(movimiento)
+
+    # --- Ventas ---
+
+    def _cargar_ventas(self, generacion):
+        self.generacion = generacion
+        self.ultima_fila = libro_ventas.ultima_fila()
+        self.ventas = []
+        self.total_ventas = 0.0
+        self.pagos_electronicos = 0.0
+        self.ids_electronicos = set()
+        try:
+            self._agregar_filas(libro_ventas.consultar(
+                "SELECT * FROM ventas WHERE fecha = ? AND fila <= ? ORDER BY fila",
+                (self.fecha, self.ultima_fila)
+            ))
+        except Exception as e:
+            print(f"Error leyendo registro de ventas: {e}")
+
+    def _agregar_filas(self, filas):
+        """Suma filas nuevas del libro con los mismos criterios que ventas_del_dia y pagos electrónicos."""
+        for row in filas:
+            if row["fecha"] != self.fecha:
+                continue
+            if row["estado"] == "Completada" and (not self.local_file or row["archivo_origen"] == self.local_file):
+                self._agregar_venta(row)
+            if (row["estado"] or "") != "Anulada" and row["id_venta"] is not None and row["medio_pago"] is not None:
+                if self.local_file and row["archivo_origen"] is not None and row["archivo_origen"] != self.local_file:
                     continue
-                if not row[timestamp_idx].startswith(fecha_str):
+                if row["id_venta"] in self.ids_electronicos:
                     continue
-
-                if estado_idx != -1 and len(row) > estado_idx and row[estado_idx] == "Anulada":
+                try:
+                    monto = _monto_electronico(row)
+                except (ValueError, IndexError, TypeError):
                     continue
+                if monto is None:
+                    continue
+                self.pagos_electronicos += monto
+                self.ids_electronicos.add(row["id_venta"])
 
-                if local_file and archivo_origen_idx != -1 and len(row) > archivo_origen_idx and row[archivo_origen_idx] != local_file:
+    def _agregar_venta(self, row):
+        if row["total_venta"] is None:
+            return
+        self.total_ventas += row["total_venta"]
+        if row["cantidad"] is None or row["precio_unitario"] is None:
+            return
+        ts = row["timestamp"]
+        self.ventas.append({
+            "hora": ts.split(" ")[1] if " " in ts else "",
+            "id_venta": row["id_venta"] or "",
+            "descripcion": row["descripcion"] or "",
+            "cantidad": row["cantidad"],
+            "precio_unitario": row["precio_unitario"],
+            "total": row["total_venta"],
+            "medio_pago": row["medio_pago"] or "",
+            "cliente": row["cliente"] or ""
+        })
+
+    def actualizar(self):
+        """Pone al día las tres partes; solo se releen las que cambiaron."""
+        firma = CatalogoProductos.firma_archivo(self.archivo_registros)
+        if firma != self.firma_registros:
+            self.firma_registros = firma
+            self._cargar_registro()
+
+        firma = CatalogoProductos.firma_archivo(self.archivo_movimientos)
+        if firma != self.firma_movimientos:
+            self.firma_movimientos = firma
+            self._cargar_movimientos()
+
+        libro_ventas.sincronizar()
+        generacion = libro_ventas.generacion
+        if generacion != self.generacion:
+            self._cargar_ventas(generacion)
+        elif libro_ventas.ultima_fila() > self.ultima_fila:
+            # Solo las filas agregadas desde la última consulta (búsqueda por clave primaria)
+            filas = libro_ventas.consultar(
+                "SELECT * FROM ventas WHERE fila > ? ORDER BY fila", (self.ultima_fila,)
+            )
+            if filas:
+                self.ultima_fila = filas[-1]["fila"]
+            self._agregar_filas(filas)
+
+    def instantanea(self):
+        return {
+            "registro": self.registro,
+            "movimientos": list(self.movimientos),
+            "total_movimientos": self.total_movimientos,
+            "ventas": list(self.ventas),
+            "total_ventas": self.total_ventas,
+            "pagos_electronicos": self.pagos_electronicos
+        }
+
+class ResumenesCaja:
+    """Acumulados de caja por (fecha, local) que se mantienen al registrar ventas y movimientos.
+
+    /api/caja/status se responde con una búsqueda en memoria: las ventas nuevas se
+    suman leyendo solo las filas del libro posteriores a la última vista, los
+    movimientos registrados por el servidor se agregan en sitio y las anulaciones
+    recalculan únicamente el día afectado. Los cambios hechos por otras
+    herramientas se detectan por la firma de cada archivo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resumenes = {}
+
+    def obtener(self, fecha, local_file=None):
+        clave = (fecha, local_file or None)
+        with self._lock:
+            resumen = self._resumenes.get(clave)
+            if resumen is None:
+                resumen = ResumenCaja(fecha, local_file)
+                self._resumenes[clave] = resumen
+            resumen.actualizar()
+            return resumen.instantanea()
+
+    def movimiento_registrado(self, archivo_movimientos, firma_anterior, movimiento):
+        """Agrega un movimiento recién escrito a los resúmenes que estaban al día con el archivo."""
+        firma = CatalogoProductos.firma_archivo(archivo_movimientos)
+        with self._lock:
+            for resumen in self._resumenes.values():
+                if resumen.archivo_movimientos != archivo_movimientos or resumen.firma_movimientos != firma_anterior:
                     continue
+                if movimiento["timestamp"].startswith(resumen.fecha):
+                    resumen.agregar_movimiento(movimiento)
+                resumen.firma_movimientos = firma
 
-                try:
-                    id_venta = row[id_venta_idx]
-                    if id_venta in ventas_procesadas:
-                        continue
+    def venta_anulada(self, filas):
+        """Las filas anuladas ya no están en el libro: se recalculan solo los días afectados."""
+        fechas = {row["fecha"] for row in filas}
+        with self._lock:
+            for resumen in self._resumenes.values():
+                if resumen.fecha in fechas:
+                    resumen.generacion = None
 
-                    medio_pago_str = row[medio_pago_idx]
-                    if ":" in medio_pago_str:
-                        pagos = medio_pago_str.split(", ")
-                        for pago in pagos:
-                            if "Efectivo" not in pago:
-                                monto_str_part = pago.split("$")[-1].strip()
-                                monto_limpio = re.sub(r"[^\d,.]", "", monto_str_part)
-                                if not monto_limpio:
-                                    continue
-                                if "," in monto_limpio and ("." not in monto_limpio or monto_limpio.rfind(",") > monto_limpio.rfind(".")):
-                                    monto_procesado = monto_limpio.replace(".", "").replace(",", ".")
-                                else:
-                                    monto_procesado = monto_limpio.replace(",", "")
-                                if monto_procesado:
-                                    total_electronico += float(monto_procesado)
-                    else:
-                        if medio_pago_str.strip() not in ["Efectivo", "N/A", ""]:
-                            total_venta_item = float(row[total_venta_idx])
-                            total_electronico += total_venta_item
-                    ventas_procesadas.add(id_venta)
-                except (ValueError, IndexError, TypeError):
-                    continue
-        return total_electronico
-    except Exception as e:
-        print(f"Error obteniendo pagos electrónicos: {e}")
-        return 0.0
+resumenes_caja = ResumenesCaja()
+
+def publicar_caja(fecha, local_file, motivo):
+    """Avisa por /api/eventos que cambió la caja de (fecha, local) para que se vuelva a pedir."""
+    bus_eventos.publicar("caja", {"fecha": fecha, "local": local_file or "local.txt", "motivo": motivo})
 
 def get_caja_status(fecha_str, local_file=None):
-    archivo_registros, archivo_movimientos = get_caja_filenames(local_file)
-    
     # Valores por defecto si no está iniciado
     caja_data = {
         "iniciado": False,
@@ -579,115 +2812,328 @@ def get_caja_status(fecha_str, local_file=None):
         "efectivo_esperado": 0.0,
         "diferencia": 0.0
     }
+
+    resumen = resumenes_caja.obtener(fecha_str, local_file)
     
-    # 1. Buscar si hay registro de caja para esta fecha
-    if os.path.exists(archivo_registros):
+    # 1. Registro de caja para esta fecha
+    row = resumen["registro"]
+    if row is not None:
         try:
-            with open(archivo_registros, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row.get("Fecha") == fecha_str:
-                        caja_data["iniciado"] = True
-                        caja_data["dinero_inicial"] = float(row.get("DineroInicial") or 0.0)
-                        caja_data["base"] = float(row.get("Base") or 0.0)
-                        caja_data["pagos_electronicos"] = float(row.get("PagosElectronicos") or 0.0)
-                        caja_data["dinero_en_caja"] = float(row.get("DineroEnCaja") or 0.0)
-                        caja_data["total_ventas"] = float(row.get("TotalVentas") or 0.0)
-                        caja_data["total_movimientos"] = float(row.get("TotalMovimientos") or 0.0)
-                        caja_data["efectivo_esperado"] = float(row.get("EfectivoEsperado") or 0.0)
-                        caja_data["diferencia"] = float(row.get("Diferencia") or 0.0)
-                        
-                        if float(row.get("DineroEnCaja") or 0.0) > 0.0 or float(row.get("Diferencia") or 0.0) != 0.0:
-                            caja_data["cerrado"] = True
-                        break
-        except Exception as e:
-            print(f"Error leyendo {archivo_registros}: {e}")
- 
-    # 2. Obtener movimientos del día
-    movimientos = []
-    total_movimientos = 0.0
-    if os.path.exists(archivo_movimientos):
-        try:
-            with open(archivo_movimientos, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row.get("Timestamp", "").startswith(fecha_str):
-                        try:
-                            monto = float(row.get("Monto") or 0.0)
-                            total_movimientos += monto
-                            movimientos.append({
-                                "timestamp": row["Timestamp"],
-                                "tipo": row["Tipo"],
-                                "descripcion": row["Descripcion"],
-                                "monto": monto
-                            })
-                        except ValueError:
-                            continue
-        except Exception as e:
-            print(f"Error leyendo {archivo_movimientos}: {e}")
+            caja_data["iniciado"] = True
+            caja_data["dinero_inicial"] = float(row.get("DineroInicial") or 0.0)
+            caja_data["base"] = float(row.get("Base") or 0.0)
+            caja_data["pagos_electronicos"] = float(row.get("PagosElectronicos") or 0.0)
+            caja_data["dinero_en_caja"] = float(row.get("DineroEnCaja") or 0.0)
+            caja_data["total_ventas"] = float(row.get("TotalVentas") or 0.0)
+            caja_data["total_movimientos"] = float(row.get("TotalMovimientos") or 0.0)
+            caja_data["efectivo_esperado"] = float(row.get("EfectivoEsperado") or 0.0)
+            caja_data["diferencia"] = float(row.get("Diferencia") or 0.0)
             
-    # 3. Obtener ventas del día (completadas)
-    total_ventas = 0.0
-    ventas_del_dia = []
-    archivo_ventas = "registro_ventas.csv"
-    if os.path.exists(archivo_ventas):
-        try:
-            with open(archivo_ventas, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row.get("Timestamp", "").startswith(fecha_str):
-                        estado = row.get("Estado", "Completada")
-                        if estado == "Completada":
-                            if local_file and row.get("ArchivoOrigen") != local_file:
-                                continue
-                            try:
-                                total_ventas += float(row.get("TotalVenta") or 0.0)
-                                hora = row.get("Timestamp", "").split(" ")[1] if " " in row.get("Timestamp", "") else ""
-                                ventas_del_dia.append({
-                                    "hora": hora,
-                                    "id_venta": row.get("ID_Venta", ""),
-                                    "descripcion": row.get("Descripcion", ""),
-                                    "cantidad": int(row.get("Cantidad") or 0),
-                                    "precio_unitario": float(row.get("PrecioUnitario") or 0.0),
-                                    "total": float(row.get("TotalVenta") or 0.0),
-                                    "medio_pago": row.get("MedioPago", ""),
-                                    "cliente": row.get("Cliente", "")
-                                })
-                            except ValueError:
-                                continue
+            if float(row.get("DineroEnCaja") or 0.0) > 0.0 or float(row.get("Diferencia") or 0.0) != 0.0:
+                caja_data["cerrado"] = True
         except Exception as e:
-            print(f"Error leyendo registro_ventas.csv: {e}")
+            print(f"Error leyendo registro de caja: {e}")
  
+    # 2 y 3. Movimientos y ventas del día (acumulados)
+    total_ventas = resumen["total_ventas"]
+    total_movimientos = resumen["total_movimientos"]
     if caja_data["iniciado"] and not caja_data["cerrado"]:
         caja_data["total_ventas"] = total_ventas
         caja_data["total_movimientos"] = total_movimientos
-        caja_data["pagos_electronicos"] = obtener_pagos_electronicos_del_dia(fecha_str, local_file)
+        caja_data["pagos_electronicos"] = resumen["pagos_electronicos"]
         caja_data["efectivo_esperado"] = (caja_data["dinero_inicial"] + caja_data["base"] + total_ventas + total_movimientos) - caja_data["pagos_electronicos"]
         
     return {
         "status": caja_data,
-        "movimientos": movimientos,
-        "ventas": ventas_del_dia
+        "movimientos": resumen["movimientos"],
+        "ventas": resumen["ventas"]
     }
 
 
+# --- COMPRESIÓN Y ENVÍO POR PARTES ---
+
+TAM_MIN_GZIP = 1024  # Respuestas más pequeñas no compensan el costo de comprimir
+TAM_BLOQUE_STREAM = 16 * 1024
+
+def acepta_gzip(accept_encoding):
+    """True si el cliente acepta gzip (y no lo excluye con q=0)."""
+    for parte in (accept_encoding or "").split(","):
+        nombre, _, params = parte.partition(";")
+        if nombre.strip().lower() not in ("gzip", "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            clave, _, valor = param.strip().partition("=")
+            if clave == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+def comprimir_gzip(body):
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+def json_por_partes(datos, clave, elementos):
+    """Serializa `datos` con `clave` como lista final, generando la lista elemento por elemento."""
+    cabecera = json.dumps(datos)
+    prefijo = cabecera[:-1] + (", " if datos else "") + json.dumps(clave) + ": ["
+    yield prefijo.encode('utf-8')
+    # Se serializa por lotes: un json.dumps por elemento es varias veces más lento
+    primero = True
+    lote = []
+    for elemento in elementos:
+        lote.append(elemento)
+        if len(lote) >= 200:
+            parte = json.dumps(lote)[1:-1]
+            yield (parte if primero else ", " + parte).encode('utf-8')
+            primero = False
+            lote = []
+    if lote:
+        parte = json.dumps(lote)[1:-1]
+        yield (parte if primero else ", " + parte).encode('utf-8')
+    yield b"]}"
+
+def etag_coincide(if_none_match, etag):
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip() for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas or f"W/{etag}" in etiquetas
+
+# --- ARCHIVOS ESTÁTICOS ---
+
+# Páginas y recursos servidos desde la carpeta del servidor (los .txt de stock son
+# datos y se siguen sirviendo sin caché)
+TIPOS_ESTATICOS = {
+    '/ventas.html': 'text/html; charset=utf-8',
+    '/existencias.html': 'text/html; charset=utf-8',
+    '/Logo1.PNG': 'image/png',
+}
+CACHE_PAGINAS = "no-cache"  # Siempre se revalidan: si no cambiaron la respuesta es un 304 sin cuerpo
+CACHE_RECURSOS = "public, max-age=86400"
+
+class CacheEstaticos:
+    """Contenido de los archivos estáticos con su ETag y su copia gzip, hechos una sola vez.
+
+    Se vuelven a leer solo cuando cambia la firma (mtime, tamaño) del archivo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {}
+
+    def obtener(self, ruta):
+        firma = CatalogoProductos.firma_archivo(ruta)
+        if firma is None:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(ruta)
+            if entrada is not None and entrada["firma"] == firma:
+                return entrada
+
+        with medir_io(), open(ruta, "rb") as f:
+            body = f.read()
+        resumen = hashlib.sha1(body).hexdigest()
+        body_gzip = None
+        if len(body) >= TAM_MIN_GZIP and not ruta.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp")):
+            body_gzip = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(body_gzip) >= len(body):
+                body_gzip = None
+        entrada = {
+            "firma": firma,
+            "body": body,
+            "body_gzip": body_gzip,
+            "etag": f'"{resumen[:20]}"',
+            "etag_gzip": f'"{resumen[:20]}-gz"',
+            "last_modified": email.utils.formatdate(firma[0] / 1e9, usegmt=True),
+        }
+        with self._lock:
+            self._entradas[ruta] = entrada
+        return entrada
+
+cache_estaticos = CacheEstaticos()
+
+def no_modificado_desde(if_modified_since, firma):
+    """True si el archivo no cambió desde la fecha If-Modified-Since (resolución de 1 s)."""
+    try:
+        fecha = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError, IndexError):
+        return False
+    if fecha is None:
+        return False
+    return int(firma[0] // 1_000_000_000) <= int(fecha.timestamp())
+
+
 class CustomHandler(http.server.SimpleHTTPRequestHandler):
+    # Evita que un teléfono que se quedó sin señal ocupe un worker indefinidamente
+    timeout = 30
+
+    def setup(self):
+        super().setup()
+        self.wfile = SalidaContada(self.wfile)
+
+    def parse_request(self):
+        self._inicio_peticion = time.perf_counter()
+        self._estado = None
+        self.wfile.bytes = 0
+        _contexto_metricas.peticion = {"io": 0.0, "nivel": 0}
+        return super().parse_request()
+
+    def handle_one_request(self):
+        self._inicio_peticion = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._inicio_peticion is not None:
+                self._registrar_metricas()
+            _contexto_metricas.peticion = None
+
+    def _registrar_metricas(self):
+        duracion = time.perf_counter() - self._inicio_peticion
+        ctx = getattr(_contexto_metricas, "peticion", None) or {"io": 0.0}
+        path = urllib.parse.urlparse(self.path).path
+        if not (path.startswith('/api/') or path in TIPOS_ESTATICOS or path in ('/', '/local.txt', '/local_2.txt', '/bodegac.txt')):
+            path = "otros"
+        try:
+            bytes_entrada = int(self.headers.get('Content-Length') or 0) if self.headers else 0
+        except ValueError:
+            bytes_entrada = 0
+        metricas.registrar(self.command or "?", path, self._estado or 0, duracion, ctx["io"],
+                           bytes_entrada, self.wfile.bytes)
+
+    def send_response(self, code, message=None):
+        self._estado = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'cache-control':
+            self._cache_control_enviado = True
+        super().send_header(keyword, value)
+
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Admin-PIN')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Admin-PIN, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, DELETE')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        # Solo los estáticos definen su propia caché; la API y los datos nunca se guardan
+        if not getattr(self, '_cache_control_enviado', False):
+            self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        self._cache_control_enviado = False
         super().end_headers()
 
+    def send_static(self, path):
+        """Sirve una página o recurso con ETag/Last-Modified, 304 y copia gzip en caché."""
+        try:
+            entrada = cache_estaticos.obtener(path.lstrip('/'))
+        except OSError as e:
+            print(f"Error leyendo {path}: {e}")
+            entrada = None
+        if entrada is None:
+            self.send_error(404, "Archivo no encontrado")
+            return
+
+        tipo = TIPOS_ESTATICOS[path]
+        cache_control = CACHE_PAGINAS if tipo.startswith("text/html") else CACHE_RECURSOS
+
+        comprimido = entrada["body_gzip"] is not None and acepta_gzip(self.headers.get('Accept-Encoding'))
+        etag = entrada["etag_gzip"] if comprimido else entrada["etag"]
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            no_modificado = (etag_coincide(if_none_match, entrada["etag"])
+                             or etag_coincide(if_none_match, entrada["etag_gzip"]))
+        else:
+            no_modificado = no_modificado_desde(self.headers.get('If-Modified-Since'), entrada["firma"])
+
+        self.send_response(304 if no_modificado else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', entrada["last_modified"])
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        if no_modificado:
+            self.end_headers()
+            return
+        body = entrada["body_gzip"] if comprimido else entrada["body"]
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(body)))
+        if comprimido:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_OPTIONS(self):
         self.send_response(204)
         self.end_headers()
 
     def send_json(self, data, status=200):
+        self.send_json_bytes(json.dumps(data).encode('utf-8'), status)
+
+    def send_json_bytes(self, body, status=200, headers=None, body_gzip=None):
+        """Envía un JSON ya serializado; body_gzip es su versión comprimida si ya existe en caché."""
+        comprimido = False
+        if len(body) >= TAM_MIN_GZIP and acepta_gzip(self.headers.get('Accept-Encoding')):
+            body = body_gzip if body_gzip is not None else comprimir_gzip(body)
+            comprimido = True
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if comprimido:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_stream(self, partes, status=200):
+        """Envía un JSON generado por partes sin armarlo completo en memoria.
+
+        Con clientes HTTP/1.1 se usa Transfer-Encoding: chunked; con HTTP/1.0 el fin
+        de la respuesta lo marca el cierre de la conexión. Se comprime al vuelo si el
+        cliente acepta gzip.
+        """
+        chunked = self.request_version == "HTTP/1.1"
+        if chunked:
+            # Solo para esta respuesta; la conexión se cierra al terminar
+            self.protocol_version = "HTTP/1.1"
+        comprimir = acepta_gzip(self.headers.get('Accept-Encoding'))
+        self.close_connection = True
+
         self.send_response(status)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if comprimir:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+
+        compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+
+        def escribir(datos):
+            if not datos:
+                return
+            if chunked:
+                self.wfile.write(f"{len(datos):X}\r\n".encode('ascii') + datos + b"\r\n")
+            else:
+                self.wfile.write(datos)
+
+        bloque = []
+        tam = 0
+        for parte in partes:
+            bloque.append(parte)
+            tam += len(parte)
+            if tam >= TAM_BLOQUE_STREAM:
+                datos = b"".join(bloque)
+                escribir(compresor.compress(datos) if compresor else datos)
+                bloque, tam = [], 0
+        datos = b"".join(bloque)
+        if compresor:
+            datos = compresor.compress(datos) + compresor.flush()
+        escribir(datos)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
 
     def do_GET(self):
         parsed_url = urllib.parse.urlparse(self.path)
@@ -713,12 +3159,51 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             if path not in allowed_files:
                 self.send_error(403, "Acceso prohibido por políticas de seguridad")
                 return
+            if path in TIPOS_ESTATICOS:
+                self.send_static(path)
+                return
             super().do_GET()
             return
 
         # --- RUTAS DE LA API (GET) ---
         
-        if path == '/api/status':
+        if path == '/api/eventos':
+            # Last-Event-ID lo manda EventSource al reconectarse; "desde" permite lo mismo a mano
+            ultimo = self.headers.get('Last-Event-ID') or query_params.get("desde", [""])[0]
+            if bus_eventos.clientes() >= BusEventos.MAX_CLIENTES:
+                self.send_json({"error": "Demasiadas conexiones de eventos abiertas."}, 503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            self.wfile.flush()
+            self.close_connection = True
+            bus_eventos.suscribir(self.request, ultimo)
+            return
+
+        elif path == '/api/metricas':
+            formato = query_params.get("formato", [""])[0]
+            if formato == "prometheus" or (not formato and "text/plain" in (self.headers.get('Accept') or "")):
+                body = metricas.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            datos = metricas.instantanea()
+            datos["eventos_clientes"] = bus_eventos.clientes()
+            recibos = cola_recibos.estado()
+            datos["recibos"] = {
+                "pendientes": len(recibos["pendientes"]),
+                "fallidos": len(recibos["fallidos"]),
+                "completados": recibos["completados"]
+            }
+            self.send_json(datos)
+            return
+
+        elif path == '/api/status':
             self.send_json({
                 "status": "ok",
                 "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -727,44 +3212,76 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             return
 
         elif path == '/api/productos':
-            local_stock = parse_stock_file("local.txt")
-            local_2_stock = parse_stock_file("local_2.txt")
-            bodega_stock = parse_stock_file("bodegac.txt")
-            costs = parse_cost_file("dbcst.txt")
-            prices = parse_cost_file("dbacc.txt")
-            
-            all_descs = sorted(list(set(local_stock.keys()) | set(local_2_stock.keys()) | set(bodega_stock.keys()) | set(costs.keys()) | set(prices.keys())))
-            
-            productos = []
-            for desc in all_descs:
-                productos.append({
-                    "descripcion": desc,
-                    "costo": costs.get(desc, 0.0),
-                    "precio_sugerido": prices.get(desc, 0.0),
-                    "stock": {
-                        "local.txt": local_stock.get(desc, 0),
-                        "local_2.txt": local_2_stock.get(desc, 0),
-                        "bodegac.txt": bodega_stock.get(desc, 0)
-                    }
-                })
-            self.send_json({"productos": productos})
+            desde = query_params.get("since", [""])[0].strip()
+            if desde and not desde.isdigit():
+                self.send_json({"error": "El parámetro since debe ser una revisión numérica."}, 400)
+                return
+
+            etag = f'"{catalogo.revision()}"'
+            if etag_coincide(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            body_gzip = None
+            if desde:
+                revision, body = catalogo.json_cambios_desde(int(desde))
+            else:
+                revision, body, body_gzip = catalogo.json_productos_gzip()
+            self.send_json_bytes(body, headers={'ETag': f'"{revision}"'}, body_gzip=body_gzip)
+            return
+
+        elif path == '/api/existencias':
+            revision, body, body_gzip = catalogo.json_existencias()
+            etag = f'"{revision}"'
+            if etag_coincide(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_json_bytes(body, headers={'ETag': etag}, body_gzip=body_gzip)
+            return
+
+        elif path == '/api/productos/buscar':
+            q = query_params.get("q", [""])[0].strip()
+            mode = query_params.get("mode", ["keywords"])[0]
+            if mode not in MODOS_BUSQUEDA:
+                self.send_json({"error": f"Modo de búsqueda no válido. Use: {', '.join(MODOS_BUSQUEDA)}."}, 400)
+                return
+            try:
+                limite = max(1, min(500, int(query_params.get("limite", ["50"])[0])))
+            except ValueError:
+                self.send_json({"error": "El límite debe ser un número entero."}, 400)
+                return
+            if not q:
+                self.send_json({"q": q, "mode": mode, "total": 0, "productos": []})
+                return
+            total, productos = catalogo.buscar(q, mode, limite)
+            self.send_json({
+                "q": q,
+                "mode": mode,
+                "revision": catalogo.revision(),
+                "total": total,
+                "productos": productos
+            })
             return
 
         elif path == '/api/clientes':
-            clientes = []
-            archivo_clientes = "clientes.csv"
-            if os.path.exists(archivo_clientes):
-                try:
-                    with open(archivo_clientes, "r", encoding="utf-8") as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            if row.get("Nombre"):
-                                clientes.append({
-                                    "nombre": row["Nombre"].strip(),
-                                    "contacto": row.get("Contacto", "").strip()
-                                })
-                except Exception as e:
-                    print(f"Error leyendo clientes: {e}")
+            q = query_params.get("q", [""])[0].strip()
+            try:
+                if q:
+                    try:
+                        limite = max(1, min(200, int(query_params.get("limite", ["20"])[0])))
+                    except ValueError:
+                        limite = DirectorioClientes.LIMITE_BUSQUEDA
+                    clientes, total = directorio_clientes.buscar(q, limite)
+                    self.send_json({"clientes": clientes, "total": total})
+                    return
+                clientes = directorio_clientes.listar()
+            except Exception as e:
+                print(f"Error leyendo clientes: {e}")
+                clientes = []
             self.send_json({"clientes": clientes})
             return
 
@@ -775,6 +3292,10 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             self.send_json(status_data)
             return
 
+        elif path == '/api/recibos/estado':
+            self.send_json(cola_recibos.estado())
+            return
+
         elif path == '/api/reportes':
             client_pin = self.headers.get('X-Admin-PIN') or query_params.get("pin", [""])[0]
             if not verify_admin_pin(client_pin):
@@ -783,73 +3304,72 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 
             fecha_inicio = query_params.get("fecha_inicio", [datetime.now().strftime("%Y-%m-%d")])[0]
             fecha_fin = query_params.get("fecha_fin", [datetime.now().strftime("%Y-%m-%d")])[0]
+            try:
+                pagina = max(1, int(query_params.get("pagina", ["1"])[0]))
+                por_pagina = min(MAX_POR_PAGINA_REPORTES, max(1, int(query_params.get("por_pagina", [str(POR_PAGINA_REPORTES)])[0])))
+            except ValueError:
+                self.send_json({"error": "pagina y por_pagina deben ser números enteros."}, 400)
+                return
             
-            total_ventas = 0.0
-            total_ganancia = 0.0
-            sales_count = 0
-            ventas_por_local = {}
-            ventas_por_pago = {}
-            lista_ventas = []
+            resumen = {
+                "total_ventas": 0.0,
+                "total_ganancia": 0.0,
+                "sales_count": 0,
+                "por_local": {},
+                "por_medio_pago": {},
+                "por_producto": [],
+                "total_lineas": 0,
+                "num_ventas": 0
+            }
+            filas = []
             
-            archivo_ventas = "registro_ventas.csv"
-            if os.path.exists(archivo_ventas):
+            try:
+                # Totales desde los resúmenes diarios; solo la página pedida recorre filas.
+                # Se pagina por venta para no partir un ticket entre dos páginas.
+                resumen = libro_ventas.resumen_rango(fecha_inicio, fecha_fin)
+                filas = libro_ventas.ventas_rango(fecha_inicio, fecha_fin, por_pagina, (pagina - 1) * por_pagina,
+                                                  iterar=True)
+            except Exception as e:
+                print(f"Error generando reporte: {e}")
+
+            def lista_ventas():
+                # Las filas se convierten y envían a medida que salen del cursor
                 try:
-                    with open(archivo_ventas, "r", encoding="utf-8") as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            ts = row.get("Timestamp", "")
-                            if not ts:
-                                continue
-                            date_part = ts.split(" ")[0]
-                            if fecha_inicio <= date_part <= fecha_fin:
-                                estado = row.get("Estado", "Completada")
-                                try:
-                                    cant = int(row.get("Cantidad") or 0)
-                                    precio = float(row.get("PrecioUnitario") or 0.0)
-                                    total_item = float(row.get("TotalVenta") or 0.0)
-                                    ganancia_item = float(row.get("Ganancia") or 0.0)
-                                    origen = row.get("ArchivoOrigen", "Desconocido")
-                                    pago = row.get("MedioPago", "Efectivo")
-                                    
-                                    sale_obj = {
-                                        "timestamp": ts,
-                                        "id_venta": row.get("ID_Venta"),
-                                        "descripcion": row.get("Descripcion"),
-                                        "cantidad": cant,
-                                        "costo": float(row.get("CostoUnitario") or 0.0),
-                                        "precio": precio,
-                                        "total": total_item,
-                                        "ganancia": ganancia_item,
-                                        "origen": origen,
-                                        "cliente": row.get("Cliente"),
-                                        "medio_pago": pago,
-                                        "estado": estado
-                                    }
-                                    lista_ventas.append(sale_obj)
-                                    
-                                    if estado == "Completada":
-                                        total_ventas += total_item
-                                        total_ganancia += ganancia_item
-                                        sales_count += 1
-                                        
-                                        ventas_por_local[origen] = ventas_por_local.get(origen, 0.0) + total_item
-                                        ventas_por_pago[pago] = ventas_por_pago.get(pago, 0.0) + total_item
-                                except ValueError:
-                                    continue
+                    for row in filas:
+                        yield {
+                            "timestamp": row["timestamp"],
+                            "id_venta": row["id_venta"],
+                            "descripcion": row["descripcion"],
+                            "cantidad": row["cantidad"],
+                            "costo": row["costo_unitario"],
+                            "precio": row["precio_unitario"],
+                            "total": row["total_venta"],
+                            "ganancia": row["ganancia"],
+                            "origen": row["archivo_origen"] or "Desconocido",
+                            "cliente": row["cliente"],
+                            "medio_pago": row["medio_pago"] if row["medio_pago"] is not None else "Efectivo",
+                            "estado": row["estado"]
+                        }
                 except Exception as e:
                     print(f"Error generando reporte: {e}")
-                    
-            lista_ventas.reverse()
-            
-            self.send_json({
+
+            num_ventas = resumen["num_ventas"]
+            self.send_json_stream(json_por_partes({
                 "rango": {"inicio": fecha_inicio, "fin": fecha_fin},
-                "total_ventas": total_ventas,
-                "total_ganancia": total_ganancia,
-                "sales_count": sales_count,
-                "por_local": ventas_por_local,
-                "por_medio_pago": ventas_por_pago,
-                "ventas": lista_ventas
-            })
+                "total_ventas": resumen["total_ventas"],
+                "total_ganancia": resumen["total_ganancia"],
+                "sales_count": resumen["sales_count"],
+                "por_local": resumen["por_local"],
+                "por_medio_pago": resumen["por_medio_pago"],
+                "por_producto": resumen["por_producto"],
+                "paginacion": {
+                    "pagina": pagina,
+                    "por_pagina": por_pagina,
+                    "total_lineas": resumen["total_lineas"],
+                    "total_ventas": num_ventas,
+                    "total_paginas": max(1, -(-num_ventas // por_pagina))
+                }
+            }, "ventas", lista_ventas()))
             return
 
         else:
@@ -906,78 +3426,55 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_json({"error": "La venta debe contener al menos un producto."}, 400)
                 return
                 
-            allowed_sources = ["local.txt", "local_2.txt", "bodegac.txt"]
-            if archivo_origen not in allowed_sources:
+            if archivo_origen not in ORIGENES_VENTA:
                 self.send_json({"error": f"Origen de inventario no válido: {archivo_origen}"}, 400)
                 return
 
-            success, msg = deduct_stock(archivo_origen, items)
-            if not success:
-                self.send_json({"error": msg}, 400)
+            try:
+                status, respuesta, nueva = registrar_venta(id_venta, items, archivo_origen, cliente, medio_pago)
+            except Exception as e:
+                self.send_json({"error": f"Error al registrar la venta en archivo: {e}"}, 500)
                 return
 
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if not id_venta:
-                id_venta = datetime.now().strftime("%Y%m%d%H%M%S")
+            if status == 400:
+                self.send_json(respuesta, 400)
+                return
+            if not nueva:
+                # Reintento de una venta ya registrada: se repite la respuesta sin tocar nada
+                self.send_json_bytes(json.dumps(respuesta).encode('utf-8'), status,
+                                     headers={"Idempotent-Replayed": "true"})
+                return
 
-            archivo_ventas = "registro_ventas.csv"
-            if not os.path.exists(archivo_ventas):
-                try:
-                    with open(archivo_ventas, "w", encoding="utf-8", newline="") as f:
-                        writer = csv.writer(f)
-                        writer.writerow([
-                            "Timestamp", "ID_Venta", "Descripcion", "Cantidad",
-                            "CostoUnitario", "PrecioUnitario", "TotalVenta", "Ganancia",
-                            "ArchivoOrigen", "Cliente", "MedioPago", "Estado"
-                        ])
-                except Exception as e:
-                    print(f"Error creando registro_ventas: {e}")
+            if cliente and cliente != "Regular" and cliente != "Cliente General":
+                # Solo agrega el cliente si es nuevo; no borra el contacto que ya tenga
+                save_customer(cliente)
+
+            cola_recibos.encolar_factura(respuesta["id_venta"], respuesta["timestamp"], items, cliente, medio_pago)
+            self.send_json(respuesta)
+
+        elif path == '/api/ventas/lote':
+            ventas = data.get("ventas")
+            if not isinstance(ventas, list) or not ventas:
+                self.send_json({"error": "El lote debe contener al menos una venta."}, 400)
+                return
+            if len(ventas) > MAX_VENTAS_LOTE:
+                self.send_json({"error": f"El lote no puede superar {MAX_VENTAS_LOTE} ventas."}, 400)
+                return
 
             try:
-                with open(archivo_ventas, "a", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    for item in items:
-                        desc = item["descripcion"].strip()
-                        cant = int(item["cantidad"])
-                        precio = float(item["precio"])
-                        costo = float(item["costo"])
-                        total_item = cant * precio
-                        ganancia_item = total_item - (cant * costo)
-                        
-                        writer.writerow([
-                            timestamp,
-                            id_venta,
-                            desc,
-                            cant,
-                            f"{costo:.2f}",
-                            f"{precio:.2f}",
-                            f"{total_item:.2f}",
-                            f"{ganancia_item:.2f}",
-                            archivo_origen,
-                            cliente,
-                            medio_pago,
-                            "Completada"
-                        ])
-                        
-                if cliente and cliente != "Regular" and cliente != "Cliente General":
-                    save_customer(cliente, "")
-                    
-                generar_factura_txt(id_venta, timestamp, items, cliente, medio_pago)
-                
-                self.send_json({
-                    "message": "Venta registrada con éxito.",
-                    "id_venta": id_venta,
-                    "timestamp": timestamp,
-                    "ticket": {
-                        "id_venta": id_venta,
-                        "timestamp": timestamp,
-                        "cliente": cliente,
-                        "medio_pago": medio_pago,
-                        "items": items
-                    }
-                })
+                resultados = registrar_lote_ventas(ventas)
             except Exception as e:
-                self.send_json({"error": f"Error al registrar la venta en archivo: {e}"}, 500)
+                self.send_json({"error": f"Error al registrar el lote de ventas: {e}"}, 500)
+                return
+
+            conteo = {}
+            for r in resultados:
+                conteo[r["estado"]] = conteo.get(r["estado"], 0) + 1
+            self.send_json({
+                "message": f"{conteo.get('registrada', 0)} de {len(resultados)} venta(s) registradas.",
+                "resumen": conteo,
+                "resultados": resultados
+            })
 
         elif path == '/api/ventas/anular':
             client_pin = self.headers.get('X-Admin-PIN') or data.get("pin", "")
@@ -990,72 +3487,47 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_json({"error": "ID de venta requerido para anulación."}, 400)
                 return
 
-            archivo_ventas = "registro_ventas.csv"
-            if not os.path.exists(archivo_ventas):
-                self.send_json({"error": "El registro de ventas no existe."}, 400)
-                return
-
             try:
-                with open(archivo_ventas, "r", encoding="utf-8") as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None)
-                    rows = list(reader)
+                filas = libro_ventas.anular(id_venta)
+                if not filas:
+                    self.send_json({"error": "No se encontró la venta o ya fue anulada."}, 404)
+                    return
+                resumenes_caja.venta_anulada(filas)
+                for fecha, archivo_origen in sorted({(f["fecha"], f["archivo_origen"]) for f in filas}):
+                    publicar_caja(fecha, archivo_origen, "anulacion")
 
-                updated_rows = []
-                matching_found = False
-                items_restaurados = []
-                
-                timestamp_venta = ""
-                cliente_venta = "Regular"
-                medio_pago_venta = ""
                 items_venta = []
-
-                for row in rows:
-                    if not row or len(row) < 12:
-                        updated_rows.append(row)
-                        continue
-                        
-                    if row[1] == id_venta:
-                        matching_found = True
-                        desc = row[2]
-                        try:
-                            cant = int(row[3])
-                        except ValueError:
-                            cant = 0
-                        try:
-                            precio = float(row[5])
-                        except ValueError:
-                            precio = 0.0
-                        archivo_origen = row[8]
-                        timestamp_venta = row[0]
-                        cliente_venta = row[9]
-                        medio_pago_venta = row[10]
-                        
-                        items_venta.append({
-                            "descripcion": desc,
-                            "cantidad": cant,
-                            "precio": precio
-                        })
-                        
-                        success, msg = restore_stock(archivo_origen, desc, cant)
+                por_archivo = {}
+                for row in filas:
+                    desc = row["descripcion"] or ""
+                    cant = row["cantidad"] or 0
+                    archivo_origen = row["archivo_origen"] or "local.txt"
+                    items_venta.append({
+                        "descripcion": desc,
+                        "cantidad": cant,
+                        "precio": row["precio_unitario"] or 0.0
+                    })
+                    por_archivo.setdefault(archivo_origen, []).append((desc, cant))
+
+                ultima = filas[-1]
+                timestamp_venta = ultima["timestamp"]
+                cliente_venta = ultima["cliente"] or "Regular"
+                medio_pago_venta = ultima["medio_pago"] or ""
+
+                # Una sola escritura por archivo de stock, sin importar cuántos items tenga la venta
+                items_restaurados = []
+                for archivo_origen, lineas_venta in por_archivo.items():
+                    cantidades = {}
+                    for desc, cant in lineas_venta:
+                        cantidades[desc.strip()] = cantidades.get(desc.strip(), 0) + cant
+                    success, msg = restore_stock_batch(archivo_origen, cantidades)
+                    for desc, cant in lineas_venta:
                         if success:
                             items_restaurados.append(f"{desc} ({cant} unds) -> {archivo_origen}")
                         else:
                             print(f"Error restaurando stock de {desc}: {msg}")
-                    else:
-                        updated_rows.append(row)
-
-                if not matching_found:
-                    self.send_json({"error": "No se encontró la venta o ya fue anulada."}, 404)
-                    return
-
-                generar_anulacion_txt(id_venta, timestamp_venta, items_venta, cliente_venta, medio_pago_venta)
 
-                with open(archivo_ventas, "w", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    if header:
-                        writer.writerow(header)
-                    writer.writerows(updated_rows)
+                cola_recibos.encolar_anulacion(id_venta, timestamp_venta, items_venta, cliente_venta, medio_pago_venta)
 
                 self.send_json({
                     "message": "Venta anulada y stock devuelto con éxito.",
@@ -1071,6 +3543,14 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             except Exception as e:
                 self.send_json({"error": f"Error inesperado al anular la venta: {e}"}, 500)
 
+        elif path == '/api/recibos/reintentar':
+            client_pin = self.headers.get('X-Admin-PIN') or data.get("pin", "")
+            if not verify_admin_pin(client_pin):
+                self.send_json({"error": "No autorizado. PIN de administrador inválido."}, 401)
+                return
+            reintentados = cola_recibos.reintentar_fallidos()
+            self.send_json({"message": f"{reintentados} recibo(s) enviados de nuevo a la cola."})
+
         elif path == '/api/caja/iniciar':
             fecha = data.get("fecha", "").strip()
             local_file = data.get("local", "").strip() or "local.txt"
@@ -1086,36 +3566,38 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             archivo_registros, _ = get_caja_filenames(local_file)
-            if os.path.exists(archivo_registros):
-                try:
-                    with open(archivo_registros, "r", encoding="utf-8") as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            if row.get("Fecha") == fecha:
-                                self.send_json({"error": f"La caja para el día {fecha} ya ha sido iniciada."}, 400)
-                                return
-                except Exception as e:
-                    print(f"Error verificando caja existente: {e}")
+            with file_locks(archivo_registros):
+                if os.path.exists(archivo_registros):
+                    try:
+                        with open(archivo_registros, "r", encoding="utf-8") as f:
+                            reader = csv.DictReader(f)
+                            for row in reader:
+                                if row.get("Fecha") == fecha:
+                                    self.send_json({"error": f"La caja para el día {fecha} ya ha sido iniciada."}, 400)
+                                    return
+                    except Exception as e:
+                        print(f"Error verificando caja existente: {e}")
+
+                if not os.path.exists(archivo_registros):
+                    try:
+                        with open(archivo_registros, "w", encoding="utf-8", newline="") as f:
+                            writer = csv.writer(f)
+                            writer.writerow([
+                                "Fecha", "DineroInicial", "Base", "PagosElectronicos",
+                                "DineroEnCaja", "TotalVentas", "TotalMovimientos",
+                                "EfectivoEsperado", "Diferencia"
+                            ])
+                    except Exception as e:
+                        print(f"Error creando {archivo_registros}: {e}")
 
-            if not os.path.exists(archivo_registros):
                 try:
-                    with open(archivo_registros, "w", encoding="utf-8", newline="") as f:
+                    with open(archivo_registros, "a", encoding="utf-8", newline="") as f:
                         writer = csv.writer(f)
-                        writer.writerow([
-                            "Fecha", "DineroInicial", "Base", "PagosElectronicos",
-                            "DineroEnCaja", "TotalVentas", "TotalMovimientos",
-                            "EfectivoEsperado", "Diferencia"
-                        ])
+                        writer.writerow([fecha, dinero_inicial, base, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+                    publicar_caja(fecha, local_file, "iniciar")
+                    self.send_json({"message": "Día de caja iniciado correctamente."})
                 except Exception as e:
-                    print(f"Error creando {archivo_registros}: {e}")
-
-            try:
-                with open(archivo_registros, "a", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([fecha, dinero_inicial, base, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
-                self.send_json({"message": "Día de caja iniciado correctamente."})
-            except Exception as e:
-                self.send_json({"error": f"Error al iniciar caja: {e}"}, 500)
+                    self.send_json({"error": f"Error al iniciar caja: {e}"}, 500)
 
         elif path == '/api/caja/movimiento':
             tipo = data.get("tipo", "").strip()
@@ -1137,30 +3619,39 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 monto = abs(monto)
 
             _, archivo_movimientos = get_caja_filenames(local_file)
-            if not os.path.exists(archivo_movimientos):
+            with file_locks(archivo_movimientos):
+                if not os.path.exists(archivo_movimientos):
+                    try:
+                        with open(archivo_movimientos, "w", encoding="utf-8", newline="") as f:
+                            writer = csv.writer(f)
+                            writer.writerow(["Timestamp", "Tipo", "Descripcion", "Monto"])
+                    except Exception as e:
+                        print(f"Error creando {archivo_movimientos}: {e}")
+
                 try:
-                    with open(archivo_movimientos, "w", encoding="utf-8", newline="") as f:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    firma_anterior = CatalogoProductos.firma_archivo(archivo_movimientos)
+                    with open(archivo_movimientos, "a", encoding="utf-8", newline="") as f:
                         writer = csv.writer(f)
-                        writer.writerow(["Timestamp", "Tipo", "Descripcion", "Monto"])
-                except Exception as e:
-                    print(f"Error creando {archivo_movimientos}: {e}")
-
-            try:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                with open(archivo_movimientos, "a", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([timestamp, tipo, descripcion, monto])
-                self.send_json({
-                    "message": "Movimiento registrado con éxito.",
-                    "movimiento": {
+                        writer.writerow([timestamp, tipo, descripcion, monto])
+                    resumenes_caja.movimiento_registrado(archivo_movimientos, firma_anterior, {
                         "timestamp": timestamp,
                         "tipo": tipo,
                         "descripcion": descripcion,
                         "monto": monto
-                    }
-                })
-            except Exception as e:
-                self.send_json({"error": f"Error al registrar movimiento: {e}"}, 500)
+                    })
+                    publicar_caja(timestamp[:10], local_file, "movimiento")
+                    self.send_json({
+                        "message": "Movimiento registrado con éxito.",
+                        "movimiento": {
+                            "timestamp": timestamp,
+                            "tipo": tipo,
+                            "descripcion": descripcion,
+                            "monto": monto
+                        }
+                    })
+                except Exception as e:
+                    self.send_json({"error": f"Error al registrar movimiento: {e}"}, 500)
 
         elif path == '/api/caja/movimiento/eliminar':
             timestamp = data.get("timestamp", "").strip()
@@ -1170,37 +3661,39 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             _, archivo_movimientos = get_caja_filenames(local_file)
-            if not os.path.exists(archivo_movimientos):
-                self.send_json({"error": "No existen movimientos registrados."}, 400)
-                return
-
-            try:
-                with open(archivo_movimientos, "r", encoding="utf-8") as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None)
-                    rows = list(reader)
+            with file_locks(archivo_movimientos):
+                if not os.path.exists(archivo_movimientos):
+                    self.send_json({"error": "No existen movimientos registrados."}, 400)
+                    return
 
-                updated_rows = []
-                eliminado = False
-                for row in rows:
-                    if row and row[0] == timestamp:
-                        eliminado = True
-                        continue
-                    updated_rows.append(row)
+                try:
+                    with open(archivo_movimientos, "r", encoding="utf-8") as f:
+                        reader = csv.reader(f)
+                        header = next(reader, None)
+                        rows = list(reader)
+
+                    updated_rows = []
+                    eliminado = False
+                    for row in rows:
+                        if row and row[0] == timestamp:
+                            eliminado = True
+                            continue
+                        updated_rows.append(row)
 
-                if not eliminado:
-                    self.send_json({"error": "Movimiento no encontrado."}, 404)
-                    return
+                    if not eliminado:
+                        self.send_json({"error": "Movimiento no encontrado."}, 404)
+                        return
 
-                with open(archivo_movimientos, "w", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    if header:
-                        writer.writerow(header)
-                    writer.writerows(updated_rows)
+                    with abrir_atomico(archivo_movimientos, encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        if header:
+                            writer.writerow(header)
+                        writer.writerows(updated_rows)
 
-                self.send_json({"message": "Movimiento eliminado con éxito."})
-            except Exception as e:
-                self.send_json({"error": f"Error al eliminar movimiento: {e}"}, 500)
+                    publicar_caja(timestamp[:10], local_file, "movimiento")
+                    self.send_json({"message": "Movimiento eliminado con éxito."})
+                except Exception as e:
+                    self.send_json({"error": f"Error al eliminar movimiento: {e}"}, 500)
 
         elif path == '/api/caja/cerrar':
             fecha = data.get("fecha", "").strip()
@@ -1217,99 +3710,87 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             archivo_registros, archivo_movimientos = get_caja_filenames(local_file)
-            if not os.path.exists(archivo_registros):
-                self.send_json({"error": f"El archivo de registros de caja no existe para este local ({local_file})."}, 400)
-                return
-
-            try:
-                dinero_inicial = 0.0
-                base = 0.0
-                dia_encontrado = False
-
-                with open(archivo_registros, "r", encoding="utf-8") as f:
-                    reader = csv.DictReader(f)
-                    rows = list(reader)
-
-                for row in rows:
-                    if row.get("Fecha") == fecha:
-                        dinero_inicial = float(row.get("DineroInicial") or 0.0)
-                        base = float(row.get("Base") or 0.0)
-                        dia_encontrado = True
-                        break
-
-                if not dia_encontrado:
-                    self.send_json({"error": f"No se encontró un inicio de día registrado para la fecha {fecha}."}, 404)
+            with file_locks(archivo_registros):
+                if not os.path.exists(archivo_registros):
+                    self.send_json({"error": f"El archivo de registros de caja no existe para este local ({local_file})."}, 400)
                     return
 
-                total_movimientos = 0.0
-                if os.path.exists(archivo_movimientos):
-                    with open(archivo_movimientos, "r", encoding="utf-8") as f:
-                        m_reader = csv.DictReader(f)
-                        for m_row in m_reader:
-                            if m_row.get("Timestamp", "").startswith(fecha):
-                                try:
-                                    total_movimientos += float(m_row.get("Monto") or 0.0)
-                                except ValueError:
-                                    continue
-
-                total_ventas = 0.0
-                archivo_ventas = "registro_ventas.csv"
-                if os.path.exists(archivo_ventas):
-                    with open(archivo_ventas, "r", encoding="utf-8") as f:
-                        v_reader = csv.DictReader(f)
-                        for v_row in v_reader:
-                            if v_row.get("Timestamp", "").startswith(fecha):
-                                estado = v_row.get("Estado", "Completada")
-                                if estado == "Completada":
-                                    if local_file and v_row.get("ArchivoOrigen") != local_file:
-                                        continue
+                try:
+                    dinero_inicial = 0.0
+                    base = 0.0
+                    dia_encontrado = False
+
+                    with open(archivo_registros, "r", encoding="utf-8") as f:
+                        reader = csv.DictReader(f)
+                        rows = list(reader)
+
+                    for row in rows:
+                        if row.get("Fecha") == fecha:
+                            dinero_inicial = float(row.get("DineroInicial") or 0.0)
+                            base = float(row.get("Base") or 0.0)
+                            dia_encontrado = True
+                            break
+
+                    if not dia_encontrado:
+                        self.send_json({"error": f"No se encontró un inicio de día registrado para la fecha {fecha}."}, 404)
+                        return
+
+                    total_movimientos = 0.0
+                    if os.path.exists(archivo_movimientos):
+                        with open(archivo_movimientos, "r", encoding="utf-8") as f:
+                            m_reader = csv.DictReader(f)
+                            for m_row in m_reader:
+                                if m_row.get("Timestamp", "").startswith(fecha):
                                     try:
-                                        total_ventas += float(v_row.get("TotalVenta") or 0.0)
+                                        total_movimientos += float(m_row.get("Monto") or 0.0)
                                     except ValueError:
                                         continue
 
-                efectivo_esperado = (dinero_inicial + base + total_ventas + total_movimientos) - pagos_electronicos
-                diferencia = dinero_real_caja - (efectivo_esperado - base)
-
-                lineas_nuevas = []
-                with open(archivo_registros, "r", encoding="utf-8") as f:
-                    csv_reader = csv.reader(f)
-                    header = next(csv_reader, None)
-                    lineas_nuevas.append(header)
-                    for row in csv_reader:
-                        if row and row[0] == fecha:
-                            row = [
-                                fecha,
-                                f"{dinero_inicial:.2f}",
-                                f"{base:.2f}",
-                                f"{pagos_electronicos:.2f}",
-                                f"{dinero_real_caja:.2f}",
-                                f"{total_ventas:.2f}",
-                                f"{total_movimientos:.2f}",
-                                f"{efectivo_esperado:.2f}",
-                                f"{diferencia:.2f}"
-                            ]
-                        lineas_nuevas.append(row)
-
-                with open(archivo_registros, "w", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerows(lineas_nuevas)
+                    total_ventas = libro_ventas.total_ventas_dia(fecha, local_file)
 
-                self.send_json({
-                    "message": "Cierre de caja guardado con éxito.",
-                    "cuadre": {
-                        "dinero_inicial": dinero_inicial,
-                        "base": base,
-                        "total_ventas": total_ventas,
-                        "total_movimientos": total_movimientos,
-                        "pagos_electronicos": pagos_electronicos,
-                        "efectivo_esperado": efectivo_esperado,
-                        "dinero_real_caja": dinero_real_caja,
-                        "diferencia": diferencia
-                    }
-                })
-            except Exception as e:
-                self.send_json({"error": f"Error al procesar el cierre de caja: {e}"}, 500)
+                    efectivo_esperado = (dinero_inicial + base + total_ventas + total_movimientos) - pagos_electronicos
+                    diferencia = dinero_real_caja - (efectivo_esperado - base)
+
+                    lineas_nuevas = []
+                    with open(archivo_registros, "r", encoding="utf-8") as f:
+                        csv_reader = csv.reader(f)
+                        header = next(csv_reader, None)
+                        lineas_nuevas.append(header)
+                        for row in csv_reader:
+                            if row and row[0] == fecha:
+                                row = [
+                                    fecha,
+                                    f"{dinero_inicial:.2f}",
+                                    f"{base:.2f}",
+                                    f"{pagos_electronicos:.2f}",
+                                    f"{dinero_real_caja:.2f}",
+                                    f"{total_ventas:.2f}",
+                                    f"{total_movimientos:.2f}",
+                                    f"{efectivo_esperado:.2f}",
+                                    f"{diferencia:.2f}"
+                                ]
+                            lineas_nuevas.append(row)
+
+                    with abrir_atomico(archivo_registros, encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        writer.writerows(lineas_nuevas)
+
+                    publicar_caja(fecha, local_file, "cerrar")
+                    self.send_json({
+                        "message": "Cierre de caja guardado con éxito.",
+                        "cuadre": {
+                            "dinero_inicial": dinero_inicial,
+                            "base": base,
+                            "total_ventas": total_ventas,
+                            "total_movimientos": total_movimientos,
+                            "pagos_electronicos": pagos_electronicos,
+                            "efectivo_esperado": efectivo_esperado,
+                            "dinero_real_caja": dinero_real_caja,
+                            "diferencia": diferencia
+                        }
+                    })
+                except Exception as e:
+                    self.send_json({"error": f"Error al procesar el cierre de caja: {e}"}, 500)
 
         elif path == '/api/caja/conteo':
             local_file = data.get("local", "").strip() or "local.txt"
@@ -1321,22 +3802,23 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             detalle = data.get("detalle", "").strip()
             
             archivo_conteo = get_conteo_filename(local_file)
-            if not os.path.exists(archivo_conteo):
+            with file_locks(archivo_conteo):
+                if not os.path.exists(archivo_conteo):
+                    try:
+                        with open(archivo_conteo, "w", encoding="utf-8", newline="") as f:
+                            writer = csv.writer(f)
+                            writer.writerow(["Timestamp", "TotalContado", "DetalleConteo"])
+                    except Exception as e:
+                        print(f"Error creando {archivo_conteo}: {e}")
+                    
                 try:
-                    with open(archivo_conteo, "w", encoding="utf-8", newline="") as f:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    with open(archivo_conteo, "a", encoding="utf-8", newline="") as f:
                         writer = csv.writer(f)
-                        writer.writerow(["Timestamp", "TotalContado", "DetalleConteo"])
+                        writer.writerow([timestamp, total, detalle])
+                    self.send_json({"message": "Conteo de efectivo registrado con éxito."})
                 except Exception as e:
-                    print(f"Error creando {archivo_conteo}: {e}")
-                    
-            try:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                with open(archivo_conteo, "a", encoding="utf-8", newline="") as f:
-                    writer = csv.writer(f)
-                    writer.writerow([timestamp, total, detalle])
-                self.send_json({"message": "Conteo de efectivo registrado con éxito."})
-            except Exception as e:
-                self.send_json({"error": f"Error al registrar el conteo: {e}"}, 500)
+                    self.send_json({"error": f"Error al registrar el conteo: {e}"}, 500)
 
         elif path == '/api/inventario/ajustar':
             client_pin = self.headers.get('X-Admin-PIN') or data.get("pin", "")
@@ -1396,19 +3878,61 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(404, "Endpoint no encontrado")
 
 
-def run_server():
+class ServidorConcurrente(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """TCPServer que atiende cada conexión en un pool acotado de hilos.
+
+    ThreadingMixIn crea un hilo nuevo por petición sin límite; aquí se reemplaza
+    process_request para enviar el trabajo a un ThreadPoolExecutor de tamaño fijo,
+    de modo que una ráfaga de teléfonos no dispare cientos de hilos.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pos-worker")
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def shutdown_request(self, request):
+        # Las conexiones de /api/eventos siguen abiertas a cargo de bus_eventos
+        if not bus_eventos.adoptado(request):
+            super().shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+class ServidorSimple(socketserver.TCPServer):
+    """TCPServer de una petición a la vez (modo "simple")."""
+    allow_reuse_address = True
+
+    def shutdown_request(self, request):
+        if not bus_eventos.adoptado(request):
+            super().shutdown_request(request)
+
+
+def crear_servidor(server_address, modo=MODO_SERVIDOR, workers=MAX_WORKERS):
+    if modo == "simple":
+        return ServidorSimple(server_address, CustomHandler)
+    return ServidorConcurrente(server_address, CustomHandler, max_workers=workers)
+
+
+def run_server(modo=MODO_SERVIDOR, workers=MAX_WORKERS):
     global PORT
     local_ip = get_local_ip()
-    socketserver.TCPServer.allow_reuse_address = True
     
     httpd = None
     while PORT < 8100:
         try:
             server_address = ("", PORT)
-            httpd = socketserver.TCPServer(server_address, CustomHandler)
+            httpd = crear_servidor(server_address, modo, workers)
             break
         except OSError as e:
-            if e.errno == 48:  # Address already in use
+            if e.errno in (errno.EADDRINUSE, 48):  # Address already in use
                 PORT += 1
             else:
                 print(f"\n[!] Error inesperado al iniciar el servidor: {e}")
@@ -1418,6 +3942,14 @@ def run_server():
         print("[!] No se encontró ningún puerto libre en el rango 8000-8100.")
         sys.exit(1)
         
+    # Precarga del catálogo y del libro de ventas para que la primera consulta no pague la lectura
+    catalogo.verificar(forzar=True)
+    try:
+        libro_ventas.sincronizar()
+        libro_ventas.compactar()
+    except Exception as e:
+        print(f"[!] No se pudo sincronizar el libro de ventas: {e}")
+
     try:
         with httpd:
             print("=" * 70)
@@ -1432,6 +3964,10 @@ def run_server():
                 print(f"   👉 http://{local_ip}:{PORT}/ventas.html")
             else:
                 print("   [!] No se detectó IP local activa. Asegúrate de estar conectado a Wi-Fi.")
+            if modo == "simple":
+                print("⚙️  Modo simple: las peticiones se atienden una a la vez.")
+            else:
+                print(f"⚙️  Modo concurrente: hasta {workers} peticiones en paralelo.")
             print("=" * 70)
             print("Presiona Ctrl + C en esta terminal para detener el servidor.")
             print("-" * 70)
@@ -1443,4 +3979,34 @@ def run_server():
         sys.exit(0)
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Servidor de inventario y punto de venta")
+    parser.add_argument("--modo", choices=["hilos", "simple"], default=MODO_SERVIDOR,
+                        help="hilos: atiende varias peticiones en paralelo; simple: una a la vez")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="Número máximo de peticiones simultáneas en modo hilos")
+    parser.add_argument("--log-metricas", metavar="ARCHIVO",
+                        help="Guarda cada minuto las métricas de /api/metricas en un log rotativo (1 MB x 5)")
+    parser.add_argument("--importar-ventas", action="store_true",
+                        help=f"Reconstruye {libro_ventas.ruta_db} a partir de {ARCHIVO_VENTAS} y sale")
+    parser.add_argument("--compactar-ventas", action="store_true",
+                        help=f"Retira de {ARCHIVO_VENTAS} las filas de ventas anuladas y sale")
+    parser.add_argument("--exportar-ventas", metavar="ARCHIVO",
+                        help="Exporta el libro de ventas en formato CSV al archivo indicado y sale")
+    args = parser.parse_args()
+
+    if args.importar_ventas:
+        filas = libro_ventas.reimportar()
+        print(f"[i] {filas} filas importadas de {ARCHIVO_VENTAS} a {libro_ventas.ruta_db}.")
+        sys.exit(0)
+    if args.compactar_ventas:
+        filas = libro_ventas.compactar()
+        print(f"[i] {filas} filas de ventas anuladas retiradas de {ARCHIVO_VENTAS}.")
+        sys.exit(0)
+    if args.exportar_ventas:
+        libro_ventas.exportar_csv(args.exportar_ventas)
+        print(f"[i] Libro de ventas exportado a {args.exportar_ventas}.")
+        sys.exit(0)
+
+    if args.log_metricas:
+        iniciar_log_metricas(args.log_metricas)
+    run_server(args.modo, max(1, args.workers))
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+# Pruebas de escritura atómica y bloqueos de almacenamiento.py.
+# Uso: python -m pytest -q test_almacenamiento.py
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import almacenamiento
+from almacenamiento import abrir_atomico, bloqueo_archivo, obtener_bloqueo
+
+
+def test_abrir_atomico_reemplaza_el_archivo_al_terminar(tmp_path):
+    ruta = tmp_path / "local.txt"
+    ruta.write_text("    Cable Usb 5\n", encoding="utf-8")
+    os.chmod(ruta, 0o644)
+    with abrir_atomico(str(ruta)) as f:
+        f.write("    Cable Usb 4\n")
+        # Mientras se escribe, los lectores siguen viendo el archivo completo anterior
+        assert ruta.read_text(encoding="utf-8") == "    Cable Usb 5\n"
+    assert ruta.read_text(encoding="utf-8") == "    Cable Usb 4\n"
+    assert os.stat(ruta).st_mode & 0o777 == 0o644
+    assert os.listdir(tmp_path) == ["local.txt"]
+
+
+def test_abrir_atomico_conserva_el_original_si_falla_la_escritura(tmp_path):
+    ruta = tmp_path / "local.txt"
+    ruta.write_text("    Cable Usb 5\n", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        with abrir_atomico(str(ruta)) as f:
+            f.write("    Cable")
+            raise RuntimeError("corte a mitad de la escritura")
+    assert ruta.read_text(encoding="utf-8") == "    Cable Usb 5\n"
+    assert os.listdir(tmp_path) == ["local.txt"]
+
+
+def test_bloqueo_es_reentrante_en_el_mismo_hilo(tmp_path):
+    ruta = str(tmp_path / "registro_ventas.csv")
+    with bloqueo_archivo(ruta):
+        with bloqueo_archivo(ruta, str(tmp_path / "anulaciones_ventas.csv")):
+            assert obtener_bloqueo(ruta)._nivel == 2
+        assert obtener_bloqueo(ruta)._nivel == 1
+    assert obtener_bloqueo(ruta)._nivel == 0
+
+
+def test_bloqueo_excluye_a_otros_hilos(tmp_path):
+    ruta = str(tmp_path / "registro_ventas.csv")
+    eventos = []
+    def otro_hilo():
+        with bloqueo_archivo(ruta):
+            eventos.append("otro")
+
+    with bloqueo_archivo(ruta):
+        hilo = threading.Thread(target=otro_hilo)
+        hilo.start()
+        time.sleep(0.2)
+        eventos.append("dueño")
+    hilo.join(5)
+    assert eventos == ["dueño", "otro"]
+
+
+def test_bloqueo_varios_archivos_siempre_en_el_mismo_orden(tmp_path):
+    a, b = str(tmp_path / "anulaciones_ventas.csv"), str(tmp_path / "registro_ventas.csv")
+    terminados = []
+    def bloquear(*rutas):
+        for _ in range(200):
+            with bloqueo_archivo(*rutas):
+                pass
+        terminados.append(rutas)
+
+    hilos = [threading.Thread(target=bloquear, args=(a, b), daemon=True),
+             threading.Thread(target=bloquear, args=(b, a), daemon=True)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(5)
+    assert len(terminados) == 2
+
+
+@pytest.mark.skipif(almacenamiento.fcntl is None, reason="bloqueo entre procesos con fcntl")
+def test_bloqueo_excluye_a_otros_procesos(tmp_path):
+    ruta = str(tmp_path / "local.txt")
+    # Otro programa (comparador, inventario_gui) intenta bloquear sin esperar
+    intento = (
+        "import fcntl, os, sys\n"
+        "fd = os.open(sys.argv[1] + '.lock', os.O_RDWR | os.O_CREAT)\n"
+        "try:\n"
+        "    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+        "except BlockingIOError:\n"
+        "    sys.exit(1)\n"
+    )
+    with bloqueo_archivo(ruta):
+        assert subprocess.run([sys.executable, "-c", intento, ruta]).returncode == 1
+    assert subprocess.run([sys.executable, "-c", intento, ruta]).returncode == 0
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Recuperación del diario de stock (DiarioStock de servidor.py) tras ediciones
+# externas del .txt y compactaciones cortadas.
+# Uso: python -m pytest -q test_diario_stock.py
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import servidor
+
+
+@pytest.fixture
+def archivo(tmp_path):
+    ruta = tmp_path / "local.txt"
+    ruta.write_text("    Aceitera El-093 10\n    Cable Usb 5\n", encoding="utf-8")
+    return str(ruta)
+
+
+@pytest.fixture
+def diarios():
+    abiertos = []
+    def abrir(ruta):
+        diario = servidor.DiarioStock(ruta)
+        abiertos.append(diario)
+        return diario
+    yield abrir
+    for diario in abiertos:
+        if diario._timer is not None:
+            diario._timer.cancel()
+
+
+def editar_como_tk(ruta, lineas):
+    """Reescribe el .txt como lo hacen comparador / inventario_gui y cambia su firma."""
+    firma = os.stat(ruta)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.writelines(f"    {desc} {cant}\n" for desc, cant in lineas)
+    os.utime(ruta, ns=(firma.st_atime_ns, firma.st_mtime_ns + 10 ** 9))
+
+
+def cortar_compactacion(diario):
+    """Simula un corte justo después de marcar la compactación, antes de reemplazar el .txt."""
+    with open(diario.archivo_diario, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"compactando": True}) + "\n")
+
+
+def leer_cabecera(diario):
+    with open(diario.archivo_diario, "r", encoding="utf-8") as f:
+        return json.loads(f.readline())["instantanea"]
+
+
+def test_cambios_pendientes_se_conservan_tras_edicion_externa_y_corte(archivo, diarios):
+    diario = diarios(archivo)
+    diario.registrar({"Aceitera El-093": -1})
+    diario.compactar()
+    diario.registrar({"Aceitera El-093": -2})
+
+    editar_como_tk(archivo, [("Aceitera El-093", 9), ("Cable Usb", 50)])
+    diario.comprobar()
+    assert leer_cabecera(diario) == list(servidor.CatalogoProductos.firma_archivo(archivo))
+
+    cortar_compactacion(diario)
+    recuperado = diarios(archivo).vista()
+    assert recuperado == {"Aceitera El-093": 7, "Cable Usb": 50}
+
+
+def test_compactacion_cortada_despues_del_reemplazo_no_repite_cambios(archivo, diarios):
+    diario = diarios(archivo)
+    diario.registrar({"Aceitera El-093": -3})
+    cortar_compactacion(diario)
+    # El .txt ya quedó reemplazado por la instantánea, pero el diario no se vació
+    editar_como_tk(archivo, [("Aceitera El-093", 7), ("Cable Usb", 5)])
+
+    recuperado = diarios(archivo).vista()
+    assert recuperado == {"Aceitera El-093": 7, "Cable Usb": 5}
+
+
+def test_cambios_de_productos_borrados_no_los_vuelven_a_crear(archivo, diarios, capsys):
+    diario = diarios(archivo)
+    diario.registrar({"Aceitera El-093": -1, "Cable Usb": -2})
+
+    # Se renombra la aceitera y se borra el cable desde la aplicación de escritorio
+    editar_como_tk(archivo, [("Aceitera El093", 10)])
+    diario.comprobar()
+    assert diario.vista() == {"Aceitera El093": 10}
+    assert "Aceitera El-093" in capsys.readouterr().out
+
+    # Los cambios descartados tampoco vuelven al recuperar el diario
+    cortar_compactacion(diario)
+    assert diarios(archivo).vista() == {"Aceitera El093": 10}
+
+
+def test_productos_creados_por_cambios_pendientes_se_conservan(archivo, diarios):
+    diario = diarios(archivo)
+    diario.registrar({"Cargador": 4})
+    diario.registrar({"Cargador": -1})
+
+    # El .txt editado aún no incluía el producto nuevo (no se había compactado)
+    editar_como_tk(archivo, [("Aceitera El-093", 8), ("Cable Usb", 5)])
+    diario.comprobar()
+    assert diario.vista() == {"Aceitera El-093": 8, "Cable Usb": 5, "Cargador": 3}
+    assert diarios(archivo).vista() == {"Aceitera El-093": 8, "Cable Usb": 5, "Cargador": 3}
@@ -0,0 +1,115 @@
+import csv
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pytest
+
+# Pruebas de GestorInventario (sin interfaz) sobre una carpeta temporal.
+# Uso: python -m pytest -q test_inventario_gui.py
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from almacenamiento import bloqueo_archivo, obtener_bloqueo
+
+inventario_gui = pytest.importorskip("inventario_gui")
+
+CABECERA = ["Timestamp", "ID_Venta", "Descripcion", "Cantidad", "CostoUnitario", "PrecioUnitario",
+            "TotalVenta", "Ganancia", "ArchivoOrigen", "Cliente", "MedioPago", "Estado"]
+
+
+def fila(id_venta, descripcion="Cable Usb", cantidad=1):
+    return ["2026-10-01 10:00:00", id_venta, descripcion, str(cantidad), "500.00", "1000.00",
+            "1000.00", "500.00", "local.txt", "Regular", "Efectivo", "Completada"]
+
+
+@pytest.fixture
+def gestor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "local.txt").write_text("    Cable Usb 10\n    Cargador 5\n", encoding="utf-8")
+    with open(tmp_path / "registro_ventas.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CABECERA)
+        writer.writerow(fila("V1"))
+    return inventario_gui.GestorInventario("local.txt")
+
+
+def leer_ventas():
+    with open("registro_ventas.csv", "r", encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))
+
+
+def agregar_como_servidor(filas):
+    # Igual que append_ventas en servidor.py: agrega bajo el bloqueo del registro
+    with bloqueo_archivo("registro_ventas.csv"):
+        with open("registro_ventas.csv", "a", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerows(filas)
+
+
+def agregar_antes_del_bloqueo(monkeypatch):
+    """El servidor agrega una venta justo antes de que el gestor bloquee el registro.
+
+    Si el gestor leyó el registro antes de bloquearlo, esa venta se pierde al reescribirlo.
+    """
+    original = inventario_gui.bloqueo_archivo
+    pendiente = [True]
+    def bloqueo(*rutas):
+        if pendiente and "registro_ventas.csv" in rutas:
+            pendiente.clear()
+            hilo = threading.Thread(target=agregar_como_servidor, args=([fila("V-SERVIDOR")],))
+            hilo.start()
+            hilo.join(5)
+        return original(*rutas)
+    monkeypatch.setattr(inventario_gui, "bloqueo_archivo", bloqueo)
+
+
+def test_anular_venta_no_pierde_ventas_agregadas_mientras_tanto(gestor, monkeypatch):
+    agregar_antes_del_bloqueo(monkeypatch)
+    ok, msg = gestor.anular_venta("V1")
+    assert ok, msg
+    ids = [r[1] for r in leer_ventas()[1:]]
+    assert ids == ["V-SERVIDOR"]
+    assert gestor.obtener_stock_dict("local.txt")["Cable Usb"] == 11
+
+
+def test_modificar_venta_no_pierde_ventas_agregadas_mientras_tanto(gestor, monkeypatch):
+    agregar_antes_del_bloqueo(monkeypatch)
+    ok, msg = gestor.modificar_venta_completa(
+        "V1", {"desc": "Cable Usb", "cant": 1},
+        {"cliente": "Ana", "medio_pago": "Nequi", "desc": "Cable Usb", "cant": 2, "costo": 500.0, "precio": 900.0}
+    )
+    assert ok, msg
+    filas = {r[1]: r for r in leer_ventas()[1:]}
+    assert set(filas) == {"V1", "V-SERVIDOR"}
+    assert filas["V1"][3] == "2" and filas["V1"][9] == "Ana"
+
+
+def test_venta_se_agrega_al_registro_bajo_su_bloqueo(gestor, monkeypatch):
+    agregados = []
+    def abrir(ruta, modo="r", *args, **kwargs):
+        if "a" in modo and os.path.basename(ruta) == "registro_ventas.csv":
+            agregados.append(obtener_bloqueo(ruta)._nivel > 0)
+        return open(ruta, modo, *args, **kwargs)
+    monkeypatch.setattr(inventario_gui, "open", abrir, raising=False)
+    item = {"linea_num": 0, "desc": "Cable Usb", "cantidad": 2, "precio": 1000.0, "costo": 500.0}
+    ok, msg = gestor.procesar_item_venta("V2", datetime.now(), item, "Regular", "Efectivo")
+    assert ok, msg
+    assert agregados == [True]
+    assert [r[1] for r in leer_ventas()[1:]] == ["V1", "V2"]
+    assert gestor.obtener_stock_dict("local.txt")["Cable Usb"] == 8
+
+
+def test_guardar_cliente_no_pierde_clientes_del_servidor(gestor, monkeypatch):
+    original = inventario_gui.bloqueo_archivo
+    pendiente = [True]
+    def bloqueo(*rutas):
+        if pendiente and "clientes.csv" in rutas:
+            pendiente.clear()
+            # DirectorioClientes del servidor agrega bajo el bloqueo de clientes.csv
+            with original("clientes.csv"), open("clientes.csv", "a", encoding="utf-8", newline="") as f:
+                csv.writer(f).writerow(["Cliente Servidor", "300"])
+        return original(*rutas)
+    monkeypatch.setattr(inventario_gui, "bloqueo_archivo", bloqueo)
+    gestor.guardar_cliente("Ana", "311")
+    assert gestor.obtener_clientes() == {"Cliente Servidor": "300", "Ana": "311"}
@@ -0,0 +1,209 @@
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+# Pruebas del registro de ventas sobre un servidor real en una carpeta temporal.
+# Uso: python -m pytest -q test_ventas.py
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+STOCK_INICIAL = "    Aceitera El-093 10\n    Cable Usb 5\n"
+PIN = "7802"
+
+
+@pytest.fixture
+def srv(tmp_path, monkeypatch):
+    """Módulo servidor recién cargado en tmp_path, con un servidor HTTP en un puerto libre."""
+    monkeypatch.chdir(tmp_path)
+    for archivo in ("local.txt", "local_2.txt", "bodegac.txt"):
+        (tmp_path / archivo).write_text(STOCK_INICIAL, encoding="utf-8")
+    import servidor
+    modulo = importlib.reload(servidor)
+    modulo.ADMIN_PIN = PIN
+    httpd = modulo.crear_servidor(("127.0.0.1", 0), "hilos", 8)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    modulo.url_pruebas = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield modulo
+    httpd.shutdown()
+    httpd.server_close()
+    modulo.cola_recibos.esperar()
+    # Los temporizadores de compactación no deben dispararse en la carpeta de otra prueba
+    for diario in list(modulo._diarios_stock.values()):
+        if diario._timer is not None:
+            diario._timer.cancel()
+    modulo.compactar_diarios()
+    # atexit vuelve a compactar con rutas relativas, ya fuera de la carpeta temporal
+    modulo._diarios_stock.clear()
+
+
+def post(srv, ruta, datos, pin=None, timeout=10):
+    req = urllib.request.Request(
+        srv.url_pruebas + ruta,
+        data=json.dumps(datos).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    if pin:
+        req.add_header("X-Admin-PIN", pin)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode("utf-8"))
+
+
+def venta(id_venta, cantidad=1, descripcion="Aceitera El-093"):
+    return {
+        "id_venta": id_venta,
+        "cliente": "Regular",
+        "medio_pago": "Efectivo",
+        "archivo_origen": "local.txt",
+        "items": [{"descripcion": descripcion, "cantidad": cantidad, "precio": 1000, "costo": 500}]
+    }
+
+
+def stock(srv, descripcion="Aceitera El-093", archivo="local.txt"):
+    return srv.obtener_diario(archivo).vista()[descripcion]
+
+
+def test_lote_y_anulacion_simultaneos_no_se_bloquean(srv):
+    status, _ = post(srv, "/api/ventas", venta("V-ANULAR"))
+    assert status == 200
+
+    # Se agranda la ventana entre el bloqueo del registro y la lectura de anulaciones
+    original = srv.libro_ventas.ids_registrados
+    def ids_registrados_lento(ids):
+        time.sleep(0.3)
+        return original(ids)
+    srv.libro_ventas.ids_registrados = ids_registrados_lento
+
+    respuestas = {}
+    def lote():
+        respuestas["lote"] = post(srv, "/api/ventas/lote", {"ventas": [venta("V-LOTE")]})
+    def anular():
+        time.sleep(0.1)
+        respuestas["anular"] = post(srv, "/api/ventas/anular", {"id_venta": "V-ANULAR"}, pin=PIN)
+
+    hilos = [threading.Thread(target=lote, daemon=True), threading.Thread(target=anular, daemon=True)]
+    for hilo in hilos:
+        hilo.start()
+    limite = time.monotonic() + 5
+    for hilo in hilos:
+        hilo.join(max(0, limite - time.monotonic()))
+    assert not any(hilo.is_alive() for hilo in hilos), "lote y anulación quedaron bloqueados"
+
+    assert respuestas["lote"][0] == 200
+    assert respuestas["lote"][1]["resultados"][0]["estado"] == "registrada"
+    assert respuestas["anular"][0] == 200
+    assert stock(srv) == 9
+
+
+def test_venta_y_anulacion_simultaneas_no_se_bloquean(srv):
+    status, _ = post(srv, "/api/ventas", venta("V-ANULAR"))
+    assert status == 200
+
+    original = srv.libro_ventas.ids_registrados
+    def ids_registrados_lento(ids):
+        time.sleep(0.3)
+        return original(ids)
+    srv.libro_ventas.ids_registrados = ids_registrados_lento
+
+    respuestas = {}
+    def vender():
+        respuestas["venta"] = post(srv, "/api/ventas", venta("V-NUEVA"))
+    def anular():
+        time.sleep(0.1)
+        respuestas["anular"] = post(srv, "/api/ventas/anular", {"id_venta": "V-ANULAR"}, pin=PIN)
+
+    hilos = [threading.Thread(target=vender, daemon=True), threading.Thread(target=anular, daemon=True)]
+    for hilo in hilos:
+        hilo.start()
+    limite = time.monotonic() + 5
+    for hilo in hilos:
+        hilo.join(max(0, limite - time.monotonic()))
+    assert not any(hilo.is_alive() for hilo in hilos), "venta y anulación quedaron bloqueadas"
+    assert respuestas["venta"][0] == 200
+    assert respuestas["anular"][0] == 200
+    assert stock(srv) == 9
+
+
+def test_venta_que_no_llega_al_registro_devuelve_el_stock(srv, monkeypatch):
+    original = srv.append_ventas
+    def append_fallido(ventas):
+        raise OSError("disco lleno")
+    monkeypatch.setattr(srv, "append_ventas", append_fallido)
+    status, _ = post(srv, "/api/ventas", venta("V-REINTENTO", cantidad=2))
+    assert status == 500
+    assert stock(srv) == 10
+
+    # El reintento con el mismo id_venta descuenta una sola vez
+    monkeypatch.setattr(srv, "append_ventas", original)
+    status, _ = post(srv, "/api/ventas", venta("V-REINTENTO", cantidad=2))
+    assert status == 200
+    assert stock(srv) == 8
+
+
+def test_reintento_de_venta_anulada_responde_409(srv):
+    status, original = post(srv, "/api/ventas", venta("V-ANULADA"))
+    assert status == 200
+    status, repetida = post(srv, "/api/ventas", venta("V-ANULADA"))
+    assert status == 200 and repetida == original
+    assert stock(srv) == 9
+
+    status, _ = post(srv, "/api/ventas/anular", {"id_venta": "V-ANULADA"}, pin=PIN)
+    assert status == 200
+    assert stock(srv) == 10
+
+    # La respuesta sigue en la caché de idempotencia, pero la venta ya no existe
+    assert srv.idempotencia_ventas.obtener("V-ANULADA") is not None
+    status, respuesta = post(srv, "/api/ventas", venta("V-ANULADA"))
+    assert status == 409
+    assert "anulada" in respuesta["error"]
+    assert stock(srv) == 10
+
+
+def estados_lote(respuesta):
+    return [(r["id_venta"], r["estado"]) for r in respuesta["resultados"]]
+
+
+def test_lote_registra_cada_venta_una_sola_vez(srv):
+    status, respuesta = post(srv, "/api/ventas/lote", {"ventas": [venta("V-L1"), venta("V-L1"), venta("V-L2", 2)]})
+    assert status == 200
+    assert estados_lote(respuesta) == [("V-L1", "registrada"), ("V-L1", "duplicada"), ("V-L2", "registrada")]
+    assert stock(srv) == 7
+
+    # La cola sin conexión reenvía el lote completo si no recibió la respuesta
+    status, respuesta = post(srv, "/api/ventas/lote", {"ventas": [venta("V-L1"), venta("V-L2", 2), venta("V-L3")]})
+    assert status == 200
+    assert estados_lote(respuesta) == [("V-L1", "duplicada"), ("V-L2", "duplicada"), ("V-L3", "registrada")]
+    assert stock(srv) == 6
+
+
+def test_lote_reenviado_de_venta_anulada_no_la_vuelve_a_registrar(srv):
+    status, respuesta = post(srv, "/api/ventas/lote", {"ventas": [venta("V-L1", 3)]})
+    assert estados_lote(respuesta) == [("V-L1", "registrada")]
+    status, _ = post(srv, "/api/ventas/anular", {"id_venta": "V-L1"}, pin=PIN)
+    assert status == 200
+    assert stock(srv) == 10
+
+    status, respuesta = post(srv, "/api/ventas/lote", {"ventas": [venta("V-L1", 3)]})
+    assert estados_lote(respuesta) == [("V-L1", "duplicada")]
+    assert stock(srv) == 10
+
+
+def test_reintento_por_api_ventas_de_venta_del_lote_rearma_la_respuesta(srv):
+    status, _ = post(srv, "/api/ventas/lote", {"ventas": [venta("V-L1", 2)]})
+    assert status == 200
+    assert srv.idempotencia_ventas.obtener("V-L1") is None
+
+    status, respuesta = post(srv, "/api/ventas", venta("V-L1", 2))
+    assert status == 200
+    assert respuesta["id_venta"] == "V-L1"
+    assert [(i["descripcion"], i["cantidad"]) for i in respuesta["ticket"]["items"]] == [("Aceitera El-093", 2)]
+    assert stock(srv) == 8